@@ -0,0 +1,116 @@
+import os
+import json
+import struct
+import tempfile
+import usb_io
+
+# Append log layout, shared by the manifest and the thumbnail cache:
+#   header   MAGIC | header length | JSON
+#   records  length | body, appended one or more at a time with a single write and fsync
+# A crash mid-append can only leave a torn record at the end; it is ignored when
+# the log is read and cut off by the next append.
+HEADER = struct.Struct('>8sI')
+LENGTH = struct.Struct('>I')
+COMPACT_MIN_RECORDS = 64  # Small logs are never worth rewriting
+
+
+class AppendLog:
+    """A file of length-prefixed records after a JSON header, only ever appended to or atomically replaced."""
+
+    def __init__(self, path, magic):
+        self.path = path
+        self.magic = magic
+        self.records = 0  # Complete records in the file
+        self.valid_length = None  # End of the last good record; None until the log is read or written
+
+    def read_header(self):
+        """Returns the JSON header, or None if the file is missing or not a log of this kind."""
+        try:
+            with open(self.path, 'rb') as f:
+                magic, length = HEADER.unpack(f.read(HEADER.size))
+                if magic != self.magic:
+                    return None
+                return json.loads(f.read(length))
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def scan(self, peek=None):
+        """Yields (offset, length, data) for every complete record; data is its body, or only the first peek bytes.
+
+        A record only counts towards records and valid_length once the caller asks
+        for the next one, so a caller that stops at a record it cannot use has the
+        next append overwrite it.
+        """
+        with open(self.path, 'rb') as f:
+            fd = f.fileno()
+            size = os.fstat(fd).st_size
+            _, header_length = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+            offset = HEADER.size + header_length
+            self.records = 0
+            self.valid_length = offset
+            while offset + LENGTH.size <= size:
+                length, = LENGTH.unpack(os.pread(fd, LENGTH.size, offset))
+                start = offset + LENGTH.size
+                if start + length > size:
+                    break  # Torn record from a crash mid-append
+                yield start, length, os.pread(fd, length if peek is None else min(peek, length), start)
+                offset = start + length
+                self.records += 1
+                self.valid_length = offset
+
+    def read(self, offset, length):
+        """Reads part of a record, e.g. one found by scan(peek=...)."""
+        with open(self.path, 'rb') as f:
+            return os.pread(f.fileno(), length, offset)
+
+    @staticmethod
+    def _frame(bodies, start):
+        encoded = bytearray()
+        offsets = []
+        for body in bodies:
+            encoded += LENGTH.pack(len(body))
+            offsets.append(start + len(encoded))
+            encoded += body
+        return encoded, offsets
+
+    def append(self, bodies):
+        """Appends bodies as records with one write and fsync; returns the offset of each body."""
+        encoded, offsets = self._frame(bodies, self.valid_length)
+        with open(self.path, 'r+b') as f:
+            # Drop whatever a crash may have left after the last good record
+            f.truncate(self.valid_length)
+            f.seek(self.valid_length)
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        self.valid_length += len(encoded)
+        self.records += len(offsets)
+        return offsets
+
+    def write(self, header, bodies=()):
+        """Atomically replaces the whole log with header and bodies; returns the offset of each body."""
+        encoded_header = json.dumps(header, sort_keys=True).encode()
+        start = HEADER.pack(self.magic, len(encoded_header)) + encoded_header
+        encoded, offsets = self._frame(bodies, len(start))
+        directory = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(self.path) + "-",
+                                         suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(start)
+                f.write(encoded)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            usb_io.fsync_dir(directory)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.records = len(offsets)
+        self.valid_length = len(start) + len(encoded)
+        return offsets
+
+    def should_compact(self, live):
+        """Whether the log has grown to more than twice the live records it holds."""
+        return self.records > max(COMPACT_MIN_RECORDS, 2 * live)
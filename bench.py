@@ -0,0 +1,395 @@
+import os
+import io
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import container
+import cipher_engine
+import compression
+import pipeline
+import drive_manager
+import host_profile
+import usb_io
+
+MB = 1024 * 1024
+USB_CHUNKS_KB = (64, 256, 1024, 4096, 16384)  # Write/read sizes tried by the usb benchmark
+RANDOM_BLOCKS_KB = (4, 64)
+
+
+class NullSink:
+    """Write target that discards data, so benchmarks measure the crypto alone."""
+
+    def write(self, data):
+        return len(data)
+
+
+class AllocationSink:
+    """Discarding sink that adds up how much memory was allocated between writes."""
+
+    def __init__(self):
+        self.allocated = 0
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def write(self, data):
+        current, peak = tracemalloc.get_traced_memory()
+        self.allocated += max(peak - self._baseline, 0)
+        self._baseline = current
+        tracemalloc.reset_peak()
+        return len(data)
+
+
+class ThrottledSink:
+    """Discarding sink that sleeps to emulate a device with limited write bandwidth."""
+
+    def __init__(self, mb_per_s):
+        self._bytes_per_s = mb_per_s * MB
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        time.sleep(len(data) / self._bytes_per_s)
+        return len(data)
+
+
+class ThrottledSource:
+    """In-memory source that sleeps to emulate a device with limited read bandwidth."""
+
+    def __init__(self, data, mb_per_s):
+        self._stream = io.BytesIO(data)
+        self._bytes_per_s = mb_per_s * MB
+
+    def _throttle(self, count):
+        time.sleep(count / self._bytes_per_s)
+        return count
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._throttle(len(data))
+        return data
+
+    def readinto(self, buffer):
+        return self._throttle(self._stream.readinto(buffer))
+
+
+def _sample_text(size):
+    """CSV-like data that compresses roughly as well as our log exports."""
+    rows = []
+    total = 0
+    index = 0
+    while total < size:
+        row = f"{index},2024-05-{index % 28 + 1:02d},sensor-{index % 97},{(index * 7919) % 10007 / 100:.2f},OK\n"
+        rows.append(row)
+        total += len(row)
+        index += 1
+    return "".join(rows).encode()[:size]
+
+
+def _print_table(title, rows):
+    print(title)
+    for label, mb_per_s, extra in rows:
+        print(f"  {label:<32} {mb_per_s:9.1f} MB/s  {extra}")
+
+
+def bench_parallel(size_mb=256, cipher=None):
+    """Compares container encryption throughput with 1, 2, 4 and N workers."""
+    cipher = cipher or cipher_engine.preferred_cipher()
+    key = os.urandom(32)
+    data = os.urandom(MB) * size_mb
+    worker_counts = sorted({1, 2, 4, container.DEFAULT_WORKERS})
+
+    rows = []
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        container.write_container(io.BytesIO(data), NullSink(), key, cipher=cipher, workers=workers)
+        mb_per_s = size_mb / (time.perf_counter() - start)
+        baseline = baseline or mb_per_s
+        rows.append((f"{workers} worker(s)", mb_per_s, f"x{mb_per_s / baseline:.2f}"))
+    _print_table(f"Parallel encryption, {size_mb} MB, {cipher}:", rows)
+
+
+def bench_alloc(size_mb=64, cipher=None):
+    """Compares allocations per MB and MB/s with and without reused buffers."""
+    cipher = cipher or cipher_engine.preferred_cipher()
+    key = os.urandom(32)
+    data = os.urandom(MB) * size_mb
+
+    rows = []
+    with tempfile.NamedTemporaryFile() as encrypted:
+        container.write_container(io.BytesIO(data), encrypted, key, cipher=cipher, workers=1)
+        encrypted.flush()
+
+        for reuse_buffers in (False, True):
+            label = "reused buffers" if reuse_buffers else "new bytes per segment"
+
+            def encrypt(sink):
+                container.write_container(io.BytesIO(data), sink, key, cipher=cipher, workers=1,
+                                          reuse_buffers=reuse_buffers, queue_depth=0)
+
+            def decrypt(sink):
+                with container.ContainerReader(encrypted.name, key) as reader:
+                    reader.write_to(sink, workers=1, reuse_buffers=reuse_buffers, queue_depth=0)
+
+            for operation, run in (("encrypt", encrypt), ("decrypt", decrypt)):
+                start = time.perf_counter()
+                run(NullSink())
+                mb_per_s = size_mb / (time.perf_counter() - start)
+
+                tracemalloc.start()
+                sink = AllocationSink()
+                run(sink)
+                tracemalloc.stop()
+                rows.append((f"{operation}, {label}", mb_per_s,
+                             f"{sink.allocated / size_mb / 1024:9.1f} KB allocated per MB"))
+    _print_table(f"Hot loop allocations, {size_mb} MB, {cipher}:", rows)
+
+
+def bench_compression(input_path=None, size_mb=64, usb_mb_s=20.0, cipher=None):
+    """Compares effective throughput onto a bandwidth-limited device with and without compression."""
+    cipher = cipher or cipher_engine.preferred_cipher()
+    key = os.urandom(32)
+    if input_path:
+        with open(input_path, 'rb') as f:
+            data = f.read()
+    else:
+        data = _sample_text(size_mb * MB)
+    plaintext_mb = len(data) / MB
+
+    rows = []
+    for codec in (None, compression.AUTO):
+        sink = ThrottledSink(usb_mb_s)
+        start = time.perf_counter()
+        container.write_container(io.BytesIO(data), sink, key, cipher=cipher, compression_codec=codec)
+        elapsed = time.perf_counter() - start
+        label = compression.resolve(codec) or "no compression"
+        rows.append((label, plaintext_mb / elapsed, f"ratio {sink.written / max(len(data), 1):.2f}"))
+    _print_table(f"Compression, {plaintext_mb:.0f} MB onto a {usb_mb_s:g} MB/s device, {cipher}:", rows)
+
+
+def bench_pipeline(size_mb=64, read_mb_s=60.0, write_mb_s=40.0, depth=pipeline.QUEUE_DEPTH, segment_kb=1024,
+                   workers=1, cipher=None):
+    """Compares the sequential loop with the read/crypt/write pipeline between throttled devices."""
+    cipher = cipher or cipher_engine.preferred_cipher()
+    key = os.urandom(32)
+    data = os.urandom(MB) * size_mb
+    segment_size = segment_kb * 1024
+
+    rows = []
+    baselines = None
+    with tempfile.NamedTemporaryFile() as encrypted:
+        container.write_container(io.BytesIO(data), encrypted, key, segment_size, cipher=cipher)
+        encrypted.flush()
+
+        for label, queue_depth in (("sequential", 0), (f"pipelined, depth {depth}", depth)):
+            start = time.perf_counter()
+            container.write_container(ThrottledSource(data, read_mb_s), ThrottledSink(write_mb_s), key, segment_size,
+                                      cipher=cipher, workers=workers, queue_depth=queue_depth)
+            encrypt_mb_s = size_mb / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with container.ContainerReader(encrypted.name, key) as reader:
+                reader.write_to(ThrottledSink(write_mb_s), workers=workers, queue_depth=queue_depth)
+            decrypt_mb_s = size_mb / (time.perf_counter() - start)
+
+            baselines = baselines or (encrypt_mb_s, decrypt_mb_s)
+            rows.append((f"encrypt, {label}", encrypt_mb_s, f"x{encrypt_mb_s / baselines[0]:.2f}"))
+            rows.append((f"decrypt, {label}", decrypt_mb_s, f"x{decrypt_mb_s / baselines[1]:.2f}"))
+    _print_table(f"Pipeline, {size_mb} MB from a {read_mb_s:g} MB/s source to a {write_mb_s:g} MB/s device, "
+                 f"{segment_kb} KB buffers, {cipher}:", rows)
+    # Sequential time is roughly the sum of the stages; pipelined it approaches the slowest one
+    print(f"  Ideal pipelined encrypt: {min(read_mb_s, write_mb_s):.1f} MB/s")
+
+
+def _drop_cache(fd):
+    """Evicts a file from the page cache so the next read really comes from the device."""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _recommend(results):
+    """Smallest chunk that gets within 5% of the best throughput; bigger ones only cost memory."""
+    best = max(mb_per_s for _, mb_per_s in results)
+    return min(chunk_kb for chunk_kb, mb_per_s in results if mb_per_s >= 0.95 * best)
+
+
+def bench_usb(mount_point=drive_manager.MOUNT_POINT, size_mb=128, random_ops=512, save=True):
+    """Measures sequential and random throughput of the mounted partition and recommends chunk sizes.
+
+    The recommended write size is saved to the host profile, where usb_io.AlignedWriter picks it up.
+    """
+    size = max(size_mb * MB, max(USB_CHUNKS_KB) * 1024)
+    data = memoryview(os.urandom(max(USB_CHUNKS_KB) * 1024))
+    fd, path = tempfile.mkstemp(dir=drive_manager.state_dir(mount_point), prefix=".bench-")
+    rows = []
+    writes = []
+    reads = []
+    try:
+        for chunk_kb in USB_CHUNKS_KB:
+            chunk = data[:chunk_kb * 1024]
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            start = time.perf_counter()
+            for _ in range(size // len(chunk)):
+                os.write(fd, chunk)
+            os.fsync(fd)
+            writes.append((chunk_kb, size / MB / (time.perf_counter() - start)))
+
+            _drop_cache(fd)
+            buffer = bytearray(len(chunk))
+            os.lseek(fd, 0, os.SEEK_SET)
+            start = time.perf_counter()
+            while os.readv(fd, [buffer]):
+                pass
+            reads.append((chunk_kb, size / MB / (time.perf_counter() - start)))
+            rows.append((f"sequential {chunk_kb} KB write", writes[-1][1], ""))
+            rows.append((f"sequential {chunk_kb} KB read", reads[-1][1], ""))
+
+        for block_kb in RANDOM_BLOCKS_KB:
+            block = block_kb * 1024
+            offsets = [random.randrange(size // block) * block for _ in range(random_ops)]
+            buffer = bytearray(block)
+            _drop_cache(fd)
+            start = time.perf_counter()
+            for offset in offsets:
+                os.preadv(fd, [buffer], offset)
+            elapsed = time.perf_counter() - start
+            rows.append((f"random {block_kb} KB read", random_ops * block / MB / elapsed,
+                         f"{random_ops / elapsed:8.0f} IOPS"))
+
+            start = time.perf_counter()
+            for offset in offsets:
+                os.pwrite(fd, data[:block], offset)
+            os.fsync(fd)
+            elapsed = time.perf_counter() - start
+            rows.append((f"random {block_kb} KB write", random_ops * block / MB / elapsed,
+                         f"{random_ops / elapsed:8.0f} IOPS"))
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+    _print_table(f"USB partition at {mount_point}, {size / MB:.0f} MB test file:", rows)
+    write_kb = _recommend(writes)
+    read_kb = _recommend(reads)
+    print(f"  Recommended write size: {write_kb} KB, read size: {read_kb} KB")
+    if save:
+        host_profile.store(usb_io.PROFILE_SECTION,
+                           dict(host_profile.load(usb_io.PROFILE_SECTION) or {}, write_chunk=write_kb * 1024))
+        print("  Saved the write size; imports onto the drive use it from now on.")
+
+
+def _make_tree(root, files, size_kb, fanout=20):
+    """Writes files random files of about size_kb KB into a folder tree fanout wide and two levels deep."""
+    for i in range(files):
+        folder = os.path.join(root, f"dir{i % fanout:02d}", f"sub{i // fanout % fanout:02d}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file{i:05d}.bin"), 'wb') as f:
+            f.write(os.urandom(random.randint(size_kb * 512, size_kb * 1536)))
+
+
+def bench_tree(files=10000, size_kb=16, workers=drive_manager.TREE_WORKERS, directory=None,
+               fsync_policy=None):
+    """Times importing a folder tree onto a drive directory and exporting it back, serial and in parallel.
+
+    directory is where the tree and the stand-in drive are created; pass a folder on
+    the USB stick to include its latency, by default it goes to the temp directory.
+    """
+    password = "bench-password"
+    if fsync_policy:
+        drive_manager.set_fsync_policy(fsync_policy)
+    rows = []
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        source = os.path.join(scratch, "source")
+        _make_tree(source, files, size_kb)
+        total_mb = sum(entry.stat().st_size for _, entry in drive_manager.scan_tree(source)) / MB
+        for count in sorted({1, workers}):
+            drive = os.path.join(scratch, f"drive{count}")
+            exported = os.path.join(scratch, f"exported{count}")
+            os.makedirs(drive)
+            start = time.perf_counter()
+            results = drive_manager.import_tree(source, os.path.join(drive, "tree"), password, drive, workers=count)
+            import_s = time.perf_counter() - start
+            start = time.perf_counter()
+            results += drive_manager.export_tree(os.path.join(drive, "tree"), exported, password, drive,
+                                                 workers=count)
+            export_s = time.perf_counter() - start
+            failed = sum(error is not None for _, _, error in results)
+            if failed:
+                print(f"[WARN] {failed} files failed with {count} worker(s)")
+            for label, elapsed in (("import", import_s), ("export", export_s)):
+                rows.append((f"{label}, {count} worker(s)", total_mb / elapsed, f"{files / elapsed:8.0f} files/s"))
+        # The exported tree must match the original file for file
+        for relative, entry in drive_manager.scan_tree(source):
+            with open(entry.path, 'rb') as original, open(os.path.join(exported, relative), 'rb') as copy:
+                if original.read() != copy.read():
+                    raise RuntimeError(f"{relative} did not round-trip")
+    _print_table(f"Folder tree, {files} files of ~{size_kb} KB ({total_mb:.0f} MB), "
+                 f"fsync policy {drive_manager.sync_policy.policy}:", rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SecureUsb throughput benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parallel = subparsers.add_parser("parallel", help="encryption throughput by worker count")
+    parallel.add_argument("--size-mb", type=int, default=256)
+    parallel.add_argument("--cipher", choices=sorted(cipher_engine.ENGINES))
+
+    alloc = subparsers.add_parser("alloc", help="allocations per MB with and without reused buffers")
+    alloc.add_argument("--size-mb", type=int, default=64)
+    alloc.add_argument("--cipher", choices=sorted(cipher_engine.ENGINES))
+
+    compress = subparsers.add_parser("compression", help="effective throughput with compression")
+    compress.add_argument("--input", help="file to use instead of generated CSV-like data")
+    compress.add_argument("--size-mb", type=int, default=64)
+    compress.add_argument("--usb-mb-s", type=float, default=20.0)
+    compress.add_argument("--cipher", choices=sorted(cipher_engine.ENGINES))
+
+    pipelined = subparsers.add_parser("pipeline", help="overlap gain of the read/crypt/write pipeline")
+    pipelined.add_argument("--size-mb", type=int, default=64)
+    pipelined.add_argument("--read-mb-s", type=float, default=60.0, help="emulated source bandwidth")
+    pipelined.add_argument("--write-mb-s", type=float, default=40.0, help="emulated target bandwidth")
+    pipelined.add_argument("--depth", type=int, default=pipeline.QUEUE_DEPTH, help="segments in flight")
+    pipelined.add_argument("--segment-kb", type=int, default=1024, help="buffer (segment) size")
+    pipelined.add_argument("--workers", type=int, default=1)
+    pipelined.add_argument("--cipher", choices=sorted(cipher_engine.ENGINES))
+
+    usb = subparsers.add_parser("usb", help="sequential and random throughput of the mounted partition")
+    usb.add_argument("--mount-point", default=drive_manager.MOUNT_POINT)
+    usb.add_argument("--size-mb", type=int, default=128, help="size of the test file written to the drive")
+    usb.add_argument("--random-ops", type=int, default=512)
+    usb.add_argument("--no-save", action="store_true", help="only print the recommendation")
+    usb.add_argument("--fsync", choices=usb_io.FSYNC_POLICIES,
+                     help="also save when imports are flushed to the stick on this host")
+
+    tree = subparsers.add_parser("tree", help="folder import/export of many small files")
+    tree.add_argument("--files", type=int, default=10000)
+    tree.add_argument("--size-kb", type=int, default=16, help="average file size")
+    tree.add_argument("--workers", type=int, default=drive_manager.TREE_WORKERS)
+    tree.add_argument("--directory", help="where to build the tree and the stand-in drive (default: temp)")
+    tree.add_argument("--fsync", choices=usb_io.FSYNC_POLICIES, help="default: the host's policy")
+
+    args = parser.parse_args(argv)
+    if args.benchmark == "parallel":
+        bench_parallel(args.size_mb, args.cipher)
+    elif args.benchmark == "alloc":
+        bench_alloc(args.size_mb, args.cipher)
+    elif args.benchmark == "compression":
+        bench_compression(args.input, args.size_mb, args.usb_mb_s, args.cipher)
+    elif args.benchmark == "pipeline":
+        bench_pipeline(args.size_mb, args.read_mb_s, args.write_mb_s, args.depth, args.segment_kb, args.workers,
+                       args.cipher)
+    elif args.benchmark == "usb":
+        bench_usb(args.mount_point, args.size_mb, args.random_ops, not args.no_save)
+        if args.fsync:
+            usb_io.store_fsync_policy(args.fsync)
+            print(f"  Saved the fsync policy: {args.fsync}")
+    elif args.benchmark == "tree":
+        bench_tree(args.files, args.size_kb, args.workers, args.directory, args.fsync)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import os
+import hmac
+import time
+import struct
+import hashlib
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import host_profile
+
+AES_GCM = "aes-256-gcm"
+AES_CTR_HMAC = "aes-256-ctr-hmac-sha256"
+CHACHA20_POLY1305 = "chacha20-poly1305"
+DEFAULT_CIPHER = AES_GCM
+BENCHMARK_SIZE = 4 * 1024 * 1024
+BENCHMARK_ROUNDS = 3
+BENCHMARK_SECTION = "cipher"
+
+
+# Engines expose seal/open, which return new bytes, and seal_into/open_into, which
+# write into a caller-provided buffer of at least len(data) + OUTPUT_SLACK bytes and
+# return the number of bytes written, so hot loops can reuse their buffers.
+OUTPUT_SLACK = 32
+
+
+class AESGCMEngine:
+    """AES-256-GCM, the fastest choice on CPUs with AES instructions."""
+    name = AES_GCM
+    nonce_size = 12
+    tag_size = 16
+
+    def __init__(self, key):
+        self._key = key
+        self._aead = AESGCM(key)
+
+    def seal(self, nonce, data, aad):
+        return self._aead.encrypt(nonce, data, aad)
+
+    def open(self, nonce, sealed, aad):
+        return self._aead.decrypt(nonce, sealed, aad)
+
+    def seal_into(self, nonce, data, aad, out):
+        encryptor = Cipher(algorithms.AES(self._key), modes.GCM(nonce), backend=default_backend()).encryptor()
+        encryptor.authenticate_additional_data(aad)
+        length = encryptor.update_into(data, out)
+        encryptor.finalize()
+        out[length:length + self.tag_size] = encryptor.tag
+        return length + self.tag_size
+
+    def open_into(self, nonce, sealed, aad, out):
+        if len(sealed) < self.tag_size:
+            raise InvalidTag()
+        tag = bytes(sealed[-self.tag_size:])
+        decryptor = Cipher(algorithms.AES(self._key), modes.GCM(nonce, tag), backend=default_backend()).decryptor()
+        decryptor.authenticate_additional_data(aad)
+        length = decryptor.update_into(sealed[:-self.tag_size], out)
+        decryptor.finalize()
+        return length
+
+
+class ChaCha20Poly1305Engine:
+    """ChaCha20-Poly1305, faster than AES on CPUs without AES instructions."""
+    name = CHACHA20_POLY1305
+    nonce_size = 12
+    tag_size = 16
+
+    def __init__(self, key):
+        self._aead = ChaCha20Poly1305(key)
+
+    def seal(self, nonce, data, aad):
+        return self._aead.encrypt(nonce, data, aad)
+
+    def open(self, nonce, sealed, aad):
+        return self._aead.decrypt(nonce, sealed, aad)
+
+    # cryptography has no incremental ChaCha20-Poly1305 API, so these still copy once
+    def seal_into(self, nonce, data, aad, out):
+        sealed = self._aead.encrypt(nonce, data, aad)
+        out[:len(sealed)] = sealed
+        return len(sealed)
+
+    def open_into(self, nonce, sealed, aad, out):
+        data = self._aead.decrypt(nonce, sealed, aad)
+        out[:len(data)] = data
+        return len(data)
+
+
+class AESCTRHMACEngine:
+    """AES-256-CTR with an encrypt-then-MAC HMAC-SHA256 tag truncated to 16 bytes."""
+    name = AES_CTR_HMAC
+    nonce_size = 16
+    tag_size = 16
+
+    def __init__(self, key):
+        subkeys = HKDF(algorithm=hashes.SHA256(), length=64, salt=None, info=b"secureusb ctr-hmac",
+                       backend=default_backend()).derive(key)
+        self._enc_key = subkeys[:32]
+        self._mac_key = subkeys[32:]
+
+    def _tag(self, nonce, ciphertext, aad):
+        mac = hmac.new(self._mac_key, struct.pack('>Q', len(aad)), hashlib.sha256)
+        mac.update(aad)
+        mac.update(nonce)
+        mac.update(ciphertext)
+        return mac.digest()[:self.tag_size]
+
+    def _context(self, nonce):
+        return Cipher(algorithms.AES(self._enc_key), modes.CTR(nonce), backend=default_backend()).encryptor()
+
+    def _crypt(self, nonce, data):
+        context = self._context(nonce)
+        return context.update(data) + context.finalize()
+
+    def seal(self, nonce, data, aad):
+        ciphertext = self._crypt(nonce, data)
+        return ciphertext + self._tag(nonce, ciphertext, aad)
+
+    def open(self, nonce, sealed, aad):
+        if len(sealed) < self.tag_size:
+            raise InvalidTag()
+        ciphertext, tag = sealed[:-self.tag_size], sealed[-self.tag_size:]
+        if not hmac.compare_digest(tag, self._tag(nonce, ciphertext, aad)):
+            raise InvalidTag()
+        return self._crypt(nonce, ciphertext)
+
+    def seal_into(self, nonce, data, aad, out):
+        context = self._context(nonce)
+        length = context.update_into(data, out)
+        context.finalize()
+        out[length:length + self.tag_size] = self._tag(nonce, out[:length], aad)
+        return length + self.tag_size
+
+    def open_into(self, nonce, sealed, aad, out):
+        if len(sealed) < self.tag_size:
+            raise InvalidTag()
+        ciphertext, tag = sealed[:-self.tag_size], sealed[-self.tag_size:]
+        if not hmac.compare_digest(tag, self._tag(nonce, ciphertext, aad)):
+            raise InvalidTag()
+        context = self._context(nonce)
+        length = context.update_into(ciphertext, out)
+        context.finalize()
+        return length
+
+
+ENGINES = {engine.name: engine for engine in (AESGCMEngine, ChaCha20Poly1305Engine, AESCTRHMACEngine)}
+
+
+def get_engine(name, key):
+    """Returns an engine instance for the cipher recorded in a file header."""
+    if name not in ENGINES:
+        raise ValueError(f"Unsupported cipher {name}")
+    return ENGINES[name](key)
+
+
+def benchmark(size=BENCHMARK_SIZE):
+    """Measures seal throughput in MB/s for every cipher this host supports."""
+    key = os.urandom(32)
+    data = os.urandom(size)
+    results = {}
+    for name, engine_class in ENGINES.items():
+        try:
+            engine = engine_class(key)
+            nonce = os.urandom(engine.nonce_size)
+            engine.seal(nonce, data[:4096], b"")  # Warm up
+            elapsed = float("inf")
+            for _ in range(BENCHMARK_ROUNDS):
+                start = time.perf_counter()
+                engine.seal(nonce, data, b"")
+                elapsed = min(elapsed, time.perf_counter() - start)
+        except Exception as e:  # e.g. ChaCha20-Poly1305 missing from the OpenSSL build
+            print(f"[WARN] Skipping {name} in cipher benchmark: {e}")
+            continue
+        results[name] = size / max(elapsed, 1e-9) / (1024 * 1024)
+    return results
+
+
+def preferred_cipher():
+    """Returns the fastest authenticated cipher for this host, benchmarking only the first time."""
+    cached = host_profile.load(BENCHMARK_SECTION)
+    if cached and cached.get("fastest") in ENGINES:
+        return cached["fastest"]
+    results = benchmark()
+    fastest = max(results, key=results.get) if results else DEFAULT_CIPHER
+    host_profile.store(BENCHMARK_SECTION, {"fastest": fastest, "mb_per_s": results})
+    return fastest
@@ -0,0 +1,84 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+ZLIB = "zlib"
+ZSTD = "zstd"
+LZ4 = "lz4"
+AUTO = "auto"  # Use the best codec installed on this host
+
+SAMPLE_SIZE = 16 * 1024
+SAMPLE_RATIO = 0.9  # A sample must shrink below 90% for its segment to be compressed
+ZLIB_LEVEL = 1  # USB bandwidth is the bottleneck, not ratio, so favour speed
+ZSTD_LEVEL = 3
+
+# Every compressed-mode segment starts with one of these flags
+RAW = b'\0'
+COMPRESSED = b'\1'
+
+
+def _zstd_decompress(data, max_length):
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_length)
+
+
+def _zlib_decompress(data, max_length):
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, max_length)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Decompressed segment is larger than expected")
+    return result
+
+
+CODECS = {ZLIB: (lambda data: zlib.compress(data, ZLIB_LEVEL), _zlib_decompress)}
+if zstandard is not None:
+    CODECS[ZSTD] = (lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data), _zstd_decompress)
+if lz4 is not None:
+    CODECS[LZ4] = (lz4.frame.compress, lambda data, max_length: lz4.frame.decompress(data))
+
+
+def resolve(codec):
+    """Turns AUTO into the best installed codec and checks that the codec is available."""
+    if codec == AUTO:
+        for name in (ZSTD, LZ4, ZLIB):
+            if name in CODECS:
+                return name
+    if codec is not None and codec not in CODECS:
+        raise ValueError(f"Compression codec {codec} is not installed")
+    return codec
+
+
+def pack(codec, data):
+    """Returns the flag-prefixed payload for one segment, compressing it only if that pays off.
+
+    A sample from the middle of the segment is compressed first, so data that is
+    already compressed (JPEG, MP4, archives) costs one small trial instead of a
+    full compression pass.
+    """
+    compress = CODECS[codec][0]
+    if len(data) > SAMPLE_SIZE:
+        middle = (len(data) - SAMPLE_SIZE) // 2
+        sample = data[middle:middle + SAMPLE_SIZE]
+        if len(compress(sample)) >= len(sample) * SAMPLE_RATIO:
+            return RAW + data
+    compressed = compress(data)
+    if len(compressed) >= len(data):
+        return RAW + data
+    return COMPRESSED + compressed
+
+
+def unpack(codec, payload, expected_length):
+    """Reverses pack(), refusing to expand past the segment's known plaintext length."""
+    flag, data = payload[:1], payload[1:]
+    if flag == RAW:
+        return bytes(data)
+    if flag != COMPRESSED:
+        raise ValueError("Unknown segment compression flag")
+    return CODECS[codec][1](bytes(data), expected_length)
@@ -0,0 +1,530 @@
+import os
+import json
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
+import cipher_engine
+import compression
+import pipeline
+import usb_io
+
+# Container layout (version 1):
+#   prelude   MAGIC | version | header slot size, NUL padded to one slot
+#   header    two slots of sequence | CRC32 | JSON describing the file (cipher, KDF, compression, ...),
+#             NUL padded; the valid slot with the highest sequence wins and a rewrite goes to the
+#             other one, so a torn header write never loses the only copy of the wrapped data key
+#   segments  nonce | ciphertext | tag, one per SEGMENT_SIZE bytes of plaintext
+#             (with compression the encrypted payload is a flag byte plus the possibly compressed data)
+#   table     (offset, stored length) for every segment
+#   footer    table offset | segment count | plaintext size | FOOTER_MAGIC
+MAGIC = b'SUSB'
+FOOTER_MAGIC = b'SUSB-END'
+VERSION = 1
+SEGMENT_SIZE = 1024 * 1024
+HEADER_SIZE = 4096  # One header slot; slots are sector aligned so writing one never touches the other
+HEADER_SLOTS = 2
+DATA_OFFSET = (1 + HEADER_SLOTS) * HEADER_SIZE  # Where the first segment starts
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+PRELUDE = struct.Struct('>4sBI')
+SLOT = struct.Struct('>QI')
+ENTRY = struct.Struct('>QI')
+FOOTER = struct.Struct('>QQQ8s')
+
+
+class ContainerError(Exception):
+    """Raised when a container is malformed or fails authentication."""
+
+
+class WrongKeyError(ContainerError):
+    """Raised when a password does not unwrap a container's data key."""
+
+
+def is_container(path):
+    """Returns True if the file at path uses the segmented container format."""
+    with open(path, 'rb') as f:
+        prelude = f.read(PRELUDE.size)
+        if len(prelude) < PRELUDE.size or not prelude.startswith(MAGIC):
+            return False
+        f.seek(0, os.SEEK_END)
+        if f.tell() < PRELUDE.size + FOOTER.size:
+            return False
+        f.seek(-FOOTER.size, os.SEEK_END)
+        return f.read(FOOTER.size).endswith(FOOTER_MAGIC)
+
+
+def is_complete(path):
+    """Whether a container was written to the end: its footer and segment table are consistent."""
+    if not is_container(path):
+        return False
+    with open(path, 'rb') as f:
+        f.seek(-FOOTER.size, os.SEEK_END)
+        file_size = f.tell() + FOOTER.size
+        table_offset, count, _, _ = FOOTER.unpack(f.read(FOOTER.size))
+    return count > 0 and table_offset + count * ENTRY.size + FOOTER.size == file_size
+
+
+def _segment_aad(file_id, index, last):
+    """Binds a segment to its file, position and end-of-file flag."""
+    return file_id + struct.pack('>Q?', index, last)
+
+
+def _encode_header(header, sequence, size=HEADER_SIZE):
+    """Encodes header as a checksummed slot carrying sequence, NUL padded to size."""
+    encoded = json.dumps(header, sort_keys=True).encode()
+    encoded = SLOT.pack(sequence, zlib.crc32(encoded)) + encoded
+    if len(encoded) > size:
+        raise ContainerError("Container header is too large")
+    return encoded.ljust(size, b'\0')
+
+
+def _decode_slot(slot):
+    """Returns (sequence, header) of a slot, or None if it is empty or torn."""
+    sequence, checksum = SLOT.unpack_from(slot)
+    encoded = slot[SLOT.size:].rstrip(b'\0')
+    if not sequence or zlib.crc32(encoded) != checksum:
+        return None
+    try:
+        return sequence, json.loads(encoded)
+    except ValueError:
+        return None
+
+
+def _read_slots(fd):
+    """Returns (header size, [(sequence, header, slot offset), ...]) of a container.
+
+    The list holds the valid slots, newest first.
+    """
+    prelude = os.pread(fd, PRELUDE.size, 0)
+    if len(prelude) < PRELUDE.size or not prelude.startswith(MAGIC):
+        raise ContainerError("Not a SecureUsb container")
+    _, version, header_size = PRELUDE.unpack(prelude)
+    if version != VERSION:
+        raise ContainerError(f"Unsupported container version {version}")
+    slots = []
+    for index in range(HEADER_SLOTS):
+        offset = (1 + index) * header_size
+        decoded = _decode_slot(os.pread(fd, header_size, offset))
+        if decoded is not None:
+            slots.append(decoded + (offset,))
+    if not slots:
+        raise ContainerError("Container header is damaged")
+    slots.sort(key=lambda slot: slot[0], reverse=True)
+    return header_size, slots
+
+
+def write_header(dst, header):
+    """Writes the prelude and the header slots, the first one holding header."""
+    dst.write(PRELUDE.pack(MAGIC, VERSION, HEADER_SIZE).ljust(HEADER_SIZE, b'\0'))
+    dst.write(_encode_header(header, 1))
+    dst.write(bytes(HEADER_SIZE * (HEADER_SLOTS - 1)))
+
+
+def rewrite_header(path, header):
+    """Replaces the JSON header of an existing container, leaving every segment untouched.
+
+    The new header goes to the slot not holding the current one and is fsynced
+    before it can win, so an interruption at any point leaves either the old or
+    the new header readable. This is a single small write however large the file is.
+    """
+    fd = os.open(path, os.O_RDWR)
+    try:
+        header_size, slots = _read_slots(fd)
+        sequence, _, current = slots[0]
+        target = header_size if current != header_size else 2 * header_size
+        os.pwrite(fd, _encode_header(header, sequence + 1, header_size), target)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_header(path, require_footer=True):
+    """Returns the current JSON header of a container, or None for any other file.
+
+    With require_footer=False it also reads the header of a container that is
+    still being written (or was interrupted).
+    """
+    if require_footer and not is_container(path):
+        return None
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        _, slots = _read_slots(fd)
+    except ContainerError:
+        if not require_footer:
+            return None
+        raise
+    finally:
+        os.close(fd)
+    return slots[0][1]
+
+
+def storage_stats(path):
+    """Returns plaintext size, stored size and compression ratio of a container without decrypting it."""
+    with open(path, 'rb') as f:
+        _, _, header_size = PRELUDE.unpack(f.read(PRELUDE.size))
+        f.seek(-FOOTER.size, os.SEEK_END)
+        table_offset, count, size, _ = FOOTER.unpack(f.read(FOOTER.size))
+    stored = table_offset - (1 + HEADER_SLOTS) * header_size
+    return {"plaintext_bytes": size, "stored_bytes": stored, "segments": count,
+            "ratio": stored / size if size else 1.0}
+
+
+def ordered_map(func, items, workers):
+    """Like map(), but runs func on a thread pool with a bounded number of items in flight.
+
+    The crypto primitives release the GIL, so segments really are processed in
+    parallel, while results still come back in input order.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _read_segments(src, segment_size, first_index=0):
+    """Yields (index, chunk, last) for every segment of src.
+
+    There is always at least one (possibly empty) segment flagged as the last one,
+    so truncating a container can never produce a valid shorter file.
+    """
+    index = first_index
+    chunk = src.read(segment_size)
+    while True:
+        next_chunk = src.read(segment_size) if len(chunk) == segment_size else b''
+        last = not next_chunk
+        yield index, chunk, last
+        if last:
+            return
+        index += 1
+        chunk = next_chunk
+
+
+def readinto_full(src, view):
+    """Fills view from src, retrying short reads; returns the number of bytes read."""
+    total = 0
+    while total < len(view):
+        count = src.readinto(view[total:])
+        if not count:
+            break
+        total += count
+    return total
+
+
+def _seal_reusing_buffers(src, engine, file_id, segment_size, codec, first_index=0):
+    """Sequential sealing loop that allocates its buffers once and never per segment.
+
+    Yields (nonce, sealed view, plaintext length, last); the view is only valid until
+    the next iteration, so callers must write it out straight away. Compression
+    necessarily builds a new payload per segment, but the output buffer is still reused.
+    """
+    current = memoryview(bytearray(segment_size))
+    upcoming = memoryview(bytearray(segment_size))
+    out = memoryview(bytearray(segment_size + 1 + cipher_engine.OUTPUT_SLACK))
+    length = readinto_full(src, current)
+    index = first_index
+    while True:
+        next_length = readinto_full(src, upcoming) if length == segment_size else 0
+        last = next_length == 0
+        nonce = os.urandom(engine.nonce_size)
+        payload = compression.pack(codec, current[:length]) if codec else current[:length]
+        sealed_length = engine.seal_into(nonce, payload, _segment_aad(file_id, index, last), out)
+        yield nonce, out[:sealed_length], length, last
+        if last:
+            return
+        current, upcoming = upcoming, current
+        length = next_length
+        index += 1
+
+
+def _seal_pipelined(src, engine, file_id, segment_size, codec, first_index, record, workers, depth):
+    """Pipelined counterpart of _seal_reusing_buffers: a reader thread, workers and a writer thread.
+
+    record(nonce, sealed, length, last) is called on the writer thread, in order.
+    """
+    def read(pipe):
+        index = first_index
+        current = pipe.take_slot()
+        current.length = readinto_full(src, current.data)
+        while True:
+            upcoming = None
+            if current.length == segment_size:
+                upcoming = pipe.take_slot()
+                upcoming.length = readinto_full(src, upcoming.data)
+            current.index = index
+            current.last = upcoming is None or upcoming.length == 0
+            pipe.emit(current)
+            if current.last:
+                if upcoming is not None:
+                    pipe.release_slot(upcoming)
+                return
+            current = upcoming
+            index += 1
+
+    def process(slot):
+        slot.nonce = os.urandom(engine.nonce_size)
+        payload = compression.pack(codec, slot.data[:slot.length]) if codec else slot.data[:slot.length]
+        sealed_length = engine.seal_into(slot.nonce, payload, _segment_aad(file_id, slot.index, slot.last), slot.out)
+        slot.result = slot.out[:sealed_length]
+
+    def write(slot):
+        record(slot.nonce, slot.result, slot.length, slot.last)
+
+    pipeline.Pipeline(segment_size, segment_size + 1 + cipher_engine.OUTPUT_SLACK, workers, depth).run(
+        read, process, write)
+
+
+def write_container(src, dst, key, segment_size=SEGMENT_SIZE, header_fields=None,
+                    cipher=cipher_engine.DEFAULT_CIPHER, workers=DEFAULT_WORKERS, reuse_buffers=True,
+                    compression_codec=None, resume=None, on_segment=None, queue_depth=pipeline.QUEUE_DEPTH):
+    """Encrypts src into dst as independently authenticated segments and returns the plaintext size.
+
+    By default reading, sealing (on workers threads) and writing run as a pipeline
+    over queue_depth reusable segment buffers, so a slow device overlaps with the
+    crypto. With queue_depth=0 and one worker, segments are read with readinto and
+    sealed with update_into into preallocated buffers on the calling thread; with
+    reuse_buffers=False each segment gets its own buffers on a thread pool.
+    segment_size is the buffer size. compression_codec (see compression.py)
+    compresses each segment before encryption when that pays off.
+
+    resume=(header, entries) continues an interrupted container whose first
+    len(entries) full segments are intact: dst must be positioned right after them
+    and src after the plaintext they hold. on_segment(dst, entries, size, last) is
+    called after every segment is written, e.g. to journal durable progress.
+    """
+    if resume:
+        header, entries = resume
+        entries = list(entries)
+        file_id = bytes.fromhex(header["file_id"])
+        cipher, segment_size, codec = header["cipher"], header["segment_size"], header["compression"]
+    else:
+        codec = compression.resolve(compression_codec)
+        file_id = os.urandom(16)
+        header = dict(header_fields or {})
+        header.update({"cipher": cipher, "segment_size": segment_size, "file_id": file_id.hex(),
+                       "compression": codec})
+        write_header(dst, header)
+        entries = []
+
+    engine = cipher_engine.get_engine(cipher, key)
+
+    def seal(segment):
+        index, chunk, last = segment
+        nonce = os.urandom(engine.nonce_size)
+        payload = compression.pack(codec, chunk) if codec else chunk
+        return nonce, engine.seal(nonce, payload, _segment_aad(file_id, index, last)), len(chunk), last
+
+    first_index = len(entries)
+    offset = entries[-1][0] + entries[-1][1] if entries else DATA_OFFSET
+    size = first_index * segment_size
+
+    def record(nonce, sealed, length, last):
+        nonlocal offset, size
+        dst.write(nonce)
+        dst.write(sealed)
+        entries.append((offset, len(nonce) + len(sealed)))
+        offset += len(nonce) + len(sealed)
+        size += length
+        if on_segment:
+            on_segment(dst, entries, size, last)
+
+    if reuse_buffers and queue_depth:
+        _seal_pipelined(src, engine, file_id, segment_size, codec, first_index, record, workers, queue_depth)
+    else:
+        if workers <= 1 and reuse_buffers:
+            sealed_segments = _seal_reusing_buffers(src, engine, file_id, segment_size, codec, first_index)
+        else:
+            sealed_segments = ordered_map(seal, _read_segments(src, segment_size, first_index), workers)
+        for sealed_segment in sealed_segments:
+            record(*sealed_segment)
+
+    dst.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+    dst.write(FOOTER.pack(offset, len(entries), size, FOOTER_MAGIC))
+    return size
+
+
+class ContainerReader:
+    """Random-access reader that only decrypts the segments a caller asks for."""
+
+    def __init__(self, path, key):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            self._load(key)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _load(self, key):
+        self.header = _read_slots(self._fd)[1][0][1]
+        if self.header.get("cipher") not in cipher_engine.ENGINES:
+            raise ContainerError(f"Unsupported cipher {self.header.get('cipher')}")
+        self.segment_size = self.header["segment_size"]
+        self.file_id = bytes.fromhex(self.header["file_id"])
+        self.codec = self.header.get("compression")
+        if self.codec is not None and self.codec not in compression.CODECS:
+            raise ContainerError(f"Compression codec {self.codec} is not installed")
+
+        file_size = os.fstat(self._fd).st_size
+        table_offset, count, self.size, footer_magic = FOOTER.unpack(
+            os.pread(self._fd, FOOTER.size, file_size - FOOTER.size))
+        if footer_magic != FOOTER_MAGIC or count == 0:
+            raise ContainerError("Container footer is missing or damaged")
+        if table_offset + count * ENTRY.size + FOOTER.size != file_size:
+            raise ContainerError("Container segment table is damaged")
+        if not (count - 1) * self.segment_size <= self.size <= count * self.segment_size:
+            raise ContainerError("Container size does not match its segment table")
+
+        table = os.pread(self._fd, count * ENTRY.size, table_offset)
+        self.entries = [ENTRY.unpack_from(table, i * ENTRY.size) for i in range(count)]
+        self._engine = cipher_engine.get_engine(self.header["cipher"], key)
+
+    @property
+    def segment_count(self):
+        return len(self.entries)
+
+    def segment_length(self, index):
+        """Returns the plaintext length of segment index."""
+        if index < self.segment_count - 1:
+            return self.segment_size
+        return self.size - index * self.segment_size
+
+    def read_segment(self, index):
+        """Decrypts and authenticates a single segment."""
+        offset, length = self.entries[index]
+        blob = os.pread(self._fd, length, offset)
+        last = index == self.segment_count - 1
+        nonce_size = self._engine.nonce_size
+        try:
+            data = self._engine.open(blob[:nonce_size], blob[nonce_size:],
+                                     _segment_aad(self.file_id, index, last))
+        except InvalidTag:
+            raise ContainerError(f"Segment {index} failed authentication") from None
+        return self._decode(index, data)
+
+    def _decode(self, index, payload):
+        """Undoes segment compression and checks the plaintext length."""
+        expected = self.segment_length(index)
+        if self.codec:
+            try:
+                payload = compression.unpack(self.codec, payload, expected)
+            except Exception as e:
+                raise ContainerError(f"Segment {index} failed to decompress: {e}") from None
+        if len(payload) != expected:
+            raise ContainerError(f"Segment {index} has an unexpected length")
+        return payload
+
+    def iter_segments(self, workers=1):
+        """Yields every segment in order, decrypting up to workers segments at a time."""
+        return ordered_map(self.read_segment, range(self.segment_count), workers)
+
+    def write_to(self, dst, workers=1, reuse_buffers=True, first_segment=0, on_segment=None,
+                 queue_depth=pipeline.QUEUE_DEPTH):
+        """Decrypts the container into dst, starting at first_segment.
+
+        By default a reader thread (preadv), workers crypto threads (update_into)
+        and a writer thread run as a pipeline over queue_depth reusable buffers.
+        With queue_depth=0 and one worker the same buffers are used sequentially on
+        the calling thread. Both keep the kernel reading ahead of them, which matters
+        on USB sticks. on_segment(dst, index) is called after each segment is
+        written.
+        """
+        if reuse_buffers and queue_depth:
+            self._write_pipelined(dst, workers, first_segment, on_segment, queue_depth)
+            return
+        if workers > 1 or not reuse_buffers:
+            segments = ordered_map(self.read_segment, range(first_segment, self.segment_count), workers)
+            for index, segment in enumerate(segments, first_segment):
+                dst.write(segment)
+                if on_segment:
+                    on_segment(dst, index)
+            return
+
+        sealed = memoryview(bytearray(self._longest_segment()))
+        out = memoryview(bytearray(self.segment_size + 1 + cipher_engine.OUTPUT_SLACK))
+        nonce_size = self._engine.nonce_size
+        readahead = usb_io.Readahead(self._fd)
+        for index in range(first_segment, self.segment_count):
+            offset, length = self.entries[index]
+            readahead.advance(offset)
+            if os.preadv(self._fd, [sealed[:length]], offset) != length:
+                raise ContainerError(f"Segment {index} is truncated")
+            last = index == self.segment_count - 1
+            try:
+                count = self._engine.open_into(bytes(sealed[:nonce_size]), sealed[nonce_size:length],
+                                               _segment_aad(self.file_id, index, last), out)
+            except InvalidTag:
+                raise ContainerError(f"Segment {index} failed authentication") from None
+            dst.write(self._decode(index, out[:count]))
+            if on_segment:
+                on_segment(dst, index)
+
+    def _longest_segment(self):
+        longest = max(length for _, length in self.entries)
+        if longest > self.segment_size + 1 + self._engine.nonce_size + cipher_engine.OUTPUT_SLACK:
+            raise ContainerError("Container segment table is damaged")
+        return longest
+
+    def _write_pipelined(self, dst, workers, first_segment, on_segment, depth):
+        nonce_size = self._engine.nonce_size
+
+        def read(pipe):
+            readahead = usb_io.Readahead(self._fd)
+            for index in range(first_segment, self.segment_count):
+                slot = pipe.take_slot()
+                offset, length = self.entries[index]
+                readahead.advance(offset)
+                if os.preadv(self._fd, [slot.data[:length]], offset) != length:
+                    raise ContainerError(f"Segment {index} is truncated")
+                slot.index = index
+                slot.length = length
+                pipe.emit(slot)
+
+        def process(slot):
+            sealed = slot.data[:slot.length]
+            last = slot.index == self.segment_count - 1
+            try:
+                count = self._engine.open_into(bytes(sealed[:nonce_size]), sealed[nonce_size:],
+                                               _segment_aad(self.file_id, slot.index, last), slot.out)
+            except InvalidTag:
+                raise ContainerError(f"Segment {slot.index} failed authentication") from None
+            slot.result = self._decode(slot.index, slot.out[:count])
+
+        def write(slot):
+            dst.write(slot.result)
+            if on_segment:
+                on_segment(dst, slot.index)
+
+        pipeline.Pipeline(self._longest_segment(), self.segment_size + 1 + cipher_engine.OUTPUT_SLACK,
+                          workers, depth).run(read, process, write)
+
+    def read_range(self, offset, length):
+        """Returns up to length bytes of plaintext starting at offset."""
+        end = min(offset + length, self.size)
+        if offset < 0 or offset >= end:
+            return b''
+        first = offset // self.segment_size
+        last = (end - 1) // self.segment_size
+        data = b''.join(self.read_segment(index) for index in range(first, last + 1))
+        start = offset - first * self.segment_size
+        return data[start:start + end - offset]
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,18 +1,47 @@
 import os
 import subprocess
 import sys
-import shutil
 import io
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from encryption import (SALT, decrypt_file, decrypt_resumable, decrypt_to_stream, encrypt_resumable, file_key,
+                        plaintext_size, rekey_many)
+import container
+import key_cache
+import manifest
+import privileged_helper
+import scrub
+import transfer_journal
+import usb_io
 
 MOUNT_POINT = "/mnt/private_partition"
 PARTITION = "/media/vishalkumar/7841-4163"  # Adjust this based on your setup
 CRYPT_NAME = "encrypted_partition"  # Name for unlocked partition
+STATE_DIR = ".secureusb"  # User-owned directory on the drive for SecureUsb's own files
+INTERNAL_NAMES = {STATE_DIR}  # Entries on the drive that are not user files
+HELPER_STAND_IN = False  # Run the privileged helper unprivileged, e.g. to try SecureUsb without root
+FSYNC_POLICY = usb_io.FSYNC_BATCH  # When imports are flushed to the stick unless set for the host (usb_io.fsync_policy)
+TREE_WORKERS = 4  # Files of a folder encrypted or decrypted at once; small files are bound by per-file overhead
+
+sync_policy = usb_io.SyncPolicy(usb_io.fsync_policy(FSYNC_POLICY))
+_helper = None  # The session's privileged helper, see privileged()
+_helper_lock = threading.Lock()
+
+
+def set_fsync_policy(policy, remember=False):
+    """Switch when imports are flushed to the stick ("file", "batch" or "unmount"), optionally for good.
+
+    Whatever the previous policy left unflushed is synced first.
+    """
+    global sync_policy
+    new_policy = usb_io.SyncPolicy(policy)
+    previous, sync_policy = sync_policy, new_policy
+    previous.sync()
+    if remember:
+        usb_io.store_fsync_policy(policy)
 
 
 def prompt_password():
@@ -24,28 +53,35 @@ def prompt_password():
     return password
 
 
-def derive_key(password):
-    """Derive a cryptographic key from a password using PBKDF2."""
-    salt = b'some_salt'  # Should be stored securely and uniquely for each user/system
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend()
-    )
-    return kdf.derive(password.encode())
+def privileged(sudo_password=None, mount_point=MOUNT_POINT):
+    """Return the session's privileged helper, starting it (and asking sudo once) on first use."""
+    global _helper
+    with _helper_lock:
+        if _helper is None or not _helper.alive:
+            _helper = privileged_helper.start(sudo_password, mount_point, stand_in=HELPER_STAND_IN)
+        return _helper
+
+
+def privileged_running():
+    """Whether privileged operations can run without asking for the sudo password."""
+    return _helper is not None and _helper.alive
+
+
+def stop_privileged():
+    """Stop the session's privileged helper, e.g. once the drive is unmounted."""
+    global _helper
+    with _helper_lock:
+        if _helper is not None:
+            _helper.close()
+            _helper = None
 
 
 def unlock_partition(password):
     """Unlock the LUKS-encrypted partition."""
     try:
-        subprocess.run(
-            ["sudo", "cryptsetup", "luksOpen", PARTITION, CRYPT_NAME],
-            input=password.encode(), check=True
-        )
+        privileged().luks_open(PARTITION, CRYPT_NAME, password)
         print("Partition unlocked successfully.")
-    except subprocess.CalledProcessError as e:
+    except privileged_helper.HelperError as e:
         if "already exists" in str(e):
             print("Partition is already unlocked.")
         else:
@@ -60,72 +96,351 @@ def mount_partition():
         print(f"Created mount point: {MOUNT_POINT}")
 
     try:
-        subprocess.run(
-            ["sudo", "mount", "-t", "xfs", f"/dev/mapper/{CRYPT_NAME}", MOUNT_POINT],
-            check=True
-        )
+        privileged().mount(CRYPT_NAME, "xfs")
         print(f"Partition mounted successfully at {MOUNT_POINT}.")
-    except subprocess.CalledProcessError:
+    except privileged_helper.HelperError:
         print("Mounting failed. The partition might not contain a valid XFS filesystem.")
         sys.exit(1)
 
 
 def unmount_partition():
     """Forcefully unmount the partition and clean up."""
+    key_cache.clear()
+    try:
+        sync_policy.sync()  # A forced unmount must not drop imports whose flush was deferred
+    except OSError as e:
+        print(f"[WARN] Could not flush the partition: {e}")
     try:
         print(f"Attempting to force unmount the partition at {MOUNT_POINT}...")
-        subprocess.run(["sudo", "umount", "-f", MOUNT_POINT], check=True)
+        privileged().unmount(force=True)
         print("Partition unmounted successfully.")
-    except subprocess.CalledProcessError as e:
+    except privileged_helper.HelperError as e:
         print(f"Failed to unmount the partition: {e}")
+    stop_privileged()
+
+
+def scan_tree(directory, skip=()):
+    """Yield (path relative to directory, os.DirEntry) for every regular file below directory.
+
+    Uses os.scandir, whose entries carry their file type, so a large tree costs no
+    extra stat per file. Symlinks are not followed; top-level names in skip are left out.
+    """
+    pending = [""]
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(directory, relative)) as entries:
+            for entry in entries:
+                if not relative and entry.name in skip:
+                    continue
+                path = os.path.join(relative, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path, entry
+
+
+def list_drive(mount_point=MOUNT_POINT):
+    """List the user files on the drive as paths relative to it, hiding SecureUsb's own bookkeeping entries."""
+    return [path for path, _ in scan_tree(mount_point, INTERNAL_NAMES)]
+
 
+def needs_privilege(directory):
+    """Whether writing into directory on the drive requires sudo."""
+    return not os.access(directory, os.W_OK)
 
-def encrypt_file(file_path, password):
-    """Encrypt a file using AES."""
-    key = derive_key(password)
-    iv = os.urandom(16)
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
 
-    with open(file_path, 'rb') as f:
-        data = f.read()
+def state_dir(mount_point=MOUNT_POINT, sudo_password=None):
+    """Return a directory on the drive the current user can write to, creating it once if needed.
 
-    padder = padding.PKCS7(algorithms.AES.block_size).padder()
-    padded_data = padder.update(data) + padder.finalize()
+    It holds files being written as well as the manifest and other bookkeeping.
+    """
+    path = os.path.join(mount_point, STATE_DIR)
+    if os.path.isdir(path) and os.access(path, os.W_OK):
+        return path
+    if not needs_privilege(mount_point):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return path
+    privileged(sudo_password, mount_point).make_dir(path)
+    return path
 
-    encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
-    encrypted_file_path = file_path + ".enc"
 
-    with open(encrypted_file_path, 'wb') as f:
-        f.write(iv + encrypted_data)
+def make_dirs(directory, mount_point=MOUNT_POINT, sudo_password=None):
+    """Create a directory on the drive and its missing parents, through the privileged helper where needed."""
+    if os.path.isdir(directory):
+        return
+    parent = os.path.dirname(directory)
+    make_dirs(parent, mount_point, sudo_password)
+    if needs_privilege(parent):
+        privileged(sudo_password, mount_point).make_dir(directory)
+    else:
+        os.makedirs(directory, exist_ok=True)
+
+
+def move_into_place(temp_path, destination, sudo_password=None):
+    """Atomically rename a finished file onto the drive, through the privileged helper if its directory needs it."""
+    if needs_privilege(os.path.dirname(destination)):
+        error, = privileged(sudo_password).move([(temp_path, destination)])
+        if error is not None:
+            raise privileged_helper.HelperError(f"Could not move {os.path.basename(destination)} into place: {error}")
+    else:
+        os.replace(temp_path, destination)
+
+
+def delete_files(paths, sudo_password=None, mount_point=MOUNT_POINT):
+    """Delete files from the drive in one batch, through the privileged helper if the drive needs it.
+
+    Returns None or an error message per path; one failure does not stop the others.
+    """
+    if needs_privilege(mount_point):
+        return privileged(sudo_password, mount_point).delete(paths)
+    results = []
+    for path in paths:
+        try:
+            os.remove(path)
+            results.append(None)
+        except FileNotFoundError:
+            results.append(None)  # Already gone, like rm -f
+        except OSError as e:
+            results.append(str(e))
+    return results
+
+
+def store_encrypted(source, destination, password, mount_point=MOUNT_POINT, sudo_password=None, digest=None,
+                    on_bytes=None):
+    """Encrypt source straight onto the drive and atomically rename it to destination.
+
+    The ciphertext is streamed into a temporary file in the drive's state directory,
+    so no copy is left next to the source and nothing is written twice; if the
+    destination directory is not writable by the user, the only privileged step is
+    the final rename, which is on the same filesystem. Progress is journaled, so if
+    an earlier attempt to store the same file was interrupted (unplugged stick,
+    sleep, crash) this resumes from its last durable segment. When the file is
+    flushed to the stick follows sync_policy; call sync_policy.batch_done() after
+    a batch of files. One that replaces an existing file is always flushed before
+    the rename. Missing folders on the way to destination are created.
+    """
+    state = state_dir(mount_point, sudo_password)
+    make_dirs(os.path.dirname(destination), mount_point, sudo_password)
+    journal = transfer_journal.find(state, transfer_journal.IMPORT, source, destination)
+    if journal is None:
+        fd, part = tempfile.mkstemp(dir=state, prefix=".", suffix=".part")
+        os.close(fd)
+        journal = transfer_journal.start(state, transfer_journal.IMPORT, source, destination, part,
+                                         durable=sync_policy.per_file)
+    try:
+        try:
+            encrypt_resumable(source, journal.info["part"], password, journal, digest=digest, on_bytes=on_bytes,
+                              sync_policy=sync_policy)
+        except container.WrongKeyError:
+            # The interrupted attempt used another password, so its work cannot be reused
+            journal.abandon()
+            return store_encrypted(source, destination, password, mount_point, sudo_password, digest, on_bytes)
+        if not journal.complete and os.path.exists(destination):
+            # Whatever the policy, a file is only replaced by one that is already on the device
+            with open(journal.info["part"], 'rb') as part:
+                journal.mark_complete(part)
+        move_into_place(journal.info["part"], destination, sudo_password)
+    except BaseException:
+        journal.close()  # Keep the partial file and journal so the next attempt resumes
+        raise
+    journal.finish()
+    return destination
+
+
+def export_decrypted(source, destination, password, mount_point=MOUNT_POINT, sudo_password=None, salt=SALT,
+                     on_bytes=None):
+    """Decrypt a file from the drive to destination, resuming an interrupted export of the same file.
+
+    Decrypted segments are streamed into a temporary file in destination's directory,
+    so memory stays bounded and the plaintext is written once. Files too small to
+    ever commit journal progress, and legacy files, which cannot resume anyway, go
+    to an unnamed file (see usb_io.AtomicOutput) that vanishes if the export is
+    interrupted; larger ones use a journaled '.name.part' file so that they resume.
+    """
+    state = state_dir(mount_point, sudo_password)
+    journal = transfer_journal.find(state, transfer_journal.EXPORT, source, destination)
+    if journal is None and (not container.is_container(source)
+                            or plaintext_size(source) < transfer_journal.COMMIT_BYTES):
+        with usb_io.AtomicOutput(destination) as output:
+            decrypt_to_stream(source, output.file, file_key(source, password, salt), on_bytes=on_bytes)
+        return destination
+    if journal is None:
+        part = os.path.join(os.path.dirname(destination), "." + os.path.basename(destination) + ".part")
+        journal = transfer_journal.start(state, transfer_journal.EXPORT, source, destination, part)
+    try:
+        decrypt_resumable(source, journal.info["part"], password, journal, salt, on_bytes)
+        os.replace(journal.info["part"], destination)
+    except container.WrongKeyError:
+        if journal.segments:
+            journal.close()
+        else:
+            journal.abandon()
+        raise
+    except BaseException:
+        journal.close()
+        raise
+    journal.finish()
+    return destination
+
+
+def _run_tree(jobs, transfer, workers, on_file):
+    """Runs transfer(source, destination) for every job on a thread pool while jobs is still being produced.
+
+    Returns (source, destination, error message or None) per file; one failure does not stop the others.
+    """
+    def run(source, destination):
+        try:
+            result = transfer(source, destination)
+            error = None
+        except Exception as e:
+            result, error = None, str(e)
+        if on_file:
+            on_file(source, destination, result, error)
+        return source, destination, error
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(run, source, destination) for source, destination in jobs]
+    return [future.result() for future in futures]
+
+
+def import_tree(source_dir, destination_dir, password, mount_point=MOUNT_POINT, sudo_password=None,
+                workers=TREE_WORKERS, on_file=None):
+    """Encrypt every file below source_dir into destination_dir on the drive, keeping the folder structure.
+
+    Each file becomes '.name.enc' in the matching folder on the drive. The tree is
+    scanned while earlier files are already being encrypted by workers threads.
+    on_file(source, destination, sha256 hex digest, error) is called from the
+    workers as each file finishes, e.g. to record it in the manifest.
+    """
+    def jobs():
+        for relative, _ in scan_tree(source_dir):
+            folder, name = os.path.split(relative)
+            yield os.path.join(source_dir, relative), os.path.join(destination_dir, folder, "." + name + ".enc")
+
+    def store(source, destination):
+        digest = hashlib.sha256()
+        store_encrypted(source, destination, password, mount_point, sudo_password, digest=digest)
+        return digest.hexdigest()
+
+    try:
+        return _run_tree(jobs(), store, workers, on_file)
+    finally:
+        sync_policy.batch_done()
+
 
-    return encrypted_file_path
+def export_tree(source_dir, destination_dir, password, mount_point=MOUNT_POINT, sudo_password=None, salt=SALT,
+                workers=TREE_WORKERS, on_file=None):
+    """Decrypt every file below the drive folder source_dir into destination_dir, recreating its folders.
 
+    '.name.enc' on the drive becomes 'name'; interrupted files resume like single
+    exports. on_file(source, destination, None, error) is called as each file finishes.
+    """
+    def jobs():
+        for relative, _ in scan_tree(source_dir):
+            folder = os.path.dirname(relative)
+            yield (os.path.join(source_dir, relative),
+                   os.path.join(destination_dir, folder, manifest.original_name(relative)))
 
-def decrypt_file(file_path, password):
-    """Decrypt a file using AES."""
-    key = derive_key(password)
+    def export(source, destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        export_decrypted(source, destination, password, mount_point, sudo_password, salt)
 
-    with open(file_path, 'rb') as f:
-        iv = f.read(16)  # Read the IV (16 bytes)
-        encrypted_data = f.read()  # The encrypted data
+    return _run_tree(jobs(), export, workers, on_file)
 
-    # Use the same padding and decryption logic as during encryption
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
 
-    decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
+def discard_transfer(kind, source, destination, mount_point=MOUNT_POINT):
+    """Roll back a transfer the user cancelled, so adding the file again starts from scratch."""
+    journal = transfer_journal.find(os.path.join(mount_point, STATE_DIR), kind, source, destination)
+    if journal is not None:
+        journal.abandon()
 
-    # Ensure proper unpadding
-    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
-    unpadded_data = unpadder.update(decrypted_data) + unpadder.finalize()
 
-    return unpadded_data
+def _verify_import(journal, password):
+    """Whether an import's output, which looks complete, really reached the disk past its last commit.
+
+    The journal only vouches for what it committed, so the segments after that
+    are authenticated with the data key, which takes the file's password. Output
+    that fails is cut back to the last commit. False without the right password.
+    """
+    part = journal.info["part"]
+    try:
+        with container.ContainerReader(part, file_key(part, password)) as reader:
+            if reader.entries[:len(journal.entries)] != journal.entries:
+                raise container.ContainerError("Segment table does not match the journal")
+            for index in range(len(journal.entries), reader.segment_count):
+                reader.read_segment(index)
+    except container.WrongKeyError:
+        return False  # Another password; the file's own resumes it
+    except (container.ContainerError, OSError, ValueError, KeyError) as e:
+        print(f"[WARN] Unflushed end of {part} did not survive ({e}); keeping only its committed part.")
+        with open(part, 'r+b') as f:
+            f.truncate(journal.committed_offset)
+            os.fsync(f.fileno())
+        return False
+    with open(part, 'rb') as f:
+        os.fsync(f.fileno())
+    return True
+
+
+def _sweep_parts(state, journals):
+    """Removes temporary files in the state directory that no journal owns.
+
+    They are left by a crash before their journal was durable (see
+    transfer_journal.start) or in the middle of replacing a bookkeeping file.
+    """
+    owned = {os.path.abspath(journal.info["part"]) for journal in journals}
+    for directory in (state, os.path.join(state, transfer_journal.JOURNAL_DIR)):
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            path = os.path.join(directory, name)
+            if name.startswith(".") and name.endswith(".part") and os.path.abspath(path) not in owned:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"[WARN] Could not remove leftover {path}: {e}")
+
+
+def recover_transfers(mount_point=MOUNT_POINT, sudo_password=None, password=None):
+    """Complete or roll back transfers that were interrupted, e.g. by pulling the stick.
+
+    Transfers whose journal says their output was written and flushed to the end
+    are moved into place; an import without that record is only completed if its
+    unflushed segments authenticate with password (usually the drive password,
+    which many files share). Those whose source or partial output is gone are
+    rolled back, and the rest are reported as pending: they resume from their
+    last durable segment when the same file is added or exported again with its
+    password. Leftover temporary files that no journal owns are removed.
+    """
+    state = os.path.join(mount_point, STATE_DIR)
+    report = []
+    journals = transfer_journal.transfers(state) if os.path.isdir(state) else []
+    for journal in journals:
+        info = journal.info
+        outcome = transfer_journal.PENDING
+        try:
+            part = info["part"]
+            if not os.path.exists(part) or not journal.source_unchanged():
+                journal.abandon()
+                outcome = transfer_journal.ROLLED_BACK
+            elif info["kind"] == transfer_journal.IMPORT and container.is_complete(part) and (
+                    journal.complete or password is not None and _verify_import(journal, password)):
+                move_into_place(part, info["destination"], sudo_password)
+                journal.finish()
+                outcome = transfer_journal.COMPLETED
+            elif info["kind"] == transfer_journal.EXPORT and journal.complete:
+                os.replace(part, info["destination"])
+                journal.finish()
+                outcome = transfer_journal.COMPLETED
+        except Exception as e:
+            print(f"[WARN] Could not recover transfer of {info['source']}: {e}")
+        report.append({"kind": info["kind"], "source": info["source"], "destination": info["destination"],
+                       "committed": journal.committed_bytes, "total": info["source_size"], "outcome": outcome})
+    _sweep_parts(state, journals)
+    return report
 
 
 def list_files():
     """List files in the mounted partition."""
-    files = os.listdir(MOUNT_POINT)
+    files = list_drive()
     if files:
         print("Files in the partition:")
         for file in files:
@@ -143,14 +458,23 @@ def move_file(password):
     if files:
         for file in files:
             print(f" - {file}")
-        filename = input("Enter the name of the file to copy to the partition: ").strip()
+        filename = input("Enter the name of the file or folder to copy to the partition: ").strip()
         if filename in files:
             source = os.path.join(current_dir, filename)
             destination = os.path.join(MOUNT_POINT, "." + filename + ".enc")
 
+            if os.path.isdir(source):
+                results = import_tree(source, os.path.join(MOUNT_POINT, filename), password)
+                failed = [(path, error) for path, _, error in results if error is not None]
+                for path, error in failed:
+                    print(f" - {os.path.relpath(path, source)}: {error}")
+                print(f"Encrypted {len(results) - len(failed)} of {len(results)} files of '{filename}' "
+                      f"into the partition.")
+                return
+
             try:
-                encrypted_file = encrypt_file(source, password)
-                shutil.move(encrypted_file, destination)
+                store_encrypted(source, destination, password)
+                sync_policy.batch_done()
                 print(f"File '{filename}' encrypted and moved to the partition.")
             except Exception as e:
                 print(f"Failed to encrypt and move file: {e}")
@@ -163,7 +487,7 @@ def move_file(password):
 def open_file(password):
     """Decrypt and open a file from the partition."""
     print("Files in the partition:")
-    files = os.listdir(MOUNT_POINT)
+    files = list_drive()
 
     if files:
         for file in files:
@@ -189,6 +513,47 @@ def open_file(password):
         print("No files found in the partition.")
 
 
+def drive_files(mount_point=MOUNT_POINT):
+    """Full paths of the user files on the drive, including those in folders, in a stable order."""
+    return [os.path.join(mount_point, name) for name in sorted(list_drive(mount_point))]
+
+
+def scrub_files(password):
+    """Verify every file on the partition and print a report; Ctrl+C pauses the scrub."""
+    rate = input("Maximum read speed in MB/s (leave empty for no limit): ").strip()
+    scrubber = scrub.Scrubber(drive_files(), password, rate_limit_mb_s=float(rate) if rate else None)
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(scrubber.run()), daemon=True)
+    worker.start()
+    while worker.is_alive():
+        try:
+            worker.join(0.5)
+        except KeyboardInterrupt:
+            scrubber.pause()
+            answer = input(f"\nScrub paused at {scrubber.bytes_read / scrub.MB:.0f} MB. Resume? (y/n): ").strip()
+            if answer.lower() == "y":
+                scrubber.resume()
+            else:
+                scrubber.cancel()
+    print(scrub.format_report(result))
+
+
+def change_file_password(password):
+    """Change the password of the encrypted files by rewrapping their keys; returns the password now in use."""
+    new_password = input("Enter the new file password: ").strip()
+    if not new_password or new_password != input("Confirm the new file password: ").strip():
+        print("Passwords are empty or do not match.")
+        return password
+
+    results = rekey_many(drive_files(), password, new_password)
+    for result in results:
+        if result["error"] is not None:
+            print(f" - {os.path.basename(result['path'])}: {result['error']}")
+    changed = sum(result["error"] is None for result in results)
+    print(f"Changed the password of {changed} of {len(results)} files.")
+    return new_password if changed else password
+
+
 def change_password():
     """Change the LUKS encryption password."""
     print("\nChanging LUKS encryption password...")
@@ -215,21 +580,33 @@ def change_password():
         print(f"Failed to change the password: {e}")
         return
 
+    # The manifest key is wrapped with the drive password, so it follows the new one
+    try:
+        manifest.rewrap_manifest(MOUNT_POINT, current_password, new_password)
+    except Exception as e:
+        print(f"[WARN] Could not re-lock the file index with the new password: {e}")
+
 
 def main():
     password = prompt_password()
     unlock_partition(password)
     mount_partition()
+    for transfer in recover_transfers(password=password):
+        print(f"Interrupted {transfer['kind']} of {transfer['source']}: {transfer['outcome']}")
+        if transfer["outcome"] == transfer_journal.PENDING:
+            print("  Add the same file again to resume it.")
 
     try:
         while True:
             print("\nOptions:")
             print("1. List files in the partition")
-            print("2. Move and encrypt a file to the partition")
+            print("2. Move and encrypt a file or folder to the partition")
             print("3. Open and decrypt a file from the partition")
             print("4. Change the LUKS encryption password")
-            print("5. Exit")
-            choice = input("Enter your choice (1/2/3/4/5): ").strip()
+            print("5. Verify the integrity of files in the partition")
+            print("6. Change the password of the encrypted files")
+            print("7. Exit")
+            choice = input("Enter your choice (1/2/3/4/5/6/7): ").strip()
 
             if choice == "1":
                 list_files()
@@ -240,6 +617,10 @@ def main():
             elif choice == "4":
                 change_password()
             elif choice == "5":
+                scrub_files(password)
+            elif choice == "6":
+                password = change_file_password(password)
+            elif choice == "7":
                 print("Exiting...")
                 unmount_partition()
                 break
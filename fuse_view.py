@@ -0,0 +1,342 @@
+import os
+import sys
+import stat
+import errno
+import getpass
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fuse  # fusepy
+except ImportError:
+    fuse = None
+import container
+import drive_manager
+import encryption
+import manifest
+
+# The view shows the drive's folders as they are and each '.name.enc' file as
+# 'name', decrypted on demand one segment at a time. Decrypted segments are kept in
+# a bounded LRU shared by all files; a reader that moves front to back gets the
+# next segments decrypted in the background before it asks for them. Everything
+# but the FUSE glue lives in DecryptedTree, which works on any directory of
+# encrypted files, so it can be exercised without a USB stick or fusepy.
+CACHE_BYTES = 64 * 1024 * 1024  # Decrypted segments kept in memory, across all open files
+READAHEAD_SEGMENTS = 4  # Segments decrypted ahead of a sequential reader
+READAHEAD_WORKERS = 2
+
+
+class FuseViewError(Exception):
+    """Raised when the decrypted view cannot be mounted."""
+
+
+def _view_name(name):
+    """'report.pdf' for '.report.pdf.enc'; None for anything that is not an encrypted file."""
+    if name.startswith('.') and name.endswith('.enc') and len(name) > len('..enc'):
+        return manifest.original_name(name)
+    return None
+
+
+class PageCache:
+    """Thread-safe LRU of decrypted segments keyed by (path, segment index), bounded in bytes."""
+
+    def __init__(self, capacity=CACHE_BYTES):
+        self.capacity = capacity
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._pages
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page):
+        if len(page) > self.capacity:
+            return
+        with self._lock:
+            previous = self._pages.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._pages[key] = page
+            self.size += len(page)
+            while self.size > self.capacity:
+                _, evicted = self._pages.popitem(last=False)
+                self.size -= len(evicted)
+
+    def drop(self, path):
+        """Forgets every page of a file, e.g. when it changed on the drive."""
+        with self._lock:
+            for key in [key for key in self._pages if key[0] == path]:
+                self.size -= len(self._pages.pop(key))
+
+
+class _OpenFile:
+    """A file opened through the view: its reader and where the last read ended."""
+
+    def __init__(self, source, reader, key, size):
+        self.source = source
+        self.reader = reader  # None for legacy AES-CBC files, which are read through encryption.decrypt_range
+        self.key = key
+        self.size = size
+        self.next_offset = 0
+        self.users = 1
+
+
+class DecryptedTree:
+    """Read-only decrypted view of a directory of encrypted files, such as the mounted partition.
+
+    Paths are relative to the view's root and use '/' ("/docs/report.pdf" is
+    root/docs/.report.pdf.enc). open() returns a handle for read() and release().
+    Missing files raise FileNotFoundError and wrong passwords PermissionError, so
+    the FUSE glue can map them to errno values. Headerless legacy files are keyed
+    with salt, or with whichever of encryption.LEGACY_SALTS leaves valid padding.
+    """
+
+    def __init__(self, root, password, salt=None, cache_bytes=CACHE_BYTES,
+                 readahead_segments=READAHEAD_SEGMENTS, workers=READAHEAD_WORKERS):
+        self.root = os.path.realpath(root)
+        self.password = password
+        self.salts = (salt,) if salt else encryption.LEGACY_SALTS
+        self.cache = PageCache(cache_bytes)
+        self.readahead_segments = readahead_segments
+        self._handles = {}
+        self._next_handle = 1
+        self._sizes = {}  # Source path -> ((size, mtime) of the encrypted file, plaintext size)
+        self._lock = threading.Lock()
+        self._readahead = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._pending = set()  # Cache keys being decrypted ahead
+
+    def _source(self, path):
+        """Returns (encrypted file or directory on the drive, whether it is a directory) for a view path."""
+        parts = [part for part in path.split('/') if part]
+        if parts and parts[0] in drive_manager.INTERNAL_NAMES:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        directory = os.path.join(self.root, *parts)
+        if os.path.isdir(directory) and not os.path.islink(directory):
+            return directory, True
+        if parts:
+            source = os.path.join(self.root, *parts[:-1], "." + parts[-1] + ".enc")
+            if os.path.isfile(source):
+                return source, False
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    def listdir(self, path):
+        source, is_directory = self._source(path)
+        if not is_directory:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        names = []
+        with os.scandir(source) as entries:
+            for entry in entries:
+                if source == self.root and entry.name in drive_manager.INTERNAL_NAMES:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    names.append(entry.name)
+                elif entry.is_file(follow_symlinks=False) and _view_name(entry.name):
+                    names.append(_view_name(entry.name))
+        return sorted(names)
+
+    def _key(self, source):
+        """The key of an encrypted file; WrongKeyError if the password does not open it."""
+        if container.is_container(source):
+            return encryption.file_key(source, self.password)
+        return encryption.legacy_key(source, self.password, self.salts)
+
+    def _plaintext_size(self, source, st):
+        signature = (st.st_size, st.st_mtime)
+        cached = self._sizes.get(source)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        size = encryption.plaintext_size(source)
+        if not container.is_container(source):
+            # The padding of a legacy file is only known once its last block is decrypted
+            try:
+                key = self._key(source)
+                size = max(size - 16, 0) + len(encryption.decrypt_range(source, max(size - 16, 0), 16, key))
+            except (ValueError, container.ContainerError):
+                pass  # Reported when the file is read
+        if cached is not None:
+            self.cache.drop(source)
+        self._sizes[source] = (signature, size)
+        return size
+
+    def getattr(self, path):
+        """stat()-like dict for a view path; files are read-only and report their plaintext size."""
+        source, is_directory = self._source(path)
+        st = os.stat(source)
+        attributes = {"st_uid": st.st_uid, "st_gid": st.st_gid, "st_atime": st.st_atime, "st_mtime": st.st_mtime,
+                      "st_ctime": st.st_ctime}
+        if is_directory:
+            return dict(attributes, st_mode=stat.S_IFDIR | 0o555, st_nlink=2, st_size=0)
+        return dict(attributes, st_mode=stat.S_IFREG | 0o444, st_nlink=1, st_size=self._plaintext_size(source, st))
+
+    def open(self, path):
+        source, is_directory = self._source(path)
+        if is_directory:
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+        try:
+            key = self._key(source)
+            reader = container.ContainerReader(source, key) if container.is_container(source) else None
+        except container.WrongKeyError:
+            raise PermissionError(errno.EACCES, "Wrong password for this file", path) from None
+        handle = _OpenFile(source, reader, key, self._plaintext_size(source, os.stat(source)))
+        with self._lock:
+            number = self._next_handle
+            self._next_handle += 1
+            self._handles[number] = handle
+        return number
+
+    def _segment(self, handle, index):
+        key = (handle.source, index)
+        page = self.cache.get(key)
+        if page is None:
+            page = handle.reader.read_segment(index)
+            self.cache.put(key, page)
+        return page
+
+    def _read_ahead(self, handle, first):
+        last = min(first + self.readahead_segments, handle.reader.segment_count)
+        for index in range(first, last):
+            key = (handle.source, index)
+            with self._lock:
+                if key in self._pending or key in self.cache:
+                    continue
+                self._pending.add(key)
+                handle.users += 1  # Keeps the reader open until the job has run
+            self._readahead.submit(self._prefetch, handle, index)
+
+    def _prefetch(self, handle, index):
+        key = (handle.source, index)
+        try:
+            self.cache.put(key, handle.reader.read_segment(index))
+        except Exception:
+            pass  # The reader gets the error itself when it gets there
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+            self._unuse(handle)
+
+    def read(self, number, size, offset):
+        """Decrypts and returns up to size bytes at offset, only touching the segments involved."""
+        handle = self._handles[number]
+        end = min(offset + size, handle.size)
+        if offset >= end:
+            return b''
+        if handle.reader is None:
+            return encryption.decrypt_range(handle.source, offset, end - offset, handle.key)
+
+        segment_size = handle.reader.segment_size
+        first, last = offset // segment_size, (end - 1) // segment_size
+        data = b''.join(self._segment(handle, index) for index in range(first, last + 1))
+        start = offset - first * segment_size
+        if offset == handle.next_offset and self.readahead_segments:
+            self._read_ahead(handle, last + 1)
+        handle.next_offset = end
+        return data[start:start + end - offset]
+
+    def _unuse(self, handle):
+        with self._lock:
+            handle.users -= 1
+            closing = handle.users == 0
+        if closing and handle.reader is not None:
+            handle.reader.close()
+
+    def release(self, number):
+        with self._lock:
+            handle = self._handles.pop(number, None)
+        if handle is not None:
+            self._unuse(handle)
+
+    def close(self):
+        """Releases every open file and stops the readahead workers."""
+        for number in list(self._handles):
+            self.release(number)
+        self._readahead.shutdown(wait=True)
+
+
+if fuse is not None:
+    class FuseOperations(fuse.Operations):
+        """fusepy glue that serves a DecryptedTree read-only."""
+
+        def __init__(self, tree):
+            self.tree = tree
+
+        def __call__(self, op, *args):
+            try:
+                return super().__call__(op, *args)
+            except OSError as e:
+                raise fuse.FuseOSError(e.errno or errno.EIO) from None
+            except (ValueError, container.ContainerError):
+                raise fuse.FuseOSError(errno.EIO) from None
+
+        def getattr(self, path, fh=None):
+            return self.tree.getattr(path)
+
+        def readdir(self, path, fh):
+            return ['.', '..'] + self.tree.listdir(path)
+
+        def open(self, path, flags):
+            if flags & (os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_TRUNC):
+                raise fuse.FuseOSError(errno.EROFS)
+            return self.tree.open(path)
+
+        def read(self, path, size, offset, fh):
+            return self.tree.read(fh, size, offset)
+
+        def release(self, path, fh):
+            self.tree.release(fh)
+            return 0
+
+        def statfs(self, path):
+            st = os.statvfs(self.tree.root)
+            return {name: getattr(st, name) for name in ("f_bsize", "f_frsize", "f_blocks", "f_bfree", "f_bavail",
+                                                         "f_files", "f_ffree", "f_favail", "f_namemax")}
+
+        def destroy(self, path):
+            self.tree.close()
+
+
+def mount(root, mount_point, password, salt=None, cache_bytes=CACHE_BYTES,
+          readahead_segments=READAHEAD_SEGMENTS, foreground=True):
+    """Serves the decrypted view of root at mount_point until it is unmounted (fusermount -u)."""
+    if fuse is None:
+        raise FuseViewError("The decrypted view needs fusepy (pip install fusepy) and FUSE")
+    tree = DecryptedTree(root, password, salt, cache_bytes, readahead_segments)
+    fuse.FUSE(FuseOperations(tree), mount_point, foreground=foreground, ro=True, nothreads=False,
+              fsname="secureusb", default_permissions=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mount a read-only decrypted view of the SecureUsb partition")
+    parser.add_argument("mount_point", help="empty directory to show the decrypted files in")
+    parser.add_argument("--root", default=drive_manager.MOUNT_POINT,
+                        help="mounted partition, or any directory of encrypted files")
+    parser.add_argument("--cache-mb", type=int, default=CACHE_BYTES // (1024 * 1024))
+    parser.add_argument("--readahead", type=int, default=READAHEAD_SEGMENTS, help="segments decrypted ahead")
+    parser.add_argument("--salt", help="salt of headerless legacy files (default: try the drive window's, "
+                                       "then the command line's)")
+    args = parser.parse_args(argv)
+    password = getpass.getpass("Enter the password of the files: ")
+    try:
+        mount(args.root, args.mount_point, password, args.salt.encode() if args.salt else None,
+              cache_bytes=args.cache_mb * 1024 * 1024, readahead_segments=args.readahead)
+    except FuseViewError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
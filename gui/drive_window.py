@@ -1,7 +1,10 @@
 import os
-import subprocess
-import shutil
+import time
+import hashlib
 import logging
+import queue
+import threading
+from collections import OrderedDict
 from PyQt6.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QMessageBox
 from PyQt6.QtWidgets import QWidget, QVBoxLayout,QSizePolicy, QHBoxLayout, QPushButton, QLabel, QListWidget, QListWidgetItem, QStyle, QFileDialog, QDialog
 from PyQt6.QtCore import Qt
@@ -10,26 +13,75 @@ import os
 from PyQt6.QtCore import Qt, QSize
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QLabel, QListWidget, QPushButton, QHBoxLayout, QFileDialog,
                              QMessageBox, QInputDialog, QLineEdit, QMenu)
-from PyQt6.QtGui import QIcon, QAction
-from PyQt6.QtCore import Qt
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
+from PyQt6.QtGui import QIcon, QAction, QPixmap
+from PyQt6.QtCore import Qt, QCoreApplication, QObject, QTimer, pyqtSignal
 import io
 from PIL import Image
+import encryption
+import container
+import key_cache
+import drive_manager
+import manifest
+import mime_sniff
+import privileged_helper
+import thumbnails
+import transfer_journal
+import transfer_queue
 from .file_viewer import FileViewer
+from .scrub_dialog import ScrubDialog
+from .transfer_panel import TransferPanel
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 icon_path = os.path.join(BASE_DIR, "icons", "file2.png")
+DRIVE_SALT = encryption.DRIVE_SALT  # Salt of headerless files added through the drive window
+PIXMAP_CACHE_SIZE = 256  # Decoded thumbnails kept in memory; older ones fall back to the plain icon
+FOLDER_ROLE = Qt.ItemDataRole.UserRole + 1  # Folder (relative to the drive) an item opens
+RELOAD_DELAY_MS = 300  # Finished imports arriving closer together than this share one reload of the view
+STOP_WAIT_S = 10  # How long unmounting waits for background writers to let go of the drive before asking
+
+
+class ThumbnailSignals(QObject):
+    """Carries thumbnails found or rendered by the thumbnail thread over to the GUI thread."""
+    ready = pyqtSignal(str, str, bytes)  # On-drive name, mime type, key that opens its thumbnail
+
+
+class CallSignals(QObject):
+    """Carries callables from worker threads over to the GUI thread, which runs them."""
+    call = pyqtSignal(object)
+
 
 class DriveWindow(QWidget):
-    def __init__(self, mount_point, previous_window):
+    def __init__(self, mount_point, previous_window, file_manifest=None):
         super().__init__()
 
         self.mount_point = mount_point
         self.previous_window = previous_window
+        self.manifest = file_manifest  # Encrypted index of the drive; None falls back to listing it
+        self.thumbnails = None
+        if self.manifest is not None:
+            try:
+                self.thumbnails = thumbnails.open_cache(os.path.dirname(self.manifest.path))
+            except Exception as e:
+                logging.error(f"Failed to open thumbnail cache: {e}")
+        self.folder = ""  # Folder of the drive being shown, relative to the mount point
+        self._entries = {}  # On-drive name (relative path) -> manifest entry or None, for the whole drive
+        self._unflushed = {}  # Imported files the manifest only lists once they are on the device
+        self._items = {}  # On-drive name -> list item, for the current view
+        self._shown = set()  # Items of the current view that display their thumbnail
+        self._pixmaps = OrderedDict()  # LRU of on-drive name -> decrypted thumbnail
+        # On-drive name -> thumbnail key, only for files unlocked with a password this session
+        self._thumbnail_keys = {}
+        self._backfill_queue = queue.Queue()  # Thumbnail work (callables), run one at a time off the GUI thread
+        self._backfill_thread = None
+        self._backfill_tried = set()
+        self._backfill_stop = threading.Event()
+        self.viewer_windows = []  # Open FileViewers; each holds plaintext lent to an external viewer
+        self._thumbnail_signals = ThumbnailSignals()
+        self._thumbnail_signals.ready.connect(self.on_thumbnail_ready)
+        self._call_signals = CallSignals()
+        self._call_signals.call.connect(lambda callback: callback())
+        self._flush_threads = []  # Threads ending a batch of imports with a syncfs
+        self._unmounting = False  # unmount_drive() flushes whatever is left itself
 
         self.setWindowTitle("Drive Contents")
         self.setGeometry(200, 200, 800, 600)
@@ -77,12 +129,27 @@ class DriveWindow(QWidget):
         self.file_list.setGridSize(QSize(120, 120))
         self.file_list.setSpacing(10)
         self.file_list.setWrapping(True)
+        self.file_list.setSelectionMode(QListWidget.SelectionMode.ExtendedSelection)  # Ctrl/Shift-click, Ctrl+A
         self.file_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.file_list.customContextMenuRequested.connect(self.show_context_menu)
         self.file_list.itemSelectionChanged.connect(self.on_file_selected)  # Detect item selection
-        self.file_list.itemDoubleClicked.connect(self.open_selected_file)
+        self.file_list.itemDoubleClicked.connect(self.on_item_double_clicked)
+        self.file_list.verticalScrollBar().valueChanged.connect(self.load_visible_thumbnails)
+        self.file_list.setMovement(QListWidget.Movement.Static)
+        self.file_list.setAcceptDrops(False)  # Files dropped on the list go to the window (see dropEvent)
         layout.addWidget(self.file_list)
 
+        # Imports run in the background; the panel shows up with the first one
+        self.transfer_panel = TransferPanel(self.transfer_worker)
+        self.transfer_panel.finished.connect(self.on_transfer_finished)
+        self.transfer_panel.setVisible(False)
+        layout.addWidget(self.transfer_panel)
+        self._reload_timer = QTimer(self)
+        self._reload_timer.setSingleShot(True)
+        self._reload_timer.setInterval(RELOAD_DELAY_MS)
+        self._reload_timer.timeout.connect(self.load_files)
+        self.setAcceptDrops(True)
+
         # Button layout
         button_layout = QHBoxLayout()
 
@@ -145,7 +212,7 @@ class DriveWindow(QWidget):
         # Refresh Button
         self.refresh_button = QPushButton("⟳ Refresh")
         self.refresh_button.setStyleSheet(button_style)
-        self.refresh_button.clicked.connect(self.load_files)
+        self.refresh_button.clicked.connect(self.refresh_files)
         button_layout.addWidget(self.refresh_button)
 
         # Add File Button
@@ -154,6 +221,25 @@ class DriveWindow(QWidget):
         self.add_file_button.clicked.connect(self.add_file)
         button_layout.addWidget(self.add_file_button)
 
+        # Add Folder Button
+        self.add_folder_button = QPushButton("➕ Add Folder")
+        self.add_folder_button.setStyleSheet(button_style)
+        self.add_folder_button.clicked.connect(self.add_folder)
+        button_layout.addWidget(self.add_folder_button)
+
+        # Transfers Button (brings the transfer panel back after it was hidden)
+        self.transfers_button = QPushButton("⇅ Transfers")
+        self.transfers_button.setStyleSheet(button_style)
+        self.transfers_button.clicked.connect(lambda: self.transfer_panel.setVisible(True))
+        button_layout.addWidget(self.transfers_button)
+
+        # Verify Button
+        self.verify_button = QPushButton("🛡 Verify")
+        self.verify_button.setStyleSheet(button_style)
+        self.verify_button.setToolTip("Check every file on the drive for corruption")
+        self.verify_button.clicked.connect(self.verify_files)
+        button_layout.addWidget(self.verify_button)
+
         # Help Button (❓)
         self.help_button = QPushButton("?")
         self.help_button.setStyleSheet("""
@@ -183,27 +269,249 @@ class DriveWindow(QWidget):
 
     def load_files(self):
         self.file_list.clear()
+        self._items = {}
+        self._shown = set()
         icon_path = os.path.join(BASE_DIR, "icons", "file2.png")
+        self.setWindowTitle(f"Drive Contents — /{self.folder}" if self.folder else "Drive Contents")
 
         try:
-            files = os.listdir(self.mount_point)
-            if not files:
+            # The manifest gives names and metadata without touching the encrypted files
+            if self.manifest is not None:
+                self._entries = dict(self.manifest.entries, **self._unflushed)
+            else:
+                self._entries = {name: None for name in drive_manager.list_drive(self.mount_point)}
+            if self.folder:
+                parent = QListWidgetItem(self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogToParent), "..")
+                parent.setData(FOLDER_ROLE, os.path.dirname(self.folder))
+                parent.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                parent.setSizeHint(QSize(120, 120))
+                self.file_list.addItem(parent)
+
+            # Folders of the drive are shown one level at a time, before the files
+            prefix = self.folder + os.sep if self.folder else ""
+            files = {}
+            folders = set()
+            for stored_name, entry in self._entries.items():
+                if not stored_name.startswith(prefix):
+                    continue
+                relative = stored_name[len(prefix):]
+                if os.sep in relative:
+                    folders.add(relative.split(os.sep, 1)[0])
+                else:
+                    files[stored_name] = entry
+            if not files and not folders:
                 item = QListWidgetItem("No files found")
                 item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
                 self.file_list.addItem(item)
                 return
 
-            for file_name in files:
-                item = QListWidgetItem(QIcon(icon_path), file_name)
+            folder_icon = self.style().standardIcon(QStyle.StandardPixmap.SP_DirIcon)
+            for name in sorted(folders, key=str.lower):
+                item = QListWidgetItem(folder_icon, name)
+                item.setData(FOLDER_ROLE, prefix + name)
+                item.setToolTip(f"{name}\nFolder, double-click to open")
+                item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                item.setSizeHint(QSize(120, 120))
+                self.file_list.addItem(item)
+
+            for stored_name, entry in sorted(files.items(),
+                                             key=lambda e: (e[1] or {}).get("name", e[0]).lower()):
+                item = QListWidgetItem(QIcon(icon_path), entry["name"] if entry else os.path.basename(stored_name))
+                item.setData(Qt.ItemDataRole.UserRole, stored_name)
+                if entry:
+                    item.setToolTip(self.describe_entry(entry))
                 item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
                 item.setSizeHint(QSize(120, 120))  # Enough space for icon + label padding
                 self.file_list.addItem(item)
+                self._items[stored_name] = item
+            # Thumbnails are decrypted once the items have been laid out and we know which are visible
+            QTimer.singleShot(0, self.load_visible_thumbnails)
 
         except Exception as e:
             error_item = QListWidgetItem(f"Error: {e}")
             error_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
             self.file_list.addItem(error_item)
 
+    def open_folder(self, folder):
+        """Shows the contents of a folder of the drive ("" is its top level)."""
+        self.folder = folder
+        self.load_files()
+
+    def on_item_double_clicked(self, item):
+        folder = item.data(FOLDER_ROLE)
+        if folder is not None:
+            self.open_folder(folder)
+        else:
+            self.open_selected_file()
+
+    def describe_entry(self, entry):
+        """Tooltip text with the metadata kept in the manifest."""
+        size = entry.get("size") or 0
+        for unit in ("B", "KB", "MB", "GB"):
+            if size < 1024 or unit == "GB":
+                break
+            size /= 1024
+        lines = [entry["name"], f"Size: {size:.1f} {unit}"]
+        if entry.get("mime"):
+            lines.append(f"Type: {entry['mime']}")
+        if entry.get("mtime"):
+            lines.append(f"Modified: {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['mtime']))}")
+        return "\n".join(lines)
+
+    def load_visible_thumbnails(self):
+        """Swaps in thumbnails for the items currently in view, decrypting only those."""
+        if self.thumbnails is None:
+            return
+        viewport = self.file_list.viewport().rect()
+        for stored_name, item in self._items.items():
+            if stored_name in self._shown or not self.file_list.visualItemRect(item).intersects(viewport):
+                continue
+            pixmap = self.thumbnail_pixmap(stored_name)
+            if pixmap is not None:
+                item.setIcon(QIcon(pixmap))
+                self._shown.add(stored_name)
+
+    def thumbnail_pixmap(self, stored_name):
+        """Returns the decrypted thumbnail of a file through a small LRU, or None if it has none."""
+        pixmap = self._pixmaps.get(stored_name)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(stored_name)
+            return pixmap
+        key = self._thumbnail_keys.get(stored_name)
+        if key is None or stored_name not in self.thumbnails:
+            return None
+        png = self.thumbnails.get(stored_name, key)
+        if png is None:
+            return None
+        pixmap = QPixmap()
+        if not pixmap.loadFromData(png, "PNG"):
+            return None
+        self._pixmaps[stored_name] = pixmap
+        while len(self._pixmaps) > PIXMAP_CACHE_SIZE:
+            evicted, _ = self._pixmaps.popitem(last=False)
+            if evicted in self._shown:
+                self._items[evicted].setIcon(QIcon(icon_path))
+                self._shown.discard(evicted)
+        return pixmap
+
+    def store_thumbnail(self, stored_name, path, mime_type, key):
+        """Renders and stores the thumbnail of an open file in the background; path is where a viewer reads it.
+
+        pdftoppm and ffmpeg can take seconds, so the GUI thread only opens its own
+        descriptor on the plaintext, which stays readable after the viewer closes.
+        """
+        if self.thumbnails is None or not thumbnails.can_thumbnail(mime_type):
+            return
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self._queue_thumbnail_job(lambda: self._render_thumbnail(stored_name, fd, mime_type, key))
+
+    def _render_thumbnail(self, stored_name, fd, mime_type, key):
+        try:
+            if self._backfill_stop.is_set() or self.thumbnails.get(stored_name, key) is not None:
+                return
+            # External renderers run in another process, so they open the descriptor through this one
+            png = thumbnails.make_thumbnail(f"/proc/{os.getpid()}/fd/{fd}", mime_type)
+            if png:
+                self.thumbnails.put(stored_name, png, key)
+                self._thumbnail_signals.ready.emit(stored_name, mime_type, key)
+        finally:
+            os.close(fd)  # Frees the plaintext once the viewer has let go of it too
+
+    def start_backfill(self, password):
+        """Queues a background pass that shows or renders the thumbnails of the files this password opens."""
+        if self.thumbnails is None or self.manifest is None:
+            return
+        entries = dict(self.manifest.entries)
+        self._queue_thumbnail_job(lambda: thumbnails.backfill(
+            self.thumbnails, self.mount_point, entries, password, self._backfill_tried,
+            on_thumbnail=self._thumbnail_signals.ready.emit, should_stop=self._backfill_stop.is_set,
+            salt=DRIVE_SALT))
+
+    def _queue_thumbnail_job(self, job):
+        if self._backfill_thread is None:
+            self._backfill_thread = threading.Thread(target=self._backfill_worker, daemon=True)
+            self._backfill_thread.start()
+        self._backfill_queue.put(job)
+
+    def _backfill_worker(self):
+        while True:
+            job = self._backfill_queue.get()
+            if job is None:
+                return
+            try:
+                job()  # Jobs check _backfill_stop themselves, so queued ones still release what they hold
+            except Exception as e:
+                logging.error(f"Thumbnail job failed: {e}")
+
+    def on_thumbnail_ready(self, stored_name, mime_type, key):
+        self._thumbnail_keys[stored_name] = key
+        if self.manifest is not None:
+            entry = self.manifest.entries.get(stored_name)
+            if entry and not entry.get("mime"):
+                self.manifest.put(stored_name, dict(entry, mime=mime_type))
+        self._pixmaps.pop(stored_name, None)
+        self._shown.discard(stored_name)
+        self.load_visible_thumbnails()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.load_visible_thumbnails()
+
+    def refresh_files(self):
+        """Reconciles the manifest with the drive (catching files added elsewhere) and reloads the view."""
+        if self.manifest is not None:
+            try:
+                self.manifest.reconcile(self.mount_point)
+            except Exception as e:
+                logging.error(f"Failed to reconcile manifest: {e}")
+        self.load_files()
+
+    def selected_file(self):
+        """Returns (on-drive name, display name) of the selected file, or None."""
+        selected = self.selected_files_only()
+        return selected[0] if selected else None
+
+    def selected_files(self):
+        """Returns (on-drive name, display name) of every selected file, and of every file in selected folders."""
+        selected = self.selected_files_only()
+        for folder in self.selected_folders():
+            selected += [(stored_name, os.path.relpath(stored_name, self.folder or os.curdir))
+                         for stored_name in sorted(self.folder_files(folder))]
+        return selected
+
+    def selected_files_only(self):
+        """Returns (on-drive name, display name) of the selected files, leaving out selected folders."""
+        return [(item.data(Qt.ItemDataRole.UserRole), item.text()) for item in self.file_list.selectedItems()
+                if item.data(Qt.ItemDataRole.UserRole)]
+
+    def selected_folders(self):
+        """Returns the drive folders (relative paths) selected in the view, other than the parent entry."""
+        return [item.data(FOLDER_ROLE) for item in self.file_list.selectedItems()
+                if item.data(FOLDER_ROLE) is not None and item.text() != ".."]
+
+    def folder_files(self, folder):
+        """On-drive names of every file below a drive folder."""
+        prefix = folder + os.sep
+        return [stored_name for stored_name in self._entries if stored_name.startswith(prefix)]
+
+    def remove_items(self, stored_names):
+        """Takes deleted files out of the view without reloading it."""
+        self.file_list.setUpdatesEnabled(False)
+        try:
+            for stored_name in stored_names:
+                item = self._items.pop(stored_name, None)
+                if item is not None:
+                    self.file_list.takeItem(self.file_list.row(item))
+                self._shown.discard(stored_name)
+                self._pixmaps.pop(stored_name, None)
+                self._thumbnail_keys.pop(stored_name, None)
+        finally:
+            self.file_list.setUpdatesEnabled(True)
+        if not self._items:
+            self.load_files()  # Shows the empty-drive placeholder
+        else:
+            self.load_visible_thumbnails()
+
     def show_help_dialog(self):
         dialog = QDialog(self)
         dialog.setWindowTitle("Help / Instructions")
@@ -240,12 +548,20 @@ class DriveWindow(QWidget):
         instructions = """
         Please note:
         
-        • Due to the nature of decryption, we cannot determine the file type automatically.
-        • When you attempt to open a file, it will be processed through several potential viewers.
-          If the correct viewer is available, the file will be displayed as intended.
-          Otherwise, an error will be shown.
-        • Alternatively, you may download the file to your local system to determine the file type,
-          but please proceed with caution as this can pose a risk.
+        • The file type is detected from the file's contents when it is added and stored
+          encrypted alongside it (hover over a file to see it).
+        • When you open a file, it is shown in the one viewer registered for its type.
+          Files added by older versions are identified from their first decrypted bytes.
+        • Select several files with Ctrl/Shift-click (or Ctrl+A) to delete them
+          all at once; files that could not be deleted are listed afterwards.
+        • Add several files or a whole folder at once, or drop them on this
+          window. They share one password and are encrypted in the background;
+          the transfer panel lets you pause, cancel or retry each of them.
+        • Folders keep their structure on the drive: double-click one to open
+          it, select it to download or delete everything inside it.
+        • Alternatively, you may download files to your local system (several
+          at a time), but please proceed with caution as this can pose a risk.
+          Files are decrypted straight into place; nothing is left in /tmp.
         """
         
         instructions_label = QLabel(instructions)
@@ -263,111 +579,133 @@ class DriveWindow(QWidget):
         open_action = QAction("Open", self)
         download_action = QAction("Download", self)
         delete_action = QAction("Delete", self)
+        password_action = QAction("Change Password", self)
         menu.addAction(open_action)
         menu.addAction(download_action)
         menu.addAction(delete_action)
+        menu.addAction(password_action)
 
         open_action.triggered.connect(self.open_selected_file)
         download_action.triggered.connect(self.download_selected_file)
         delete_action.triggered.connect(self.delete_selected_file)
+        password_action.triggered.connect(self.change_file_password)
 
         menu.exec(self.file_list.viewport().mapToGlobal(position))
 
     def download_selected_file(self):
-        selected_items = self.file_list.selectedItems()
-        if not selected_items:
+        """Decrypts the selected files and folders to a chosen location in the background, several at a time."""
+        files = self.selected_files_only()
+        folders = self.selected_folders()
+        if not files and not folders:
             return
-        file_name = selected_items[0].text()
-        file_path = os.path.join(self.mount_point, file_name)
+        count = len(files) + sum(len(self.folder_files(folder)) for folder in folders)
 
         # Warning message to the user
         warning_message = "Downloading files may be dangerous. We strongly recommend not to download."
         reply = QMessageBox.warning(self, "Warning", warning_message,
                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                     QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
 
-        if reply == QMessageBox.StandardButton.Yes:
-            # Prompt for decryption password
-            password, ok = QInputDialog.getText(self, "Decryption Password", "Enter the decryption password:",
-                                                QLineEdit.EchoMode.Password)
-            if not ok or not password:
-                return
+        # Prompt for decryption password
+        password, ok = QInputDialog.getText(self, "Decryption Password",
+                                            "Enter the decryption password:" if count == 1 else
+                                            f"Enter the decryption password of the {count} files:",
+                                            QLineEdit.EchoMode.Password)
+        if not ok or not password:
+            return
 
-            # Prompt for sudo password
-            sudo_password, ok = QInputDialog.getText(self, "Sudo Password", "Enter your sudo password:",
-                                                     QLineEdit.EchoMode.Password)
-            if not ok or not sudo_password:
+        # A single file is saved under a chosen name (its original one rather than the
+        # on-drive '.name.enc' by default); anything more goes into a chosen folder
+        if len(files) == 1 and not folders:
+            save_path, _ = QFileDialog.getSaveFileName(self, "Save Decrypted File", files[0][1])
+            if not save_path:
+                QMessageBox.warning(self, "Error", "No save location chosen.")
                 return
+            targets = [(files[0][0], save_path, files[0][1])]
+        else:
+            directory = QFileDialog.getExistingDirectory(self, "Save Decrypted Files In")
+            if not directory:
+                QMessageBox.warning(self, "Error", "No save location chosen.")
+                return
+            targets = [(stored_name, os.path.join(directory, display_name), display_name)
+                       for stored_name, display_name in files]
+            # Folders are recreated with their structure under the chosen one
+            for folder in folders:
+                for stored_name in sorted(self.folder_files(folder)):
+                    relative = os.path.join(os.path.basename(folder), os.path.relpath(stored_name, folder))
+                    display_name = os.path.join(os.path.dirname(relative), manifest.original_name(relative))
+                    targets.append((stored_name, os.path.join(directory, display_name), display_name))
+
+        if not self.ensure_privileged(self.mount_point):
+            return
 
-            try:
-                decrypted_data = self.decrypt_file(file_path, password)
-
-                # Create a new file name without the leading dot and .enc extension
-                if file_name.startswith('.'):
-                    file_name = file_name[1:]
-                new_file_name = file_name.rsplit('.enc', 1)[0]
-
-                # Create a temporary file with decrypted data
-                temp_decrypted_file_path = os.path.join('/tmp', new_file_name)
-                with open(temp_decrypted_file_path, 'wb') as temp_file:
-                    temp_file.write(decrypted_data)
-
-                # Ask for location to save the decrypted file
-                save_path, _ = QFileDialog.getSaveFileName(self, "Save Decrypted File", new_file_name)
-                if save_path:
-                    shutil.copy(temp_decrypted_file_path, save_path)
-                    QMessageBox.information(self, "Success",
-                                            f"File '{new_file_name}' decrypted and saved at {save_path}.")
-                else:
-                    QMessageBox.warning(self, "Error", "No save location chosen.")
-
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to download and decrypt file: {e}")
-
+        # Decrypted straight to the chosen location; an interrupted large download resumes next time
+        for stored_name, destination, display_name in targets:
+            entry = self._entries.get(stored_name)
+            source = os.path.join(self.mount_point, stored_name)
+            size = entry["size"] if entry and entry.get("size") is not None else os.path.getsize(source)
+            self.transfer_panel.add(source, destination, size, password, transfer_journal.EXPORT, display_name)
+        self.transfer_panel.setVisible(True)
 
     def delete_selected_file(self):
-        selected_items = self.file_list.selectedItems()
-        if not selected_items:
+        """Deletes every selected file with one confirmation and one privileged batch."""
+        selected = self.selected_files()
+        if not selected:
             return
-        file_name = selected_items[0].text()
-        file_path = os.path.join(self.mount_point, file_name)
+        folders = self.selected_folders()
+        question = (f"Are you sure you want to delete '{selected[0][1]}'?" if len(selected) == 1 and not folders else
+                    f"Are you sure you want to delete these {len(selected)} files?")
 
-        reply = QMessageBox.warning(self, "Confirm Deletion", f"Are you sure you want to delete '{file_name}'?",
+        reply = QMessageBox.warning(self, "Confirm Deletion", question,
                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                     QMessageBox.StandardButton.No)
 
         if reply == QMessageBox.StandardButton.Yes:
-            # Prompt for sudo password
-            sudo_password, ok = QInputDialog.getText(self, "Sudo Password", "Enter your sudo password:",
-                                                     QLineEdit.EchoMode.Password)
-            if not ok or not sudo_password:
+            if not self.ensure_privileged(self.mount_point):
                 return
 
             try:
-                # Use sudo to delete the file
-                process = subprocess.run(
-                    ['sudo', '-S', 'rm', '-f', file_path],
-                    input=sudo_password + "\n",
-                    text=True,
-                    capture_output=True
-                )
-
-                if process.returncode == 0:
-                    self.load_files()  # Refresh file list after deletion
-                    QMessageBox.information(self, "Success", f"File '{file_name}' deleted successfully.")
-                else:
-                    QMessageBox.critical(self, "Error", f"Failed to delete file: {process.stderr}")
+                errors = drive_manager.delete_files([os.path.join(self.mount_point, file_name)
+                                                     for file_name, _ in selected], mount_point=self.mount_point)
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"Failed to delete files: {e}")
+                return
 
+            deleted = [file_name for (file_name, _), error in zip(selected, errors) if error is None]
+            failed = [(display_name, error) for (_, display_name), error in zip(selected, errors) if error is not None]
+            for file_name in deleted:
+                self._unflushed.pop(file_name, None)
+            try:
+                if self.manifest is not None:
+                    self.manifest.remove_many(deleted)
+                if self.thumbnails is not None:
+                    self.thumbnails.remove_many(deleted)
             except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to delete file: {e}")
+                logging.error(f"Failed to update the manifest after deleting files: {e}")
+            if folders:
+                self.load_files()  # Emptied folders disappear from the view
+            else:
+                self.remove_items(deleted)
+
+            if not failed:
+                QMessageBox.information(self, "Success", f"File '{selected[0][1]}' deleted successfully."
+                                        if len(selected) == 1 else f"Deleted {len(deleted)} files.")
+                return
+            report = QMessageBox(QMessageBox.Icon.Warning, "Delete Failed",
+                                 f"Deleted {len(deleted)} of {len(selected)} files; {len(failed)} could not be "
+                                 f"deleted.", QMessageBox.StandardButton.Ok, self)
+            report.setDetailedText("\n".join(f"{display_name}: {error}" for display_name, error in failed))
+            report.exec()
 
 
     def open_selected_file(self):
-        selected_items = self.file_list.selectedItems()
-        if not selected_items:
+        selected = self.selected_file()
+        if not selected:
             return
 
-        file_name = selected_items[0].text()
+        file_name, display_name = selected
         file_path = os.path.join(self.mount_point, file_name)
 
         password, ok = QInputDialog.getText(self, "Decryption Password", "Enter the decryption password:",
@@ -376,49 +714,43 @@ class DriveWindow(QWidget):
             return
 
         try:
-            decrypted_data = self.decrypt_file(file_path, password)
-
-            # Keep reference so FileViewer stays alive
-            self.viewer_window = FileViewer(decrypted_data)
-
-            QMessageBox.information(self, "Success", f"Decrypted and opened file '{file_name}'.")
+            key = encryption.file_key(file_path, password, DRIVE_SALT)
+            entry = self.manifest.entries.get(file_name) if self.manifest is not None else None
+            mime_type = entry.get("mime") if entry else None
+            if not mime_type:
+                # Files added before types were recorded are sniffed from their first decrypted bytes
+                mime_type = mime_sniff.sniff(encryption.decrypt_range(file_path, 0, mime_sniff.SNIFF_SIZE, key),
+                                             display_name)
+
+            # The plaintext is streamed straight into the viewer's sealed memfd, never held as bytes here.
+            # Keep references so every FileViewer stays alive until it is closed
+            viewer_window = FileViewer(lambda dst: encryption.decrypt_to_stream(file_path, dst, key), mime_type,
+                                       display_name)
+            self.viewer_windows = [viewer for viewer in self.viewer_windows if viewer.isVisible()] + [viewer_window]
+            if entry and not entry.get("mime"):
+                # Remember what was sniffed so the next open skips it
+                self.manifest.put(file_name, dict(entry, mime=mime_type))
+            thumbnail_key = thumbnails.thumbnail_key(key)
+            self._thumbnail_keys[file_name] = thumbnail_key
+            self._shown.discard(file_name)
+            self.load_visible_thumbnails()
+            if viewer_window.path:
+                self.store_thumbnail(file_name, viewer_window.path, mime_type, thumbnail_key)
+            self.start_backfill(password)
+
+            QMessageBox.information(self, "Success", f"Decrypted and opened file '{display_name}'.")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to open file: {e}")
 
 
-    def encrypt_file(self, file_path, password):
-        """Encrypt a file using AES."""
-        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-        from cryptography.hazmat.primitives import padding
-        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-        from cryptography.hazmat.primitives import hashes
-        from cryptography.hazmat.backends import default_backend
-        import os
-
-        key = self.derive_key(password)
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-        encryptor = cipher.encryptor()
-
-        with open(file_path, 'rb') as f:
-            data = f.read()
-
-        padder = padding.PKCS7(algorithms.AES.block_size).padder()
-        padded_data = padder.update(data) + padder.finalize()
-
-        encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
-        encrypted_file_path = file_path + ".enc"
-
-        with open(encrypted_file_path, 'wb') as f:
-            f.write(iv + encrypted_data)
-
-        return encrypted_file_path
-    
     def on_file_selected(self):
         # Check if any file is selected
         selected_items = self.file_list.selectedItems()
         if selected_items:
-            # Make both the delete and download buttons visible
+            # Delete and download work on the whole selection
+            count = f" ({len(selected_items)})" if len(selected_items) > 1 else ""
+            self.delete_button.setText(f"Delete{count}")
+            self.download_button.setText(f"Download{count}")
             self.delete_button.setVisible(True)
             self.download_button.setVisible(True)
         else:
@@ -441,88 +773,399 @@ class DriveWindow(QWidget):
         self.close()
 
     def add_file(self):
-        """Allow the user to select a file, encrypt it, and save it to the drive."""
+        """Allow the user to select files to encrypt and save to the drive in the background."""
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Files to Encrypt and Move")
+        if file_paths:
+            self.queue_imports(file_paths)
+
+    def add_folder(self):
+        """Queues every file inside a folder (and its subfolders)."""
+        directory = QFileDialog.getExistingDirectory(self, "Select Folder to Encrypt and Move")
+        if directory:
+            self.queue_imports([directory])
+
+    def dragEnterEvent(self, event):
+        if event.mimeData().hasUrls() and any(url.isLocalFile() for url in event.mimeData().urls()):
+            event.acceptProposedAction()
+
+    def dropEvent(self, event):
+        paths = [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+        if paths:
+            event.acceptProposedAction()
+            self.queue_imports(paths)
+
+    @staticmethod
+    def expand_paths(paths):
+        """Yields (file, folder it goes to relative to the current one) for paths and the files inside folders."""
+        for path in paths:
+            path = os.path.normpath(path)
+            if not os.path.isdir(path):
+                yield path, ""
+                continue
+            # Folders keep their structure on the drive, under the folder's own name
+            for relative, entry in sorted(drive_manager.scan_tree(path)):
+                yield entry.path, os.path.join(os.path.basename(path), os.path.dirname(relative))
+
+    def queue_imports(self, paths):
+        """Asks for one password and queues the files (and folder contents) among paths for encryption."""
         try:
             if not os.path.ismount(self.mount_point):
                 QMessageBox.warning(self, "Warning", "Partition is not mounted.")
                 return
+            files = list(self.expand_paths(paths))
+            if not files:
+                QMessageBox.information(self, "Add Files", "There are no files to add.")
+                return
 
-            file_path, _ = QFileDialog.getOpenFileName(self, "Select File to Encrypt and Move")
-            if file_path:
-                password, ok = QInputDialog.getText(self, "Encryption Password",
-                                                    "Enter the encryption password for this file:",
-                                                    QLineEdit.EchoMode.Password)
-                if not ok or not password:
+            # Names already on the drive, or about to be, are only replaced if the user says so
+            existing = set(self._entries) | {
+                os.path.relpath(transfer.destination, self.mount_point)
+                for transfer in self.transfer_panel.queue.transfers
+                if transfer.kind == transfer_journal.IMPORT
+                and transfer.status not in (transfer_queue.FAILED, transfer_queue.CANCELLED)}
+
+            def stored_name(file_path, folder, copy=1):
+                name, extension = os.path.splitext(os.path.basename(file_path))
+                suffix = f" ({copy})" if copy > 1 else ""
+                return os.path.join(self.folder, folder, f".{name}{suffix}{extension}.enc")
+
+            def exists(name):
+                return name in existing or os.path.lexists(os.path.join(self.mount_point, name))
+
+            clashes = [os.path.join(folder, os.path.basename(file_path)) for file_path, folder in files
+                       if exists(stored_name(file_path, folder))]
+            replace = False
+            if clashes:
+                box = QMessageBox(QMessageBox.Icon.Question, "Files Already Exist",
+                                  f"{len(clashes)} of the files being added already exist on the drive. Keep both "
+                                  f"(the new ones get a number) or replace the existing ones?",
+                                  QMessageBox.StandardButton.Cancel, self)
+                keep_button = box.addButton("Keep Both", QMessageBox.ButtonRole.AcceptRole)
+                replace_button = box.addButton("Replace", QMessageBox.ButtonRole.DestructiveRole)
+                box.setDefaultButton(keep_button)
+                box.setDetailedText("\n".join(clashes))
+                box.exec()
+                if box.clickedButton() not in (keep_button, replace_button):
                     return
+                replace = box.clickedButton() is replace_button
 
-                confirm_password, ok = QInputDialog.getText(self, "Encryption Password",
-                                                            "Re-enter the encryption password:",
-                                                            QLineEdit.EchoMode.Password)
-                if not ok or password != confirm_password:
-                    QMessageBox.critical(self, "Error", "Passwords do not match.")
-                    return
+            password, ok = QInputDialog.getText(self, "Encryption Password",
+                                                "Enter the encryption password for this file:" if len(files) == 1
+                                                else f"Enter the encryption password for these {len(files)} files:",
+                                                QLineEdit.EchoMode.Password)
+            if not ok or not password:
+                return
 
-                sudo_password, ok = QInputDialog.getText(self, "Sudo Password", "Enter your sudo password:",
-                                                         QLineEdit.EchoMode.Password)
-                if not ok or not sudo_password:
-                    return
+            confirm_password, ok = QInputDialog.getText(self, "Encryption Password",
+                                                        "Re-enter the encryption password:",
+                                                        QLineEdit.EchoMode.Password)
+            if not ok or password != confirm_password:
+                QMessageBox.critical(self, "Error", "Passwords do not match.")
+                return
+
+            if not self.ensure_privileged(self.mount_point):
+                return
 
-                destination = os.path.join(self.mount_point, "." + os.path.basename(file_path) + ".enc")
-                encrypted_file = self.encrypt_file(file_path, password)
-                # Use 'sudo' to move the file with provided sudo password
-                subprocess.run(["sudo", "-S", "mv", encrypted_file, destination], input=f"{sudo_password}\n", text=True,
-                               check=True)
-                QMessageBox.information(self, "Success", f"File '{os.path.basename(file_path)}' encrypted and moved.")
-                self.load_files()
+            # Files with the same name (dropped from different folders) must not overwrite each other either
+            taken = set()
+            for file_path, folder in files:
+                copy = 1
+                target = stored_name(file_path, folder)
+                while target in taken or (not replace and exists(target)):
+                    copy += 1
+                    target = stored_name(file_path, folder, copy)
+                taken.add(target)
+                self.transfer_panel.add(file_path, os.path.join(self.mount_point, target),
+                                        os.path.getsize(file_path), password, transfer_journal.IMPORT,
+                                        os.path.join(folder, os.path.basename(file_path)))
+            self.transfer_panel.setVisible(True)
+            self.start_backfill(password)
         except Exception as e:
-            logging.error(f"Failed to move and encrypt file: {e}")
-            QMessageBox.critical(self, "Error", f"Failed to move and encrypt file: {e}")
+            logging.error(f"Failed to queue files: {e}")
+            QMessageBox.critical(self, "Error", f"Failed to queue files: {e}")
+
+    def transfer_worker(self, transfer, on_bytes):
+        """Runs one queued transfer on a worker thread, so it touches no widgets; returns its result."""
+        try:
+            if transfer.kind == transfer_journal.EXPORT:
+                os.makedirs(os.path.dirname(transfer.destination), exist_ok=True)
+                return drive_manager.export_decrypted(transfer.source, transfer.destination, transfer.password,
+                                                      self.mount_point, salt=DRIVE_SALT, on_bytes=on_bytes)
+            return self.import_worker(transfer, on_bytes)
+        except transfer_queue.TransferCancelled:
+            if transfer.cancelled:
+                drive_manager.discard_transfer(transfer.kind, transfer.source, transfer.destination,
+                                               self.mount_point)
+            raise
+
+    def import_worker(self, transfer, on_bytes):
+        """Encrypts one queued file onto the drive; returns its manifest entry and storage stats."""
+        mime_type = mime_sniff.sniff_file(transfer.source)
+        # Ciphertext goes straight onto the drive; the privileged helper only does the final rename
+        start = time.monotonic()
+        digest = hashlib.sha256()
+        drive_manager.store_encrypted(transfer.source, transfer.destination, transfer.password, self.mount_point,
+                                      digest=digest, on_bytes=on_bytes)
+        elapsed = max(time.monotonic() - start, 1e-6)
+        stored_name = os.path.relpath(transfer.destination, self.mount_point)
+        key = None
+        if self.thumbnails is not None and thumbnails.can_thumbnail(mime_type):
+            # The thumbnail opens with the new file's own key, so only its password shows it
+            key = thumbnails.thumbnail_key(encryption.file_key(transfer.destination, transfer.password, DRIVE_SALT))
+            png = thumbnails.make_thumbnail(transfer.source, mime_type)
+            if png:
+                self.thumbnails.put(stored_name, png, key)
+        stats = container.storage_stats(transfer.destination)
+        logging.info(f"Stored {transfer.destination}: {stats['ratio']:.0%} of original size, "
+                     f"{stats['plaintext_bytes'] / elapsed / (1024 * 1024):.1f} MB/s effective")
+        return {"entry": manifest.new_entry(transfer.source, digest.hexdigest(), mime_type), "stats": stats,
+                "thumbnail_key": key}
+
+    def on_transfer_finished(self, transfer):
+        """Records a finished import in the manifest; the view is reloaded once a burst of them is over."""
+        if transfer.status == transfer_queue.DONE and transfer.kind == transfer_journal.IMPORT:
+            stored_name = os.path.relpath(transfer.destination, self.mount_point)
+            if self.manifest is not None:
+                # The manifest never lists a file before it is on the device; a crash before that
+                # leaves the file to reconcile()
+                self._unflushed[stored_name] = transfer.result["entry"]
+                drive_manager.sync_policy.when_durable(
+                    lambda: self.run_on_gui_thread(lambda: self.record_import(stored_name, transfer.source)))
+            if transfer.result["thumbnail_key"]:
+                self._thumbnail_keys[stored_name] = transfer.result["thumbnail_key"]
+            self._pixmaps.pop(stored_name, None)
+            self._shown.discard(stored_name)
+            self._reload_timer.start()
+        elif transfer.status == transfer_queue.FAILED:
+            logging.error(f"Failed to {transfer.kind} {transfer.source}: {transfer.error}")
+        if not self.transfer_panel.queue.active and not self._unmounting:
+            # A syncfs of a slow stick can take many seconds, so the batch is flushed off the GUI thread
+            thread = threading.Thread(target=self._flush_batch, daemon=True)
+            thread.start()
+            self._flush_threads = [t for t in self._flush_threads if t.is_alive()] + [thread]
+
+    def _flush_batch(self):
+        try:
+            drive_manager.sync_policy.batch_done()
+        except OSError as e:
+            logging.error(f"Failed to flush the drive: {e}")
+
+    def run_on_gui_thread(self, callback):
+        """Runs callback on the GUI thread: right away if called there, else from the event loop."""
+        if threading.current_thread() is threading.main_thread():
+            callback()
+        else:
+            self._call_signals.call.emit(callback)
+
+    def record_import(self, stored_name, source):
+        """Adds an imported file to the manifest once it is on the device."""
+        entry = self._unflushed.pop(stored_name, None)
+        if entry is None:
+            return  # Deleted again in the meantime
+        try:
+            self.manifest.put(stored_name, entry)
+        except Exception as e:
+            logging.error(f"Failed to update the manifest after adding {source}: {e}")
+
+    def ensure_privileged(self, directory=None):
+        """Makes sure privileged operations will not need a sudo prompt; False if the user cancelled.
+
+        Nothing is asked when directory is writable anyway or the session's helper is already running.
+        """
+        if directory is not None and not drive_manager.needs_privilege(directory):
+            return True
+        if drive_manager.privileged_running():
+            return True
+        sudo_password, ok = QInputDialog.getText(self, "Sudo Password", "Enter your sudo password:",
+                                                 QLineEdit.EchoMode.Password)
+        if not ok or not sudo_password:
+            return False
+        try:
+            drive_manager.privileged(sudo_password, self.mount_point)
+        except privileged_helper.HelperError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return False
+        return True
+
+    def resume_transfers(self, transfers):
+        """Reports what the recovery pass did on mount and offers to resume the pending transfers."""
+        if not transfers:
+            return
+        if any(t["outcome"] == transfer_journal.COMPLETED for t in transfers):
+            self.refresh_files()  # Picks completed imports up in the manifest
+
+        lines = []
+        for transfer in transfers:
+            line = f"{transfer['kind'].capitalize()} of '{os.path.basename(transfer['source'])}': {transfer['outcome']}"
+            if transfer["outcome"] == transfer_journal.PENDING:
+                line += f" ({transfer['committed'] / max(transfer['total'], 1):.0%} done)"
+            lines.append(line)
+        pending = [t for t in transfers if t["outcome"] == transfer_journal.PENDING]
+        if not pending:
+            QMessageBox.information(self, "Interrupted Transfers", "\n".join(lines))
+            return
+        reply = QMessageBox.question(self, "Interrupted Transfers",
+                                     "\n".join(lines) + "\n\nResume the pending transfers now? They also resume "
+                                                        "whenever the same file is added or downloaded again.",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.Yes)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+
+        if not self.ensure_privileged(self.mount_point):
+            return
+        for transfer in pending:
+            name = os.path.basename(transfer["source" if transfer["kind"] == transfer_journal.IMPORT
+                                             else "destination"])
+            password, ok = QInputDialog.getText(self, "Resume Transfer", f"Enter the password of '{name}':",
+                                                QLineEdit.EchoMode.Password)
+            if not ok or not password:
+                continue
+            if transfer["kind"] == transfer_journal.IMPORT:
+                # Imports carry on in the background like any other queued file
+                self.transfer_panel.add(transfer["source"], transfer["destination"], transfer["total"], password,
+                                        transfer_journal.IMPORT)
+                self.transfer_panel.setVisible(True)
+                continue
+            try:
+                drive_manager.export_decrypted(transfer["source"], transfer["destination"], password,
+                                               self.mount_point, salt=DRIVE_SALT)
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"Failed to resume '{name}': {e}")
+        self.load_files()
+
+    def change_file_password(self):
+        """Rewraps the data key of the selected file (or of every file sharing its password) under a new password."""
+        selected = self.selected_file()
+        if not selected:
+            return
+        file_name, display_name = selected
+        old_password, ok = QInputDialog.getText(self, "Current Password",
+                                                f"Enter the current password of '{display_name}':",
+                                                QLineEdit.EchoMode.Password)
+        if not ok or not old_password:
+            return
+        new_password, ok = QInputDialog.getText(self, "New Password", "Enter the new password:",
+                                                QLineEdit.EchoMode.Password)
+        if not ok or not new_password:
+            return
+        confirm_password, ok = QInputDialog.getText(self, "New Password", "Re-enter the new password:",
+                                                    QLineEdit.EchoMode.Password)
+        if not ok or new_password != confirm_password:
+            QMessageBox.critical(self, "Error", "Passwords do not match.")
+            return
+
+        reply = QMessageBox.question(self, "Change Password",
+                                     "Also change the password of every other file that uses the same password?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.No)
+        selected_path = os.path.join(self.mount_point, file_name)
+        paths = [selected_path]
+        if reply == QMessageBox.StandardButton.Yes:
+            paths += [path for path in drive_manager.drive_files(self.mount_point) if path != selected_path]
+
+        try:
+            # Only the small wrapped-key header of each file is rewritten
+            results = encryption.rekey_many(paths, old_password, new_password)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to change password: {e}")
+            return
+        if results[0]["error"] is not None:
+            QMessageBox.critical(self, "Error", f"Failed to change the password of '{display_name}': "
+                                                f"{results[0]['error']}")
+            return
+        changed = sum(result["error"] is None for result in results)
+        # Other files failing is expected when they use different passwords
+        QMessageBox.information(self, "Success", f"Changed the password of {changed} file(s).")
+
+    def verify_files(self):
+        """Checks the authentication tags of every file on the drive in the background."""
+        paths = drive_manager.drive_files(self.mount_point)
+        if not paths:
+            QMessageBox.information(self, "Verify Files", "There are no files to verify.")
+            return
+        password, ok = QInputDialog.getText(self, "Decryption Password",
+                                            "Enter the password of the files to verify:",
+                                            QLineEdit.EchoMode.Password)
+        if not ok or not password:
+            return
+        rate, ok = QInputDialog.getDouble(self, "Verify Files", "Maximum read speed in MB/s (0 for no limit):",
+                                          0, 0, 10000, 1)
+        if not ok:
+            return
+        self.scrub_dialog = ScrubDialog(paths, password, DRIVE_SALT, rate or None, self)
+        self.scrub_dialog.show()
 
     def decrypt_file(self, file_path, password):
         """Decrypt a file using AES."""
-        key = self.derive_key(password)  # Corrected reference to derive_key
-        with open(file_path, 'rb') as f:
-            iv = f.read(16)  # Read the IV (16 bytes)
-            encrypted_data = f.read()  # The encrypted data
-
-        # Use the same padding and decryption logic as during encryption
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-        decryptor = cipher.decryptor()
-        decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
-
-        # Ensure proper unpadding
-        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
-        unpadded_data = unpadder.update(decrypted_data) + unpadder.finalize()
-        return unpadded_data
-
-    def derive_key(self, password, salt=b'salt_', iterations=100000):
+        return encryption.decrypt_file(file_path, password, salt=DRIVE_SALT)
+
+    def derive_key(self, password, salt=DRIVE_SALT, iterations=encryption.ITERATIONS):
         """Derive a key from the given password."""
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=iterations,
-            backend=default_backend()
-        )
-        return kdf.derive(password.encode())
+        return encryption.derive_key(password, salt, iterations)
 
     def closeEvent(self, event):
-        reply = QMessageBox.question(self, "Confirm Exit", "Are you sure you want to exit?",
+        question = "Are you sure you want to exit?"
+        if self.transfer_panel.queue.active:
+            question = "Files are still being added; they resume when added again. " + question
+        reply = QMessageBox.question(self, "Confirm Exit", question,
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                      QMessageBox.StandardButton.No)
 
-        if reply == QMessageBox.StandardButton.Yes:
-            print("unmounting device")
-            self.unmount_drive()  # Unmount the drive before exiting
+        if reply == QMessageBox.StandardButton.Yes and self.unmount_drive():  # Unmount the drive before exiting
             event.accept()  # Close the window
         else:
             event.ignore()  # Cancel the close event
 
+    def stop_writers(self, timeout):
+        """Stops the transfer, thumbnail and flush threads; False if one still uses the drive after timeout seconds."""
+        deadline = time.monotonic() + timeout
+        stopped = self.transfer_panel.stop(timeout)  # Interrupted imports keep their journal and resume later
+        for thread in [self._backfill_thread] + self._flush_threads:
+            if thread is not None:
+                thread.join(max(0.0, deadline - time.monotonic()))
+                stopped = stopped and not thread.is_alive()
+        return stopped
+
     def unmount_drive(self):
+        """Stops everything using the drive, flushes it and unmounts it.
+
+        Returns False, leaving the drive mounted, if something was still writing to
+        it and the user chose not to wait any longer.
+        """
+        print("unmounting device")
+        self._unmounting = True
+        self._backfill_stop.set()
+        self._backfill_queue.put(None)
+        while not self.stop_writers(STOP_WAIT_S):
+            reply = QMessageBox.warning(self, "Files Still Being Written",
+                                        "A file is still being written to the drive; unmounting now could damage "
+                                        "it.\n\nKeep waiting? Cancel leaves the drive mounted.",
+                                        QMessageBox.StandardButton.Retry | QMessageBox.StandardButton.Cancel,
+                                        QMessageBox.StandardButton.Retry)
+            if reply != QMessageBox.StandardButton.Retry:
+                self._unmounting = False
+                return False
+        QCoreApplication.processEvents()  # Delivers what the stopped threads reported, e.g. imports to record
+        self._pixmaps.clear()
+        self._thumbnail_keys.clear()
+        for viewer in self.viewer_windows:
+            viewer.close()  # Plaintext lent to viewers must not outlive the mounted drive
+        self.viewer_windows = []
+        logging.info(f"Key cache stats: {key_cache.stats()}")
+        key_cache.clear()  # Derived keys must not outlive the mounted drive
         try:
-            subprocess.run(['sudo', 'umount', self.mount_point], check=True)
+            drive_manager.sync_policy.sync()
+        except OSError as e:
+            logging.error(f"Failed to flush the drive: {e}")
+        if not self.ensure_privileged():
+            return True  # Left mounted, but nothing writes to it any more
+        try:
+            drive_manager.privileged().unmount()
+            drive_manager.stop_privileged()
             QMessageBox.information(self, "Unmounted", "Drive successfully unmounted.")
-        except subprocess.CalledProcessError:
-
+        except privileged_helper.HelperError as e:
+            logging.error(f"Failed to unmount the drive: {e}")
             QMessageBox.warning(self, "Error", "Failed to unmount the drive.")
+        return True
 
@@ -1,31 +1,62 @@
 import sys
-import io
 import subprocess
 import os
-import random
-import time
-import threading
+import mimetypes
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QPushButton, QVBoxLayout,
     QLabel, QMessageBox
 )
 from PyQt6.QtCore import Qt
-from PIL import Image
+import handoff
+import mime_sniff
+
+# MIME type prefix -> viewer method; the first match wins and anything else goes to open_with_default
+VIEWERS = [
+    ("text/", "open_as_text"),
+    ("application/pdf", "open_as_pdf"),
+    ("image/", "open_as_image"),
+    ("audio/", "open_as_audio"),
+    ("video/", "open_as_video"),
+]
+
+
+def viewer_for(mime_type):
+    """Name of the FileViewer method that handles mime_type."""
+    for prefix, method in VIEWERS:
+        if mime_type.startswith(prefix):
+            return method
+    return "open_with_default"
 
 
 class FileViewer(QWidget):
-    def __init__(self, decrypted_data):
+    """Lends plaintext to the desktop viewer for its type until this window is closed.
+
+    plaintext is bytes or a callable write(f) that streams the decrypted file into
+    f (see handoff.Handoff); with a callable, mime_type has to be given. Errors
+    while decrypting propagate out of the constructor.
+    """
+
+    def __init__(self, plaintext, mime_type=None, name=None):
         super().__init__()
-        self.decrypted_data = decrypted_data
+        self.plaintext = plaintext
+        self.name = name
+        self.handoffs = []  # Plaintext lent to external viewers; freed when this window closes
+        self.mime_type = mime_type or mime_sniff.sniff(plaintext[:mime_sniff.SNIFF_SIZE], name)
         self.init_ui()
 
+    @property
+    def path(self):
+        """Where the plaintext can be read while the window is open, or None."""
+        return self.handoffs[0].path if self.handoffs else None
+
     def init_ui(self):
-        self.setWindowTitle("Simultaneous File Viewer")
+        self.setWindowTitle("File Viewer")
         self.setGeometry(200, 200, 400, 200)
 
         layout = QVBoxLayout()
 
-        self.label = QLabel("Opening file with all possible viewers...", self)
+        self.label = QLabel(f"Opening {self.mime_type} file...\n"
+                            f"Close this window when you are done to release the decrypted copy.", self)
         self.label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.label)
 
@@ -35,71 +66,59 @@ class FileViewer(QWidget):
 
         self.setLayout(layout)
 
-        # Start all viewers in separate threads
-        threading.Thread(target=self.open_as_text, daemon=True).start()
-        threading.Thread(target=self.open_as_pdf, daemon=True).start()
-        threading.Thread(target=self.open_as_image, daemon=True).start()
-        threading.Thread(target=self.open_as_audio, daemon=True).start()
-        threading.Thread(target=self.open_as_video, daemon=True).start()
+        # Start only the viewer registered for this type; handing the data over takes no disk I/O
+        getattr(self, viewer_for(self.mime_type))()
 
         self.show()
 
-    def overwrite_with_noise(self, file_path):
-        try:
-            with open(file_path, "wb") as f:
-                f.write(os.urandom(1024 * 100))  # 100KB of random noise
-        except Exception as e:
-            print(f"[ERROR] Overwriting failed: {e}")
-
     def safe_open(self, extension, viewer_func):
+        """Hands the plaintext to viewer_func(path) from memory (see handoff); nothing is written to disk."""
+        name = self.name or "file"
+        if mimetypes.guess_type(name)[0] != self.mime_type and not name.lower().endswith("." + extension):
+            name = f"{name}.{extension}"  # The viewer application is chosen by extension
+        self.handoffs.append(handoff.Handoff(self.plaintext, name))
+        self.plaintext = None  # Only the sealed copy is kept
         try:
-            temp_file = f"tempfile_{extension}.{extension}"
-            with open(temp_file, "wb") as f:
-                f.write(self.decrypted_data)
-
-            viewer_func(temp_file)
-
-            time.sleep(10)
-            self.overwrite_with_noise(temp_file)
-            time.sleep(1)
-            os.remove(temp_file)
-
+            viewer_func(self.path)
         except Exception as e:
             print(f"[ERROR] Opening {extension} failed: {e}")
 
     def open_as_text(self):
-        try:
-            text = self.decrypted_data.decode("utf-8")
-            temp_file = "tempfile.txt"
-            with open(temp_file, "w", encoding="utf-8") as f:
-                f.write(text)
-
-            subprocess.Popen(["xdg-open", temp_file])
-
-            time.sleep(10)
-            self.overwrite_with_noise(temp_file)
-            time.sleep(1)
-            os.remove(temp_file)
-        except Exception:
-            pass
+        self.safe_open("txt", lambda f: subprocess.Popen(["xdg-open", f]))
 
     def open_as_pdf(self):
         self.safe_open("pdf", lambda f: subprocess.Popen(["xdg-open", f]))
 
     def open_as_audio(self):
-        self.safe_open("mp3", lambda f: subprocess.Popen(["xdg-open", f]))
+        self.safe_open(self.extension("mp3"), lambda f: subprocess.Popen(["xdg-open", f]))
 
     def open_as_video(self):
-        self.safe_open("mp4", lambda f: subprocess.Popen(["xdg-open", f]))
+        self.safe_open(self.extension("mp4"), lambda f: subprocess.Popen(["xdg-open", f]))
 
     def open_as_image(self):
-        try:
-            img = Image.open(io.BytesIO(self.decrypted_data))
-            img.show()
-        except Exception:
-            pass
+        # PIL's Image.show() would write a PNG copy to /tmp, so images go through the desktop viewer too
+        self.safe_open(self.extension("png"), lambda f: subprocess.Popen(["xdg-open", f]))
+
+    def open_with_default(self):
+        self.safe_open(self.extension("bin"), lambda f: subprocess.Popen(["xdg-open", f]))
+
+    def extension(self, fallback):
+        """File extension that makes xdg-open pick the right application for this type."""
+        extension = mimetypes.guess_extension(self.mime_type)
+        return extension.lstrip(".") if extension else fallback
+
+    def release(self):
+        """Frees the plaintext lent to viewers; viewers that still have it open keep their own reference."""
+        for shared in self.handoffs:
+            try:
+                shared.close()
+            except OSError as e:
+                print(f"[ERROR] Releasing {shared.path} failed: {e}")
+        self.handoffs = []
+        self.plaintext = None
 
     def closeEvent(self, event):
+        self.release()
         event.accept()
 
 
@@ -7,7 +7,10 @@ import subprocess
 import os
 
 from drive_manager import MOUNT_POINT
+import drive_manager
+import privileged_helper
 from gui.drive_window import DriveWindow  # Ensure correct relative path
+import manifest
 
 
 class PasswordWindow(QWidget):
@@ -138,7 +141,7 @@ class PasswordWindow(QWidget):
                                                  QLineEdit.EchoMode.Password)
         if ok and sudo_password:
             if self.unlock_drive(password, sudo_password):
-                self.open_drive_window()
+                self.open_drive_window(password, sudo_password)
             else:
                 QMessageBox.critical(self, "Error", "Failed to unlock drive. Incorrect password or insufficient permissions.")
         else:
@@ -147,29 +150,20 @@ class PasswordWindow(QWidget):
     def unlock_drive(self, password, sudo_password):
         CRYPT_NAME = "encrypted_partition"
         try:
+            # Started once here; later adds, deletes and the unmount reuse it without asking again
+            helper = drive_manager.privileged(sudo_password, self.mount_point)
             self.pre_checks(sudo_password)
 
-            subprocess.run(
-                ["sudo", "cryptsetup", "luksOpen", self.device_name, CRYPT_NAME],
-                input=password.encode('utf-8') + b'\n',  # Add newline for password input
-                check=True,
-                stderr=subprocess.PIPE
-            )
+            helper.luks_open(self.device_name, CRYPT_NAME, password)
 
             if not os.path.exists(self.mount_point):
                 os.makedirs(self.mount_point)
 
-            subprocess.run(
-                ["sudo", "mount", f"/dev/mapper/{CRYPT_NAME}", self.mount_point],
-                input=sudo_password.encode('utf-8') + b'\n',  # Add newline for sudo password
-                check=True,
-                stderr=subprocess.PIPE
-            )
+            helper.mount(CRYPT_NAME)
             return True
-        except subprocess.CalledProcessError as e:
-            error_message = e.stderr.decode().strip()
-            print(f"Failed to unlock drive: {e} - {error_message}")
-            QMessageBox.critical(self, "Error", f"Failed to unlock drive: {error_message}")
+        except privileged_helper.HelperError as e:
+            print(f"Failed to unlock drive: {e}")
+            QMessageBox.critical(self, "Error", f"Failed to unlock drive: {e}")
             return False
         except Exception as e:
             print(f"Unexpected error: {e}")
@@ -179,34 +173,30 @@ class PasswordWindow(QWidget):
     def pre_checks(self, sudo_password):
         CRYPT_NAME = "encrypted_partition"
         try:
+            helper = drive_manager.privileged(sudo_password, self.mount_point)
             if os.path.ismount(self.mount_point):
-                subprocess.run(
-                    ["sudo", "-S", "umount", self.mount_point],
-                    input=sudo_password.encode('utf-8') + b'\n', check=True,
-                    stderr=subprocess.PIPE
-                )
-
-            luks_status = subprocess.run(
-                ["sudo", "-S", "cryptsetup", "status", CRYPT_NAME],
-                capture_output=True, input=sudo_password.encode('utf-8') + b'\n'
-            )
-            luks_stdout = luks_status.stdout.decode('utf-8')
+                helper.unmount()
 
-            if "is active" in luks_stdout:
-                subprocess.run(
-                    ["sudo", "-S", "cryptsetup", "luksClose", CRYPT_NAME],
-                    input=sudo_password.encode('utf-8') + b'\n', check=True,
-                    stderr=subprocess.PIPE
-                )
+            if helper.luks_status(CRYPT_NAME):
+                helper.luks_close(CRYPT_NAME)
 
             return True
-        except subprocess.CalledProcessError as e:
-            error_message = e.stderr.decode().strip()
-            print(f"Pre-checks failed: {e} - {error_message}")
-            QMessageBox.critical(self, "Error", f"Pre-checks failed: {error_message}")
+        except privileged_helper.HelperError as e:
+            print(f"Pre-checks failed: {e}")
+            QMessageBox.critical(self, "Error", f"Pre-checks failed: {e}")
             return False
 
-    def open_drive_window(self):
+    def open_drive_window(self, password=None, sudo_password=None):
+        # The drive password also unlocks the encrypted file index; without it the drive is just listed
+        file_manifest = self.open_manifest(password, sudo_password) if password else None
+
+        # Finish or roll back transfers cut short by unplugging the stick or a crash
+        try:
+            transfers = drive_manager.recover_transfers(self.mount_point, sudo_password, password)
+        except Exception as e:
+            print(f"Could not recover interrupted transfers: {e}")
+            transfers = []
+
         # Hide the password-related widgets
         self.label.setVisible(False)
         self.password_input.setVisible(False)
@@ -220,12 +210,54 @@ class PasswordWindow(QWidget):
              child.widget().setParent(None)
 
         # Load DriveWindow inside the current window (self)
-        self.drive_window = DriveWindow(self.mount_point, self.previous_window)
+        self.drive_window = DriveWindow(self.mount_point, self.previous_window, file_manifest)
         self._layout.addWidget(self.drive_window)
+        if password:
+            # Files are often encrypted with the drive password, so it is tried first for missing thumbnails
+            self.drive_window.start_backfill(password)
+        self.drive_window.resume_transfers(transfers)
 
         # Refresh layout to ensure proper rendering
         self.setLayout(self._layout)
 
+    def open_manifest(self, password, sudo_password):
+        """Opens the drive's file index; one locked with an earlier drive password is re-locked or rebuilt on request."""
+        try:
+            return manifest.open_manifest(self.mount_point, password, sudo_password)
+        except manifest.ManifestKeyError:
+            pass
+        except Exception as e:
+            print(f"Could not open file manifest: {e}")
+            return None
+
+        while True:
+            box = QMessageBox(QMessageBox.Icon.Question, "File Index Locked",
+                              "The file index of this drive is locked with another drive password, for example "
+                              "the one before it was changed. Enter that password to re-lock the index with the "
+                              "current one, or rebuild the index from the files on the drive (stored file types "
+                              "and checksums are lost; the old index is kept aside).",
+                              QMessageBox.StandardButton.NoButton, self)
+            previous_button = box.addButton("Enter Previous Password", QMessageBox.ButtonRole.AcceptRole)
+            rebuild_button = box.addButton("Rebuild Index", QMessageBox.ButtonRole.DestructiveRole)
+            box.addButton("Skip", QMessageBox.ButtonRole.RejectRole)
+            box.setDefaultButton(previous_button)
+            box.exec()
+            try:
+                if box.clickedButton() is rebuild_button:
+                    return manifest.rebuild_manifest(self.mount_point, password, sudo_password)
+                if box.clickedButton() is not previous_button:
+                    return None  # The drive is just listed, as without a manifest
+                previous_password, ok = QInputDialog.getText(self, "Previous Drive Password",
+                                                             "Enter the previous drive password:",
+                                                             QLineEdit.EchoMode.Password)
+                if ok and previous_password:
+                    return manifest.rewrap_manifest(self.mount_point, previous_password, password, sudo_password)
+            except manifest.ManifestKeyError:
+                QMessageBox.warning(self, "Error", "That password does not open the file index either.")
+            except Exception as e:
+                print(f"Could not open file manifest: {e}")
+                return None
+
     def change_password(self):
         current_password, ok = QInputDialog.getText(self, 'Current Password',
                                                     'Enter current password:',
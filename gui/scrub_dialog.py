@@ -0,0 +1,126 @@
+import threading
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QProgressBar, QTextEdit
+from PyQt6.QtCore import QObject, pyqtSignal
+import scrub
+
+
+class ScrubSignals(QObject):
+    """Carries scrub progress from the worker thread over to the GUI thread."""
+    progress = pyqtSignal(object, object)  # Byte counts can exceed a 32-bit int
+    finished = pyqtSignal(dict)
+
+
+class ScrubDialog(QDialog):
+    """Runs an integrity scrub in the background with pause/resume and shows the report."""
+
+    def __init__(self, paths, password, salt, rate_limit_mb_s=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Verify Files")
+        self.setGeometry(300, 200, 520, 360)
+        self.setStyleSheet("""
+            QDialog {
+                background-color: #1d1f21;
+                border-radius: 8px;
+            }
+            QLabel {
+                color: #ffffff;
+                font-size: 14px;
+                padding: 6px;
+            }
+            QTextEdit {
+                background-color: #272727;
+                color: #f4f4f4;
+                font-family: monospace;
+            }
+            QPushButton {
+                background-color: #94e2d5;
+                color: #1e1e2e;
+                padding: 8px 14px;
+                border-radius: 6px;
+                border: none;
+                font-size: 15px;
+            }
+            QPushButton:hover {
+                background-color: #a6e3a1;
+            }
+        """)
+
+        self.signals = ScrubSignals()
+        self.signals.progress.connect(self.on_progress)
+        self.signals.finished.connect(self.on_finished)
+        self.scrubber = scrub.Scrubber(paths, password, rate_limit_mb_s=rate_limit_mb_s, salt=salt,
+                                       progress=self.signals.progress.emit)
+
+        layout = QVBoxLayout()
+        self.status_label = QLabel(f"Verifying {len(paths)} files...")
+        layout.addWidget(self.status_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        layout.addWidget(self.progress_bar)
+        self.report_view = QTextEdit()
+        self.report_view.setReadOnly(True)
+        self.report_view.setVisible(False)
+        layout.addWidget(self.report_view)
+
+        button_layout = QHBoxLayout()
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.clicked.connect(self.toggle_pause)
+        button_layout.addWidget(self.pause_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_or_close)
+        button_layout.addWidget(self.cancel_button)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+        self.finished_report = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            report = self.scrubber.run()
+        except Exception as e:
+            print(f"[ERROR] Scrub failed: {e}")
+            report = self.scrubber.report(error=str(e))
+        self.signals.finished.emit(report)  # Always, so the dialog never waits forever
+
+    def on_progress(self, done, total):
+        if total:
+            self.progress_bar.setValue(min(int(done * 1000 / total), 1000))
+        self.status_label.setText(f"Verified {done / scrub.MB:.0f} of {total / scrub.MB:.0f} MB"
+                                  + (" (paused)" if self.scrubber.paused else ""))
+
+    def toggle_pause(self):
+        if self.scrubber.paused:
+            self.scrubber.resume()
+            self.pause_button.setText("Pause")
+        else:
+            self.scrubber.pause()
+            self.pause_button.setText("Resume")
+
+    def cancel_or_close(self):
+        if self.finished_report is None:
+            self.scrubber.cancel()
+        else:
+            self.accept()
+
+    def on_finished(self, report):
+        self.finished_report = report
+        self.progress_bar.setValue(1000)
+        failed = [result for result in report["files"] if result["status"] != scrub.OK]
+        if report.get("error"):
+            self.status_label.setText("The scrub stopped early")
+        elif failed:
+            self.status_label.setText(f"{len(failed)} of {len(report['files'])} files need attention, "
+                                      f"{report['mb_per_s']:.1f} MB/s")
+        else:
+            self.status_label.setText(f"All {len(report['files'])} files verified, {report['mb_per_s']:.1f} MB/s")
+        self.report_view.setPlainText(scrub.format_report(report))
+        self.report_view.setVisible(True)
+        self.pause_button.setVisible(False)
+        self.cancel_button.setText("Close")
+
+    def closeEvent(self, event):
+        if self.finished_report is None:
+            self.scrubber.cancel()
+        event.accept()
+
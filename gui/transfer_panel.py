@@ -0,0 +1,182 @@
+from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QProgressBar, QTreeWidget,
+                             QTreeWidgetItem, QAbstractItemView)
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+import transfer_queue
+
+REFRESH_MS = 500  # How often speeds and ETAs are redrawn while transfers run
+
+
+class TransferSignals(QObject):
+    """Carries transfer state changes from the worker threads over to the GUI thread."""
+    changed = pyqtSignal(object)
+
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024 or unit == "GB":
+            break
+        count /= 1024
+    return f"{count:.1f} {unit}"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "-"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class TransferPanel(QWidget):
+    """Queue of background transfers with per-file and overall progress, speed and ETA.
+
+    process(transfer, on_bytes) runs each transfer on a worker thread (see
+    transfer_queue.TransferQueue); finished(transfer) is emitted on the GUI thread
+    whenever one is done, has failed or was cancelled.
+    """
+    finished = pyqtSignal(object)
+
+    def __init__(self, process, workers=transfer_queue.WORKERS, parent=None):
+        super().__init__(parent)
+        self.setStyleSheet("""
+            QTreeWidget {
+                background-color: #1d1f21;
+                color: #f4f4f4;
+                font-size: 13px;
+                border: none;
+            }
+            QLabel {
+                font-size: 14px;
+                font-weight: normal;
+                padding: 4px;
+            }
+            QPushButton {
+                background-color: #94e2d5;
+                color: #1e1e2e;
+                padding: 6px 12px;
+                border-radius: 6px;
+                border: none;
+                font-size: 13px;
+            }
+            QPushButton:hover {
+                background-color: #a6e3a1;
+            }
+        """)
+
+        self.signals = TransferSignals()
+        self.signals.changed.connect(self.on_changed)
+        self.queue = transfer_queue.TransferQueue(process, workers, on_change=self.signals.changed.emit)
+        self._rows = {}  # Transfer id -> (tree item, progress bar)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.summary_label = QLabel("No transfers")
+        layout.addWidget(self.summary_label)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["File", "Progress", "Speed", "ETA", "Status"])
+        self.tree.setRootIsDecorated(False)
+        self.tree.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.tree.setColumnWidth(0, 260)
+        self.tree.setColumnWidth(1, 160)
+        layout.addWidget(self.tree)
+
+        button_layout = QHBoxLayout()
+        for label, action in (("Pause", self.queue.pause), ("Resume", self.queue.resume),
+                              ("Cancel", self.queue.cancel), ("Retry", self.queue.retry)):
+            button = QPushButton(label)
+            button.setToolTip(f"{label} the selected transfers, or all of them if none is selected")
+            button.clicked.connect(lambda _, action=action: self.apply(action))
+            button_layout.addWidget(button)
+        button_layout.addStretch()
+        clear_button = QPushButton("Clear Finished")
+        clear_button.clicked.connect(self.clear_finished)
+        button_layout.addWidget(clear_button)
+        hide_button = QPushButton("Hide")
+        hide_button.clicked.connect(lambda: self.setVisible(False))
+        button_layout.addWidget(hide_button)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def add(self, source, destination, size, password, kind=None, name=None):
+        """Queues a transfer and starts the progress display."""
+        transfer = self.queue.add(source, destination, size, password, kind, name)
+        if not self.timer.isActive():
+            self.timer.start()
+        return transfer
+
+    def selected_transfers(self):
+        ids = {id(item) for item in self.tree.selectedItems()}
+        return [t for t in self.queue.transfers if t.id in self._rows and id(self._rows[t.id][0]) in ids]
+
+    def apply(self, action):
+        """Applies a queue action to the selected transfers, or to all of them."""
+        for transfer in self.selected_transfers() or list(self.queue.transfers):
+            action(transfer)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def clear_finished(self):
+        self.queue.clear_finished()
+        kept = {transfer.id for transfer in self.queue.transfers}
+        for transfer_id in [transfer_id for transfer_id in self._rows if transfer_id not in kept]:
+            item, _ = self._rows.pop(transfer_id)
+            self.tree.takeTopLevelItem(self.tree.indexOfTopLevelItem(item))
+        self.refresh()
+
+    def _row(self, transfer):
+        row = self._rows.get(transfer.id)
+        if row is None:
+            item = QTreeWidgetItem([transfer.name, "", "", "", ""])
+            item.setToolTip(0, f"{transfer.source}\n→ {transfer.destination}")
+            self.tree.addTopLevelItem(item)
+            bar = QProgressBar()
+            bar.setRange(0, 1000)
+            self.tree.setItemWidget(item, 1, bar)
+            row = self._rows[transfer.id] = (item, bar)
+        return row
+
+    def _update_row(self, transfer):
+        item, bar = self._row(transfer)
+        bar.setValue(int(transfer.done * 1000 / transfer.size) if transfer.size else
+                     1000 if transfer.status == transfer_queue.DONE else 0)
+        running = transfer.status == transfer_queue.RUNNING
+        item.setText(2, f"{format_bytes(transfer.rate)}/s" if running else "")
+        item.setText(3, format_eta(transfer.eta) if running else "")
+        item.setText(4, transfer.status.capitalize() + (f": {transfer.error}" if transfer.error else ""))
+        item.setToolTip(4, transfer.error or "")
+
+    def on_changed(self, transfer):
+        self._update_row(transfer)
+        if transfer.status in transfer_queue.FINISHED:
+            self.finished.emit(transfer)
+        self.refresh()
+
+    def refresh(self):
+        for transfer in list(self.queue.transfers):
+            self._update_row(transfer)
+        stats = self.queue.stats()
+        if not stats["files"]:
+            self.summary_label.setText("No transfers")
+        else:
+            text = (f"{stats['files_done']} of {stats['files']} files, {format_bytes(stats['bytes'])} of "
+                    f"{format_bytes(stats['total'])}")
+            if self.queue.active:
+                text += f", {format_bytes(stats['bytes_per_s'])}/s, ETA {format_eta(stats['eta'])}"
+            if stats["failed"]:
+                text += f", {stats['failed']} failed"
+            self.summary_label.setText(text)
+        if not self.queue.active:
+            self.timer.stop()
+
+    def stop(self, timeout=None):
+        """Interrupts whatever is running; interrupted imports resume from their journal next time.
+
+        Returns False if a transfer is still writing after timeout seconds (see TransferQueue.stop).
+        """
+        self.timer.stop()
+        return self.queue.stop(timeout)
@@ -0,0 +1,101 @@
+import os
+import fcntl
+import tempfile
+
+# Decrypted files are handed to external viewers without touching a disk. The
+# plaintext lives in an anonymous memfd that only this process holds; the viewer
+# opens it through a symlink named like the original file (so it picks the right
+# application) that points at /proc/<pid>/fd/<fd>. The symlink sits in a private
+# directory under the user's runtime directory, which is tmpfs. Closing the
+# handoff removes the link and frees the memory.
+DIRECTORY_PREFIX = "secureusb-view-"
+SEALS = ("F_SEAL_SEAL", "F_SEAL_SHRINK", "F_SEAL_GROW", "F_SEAL_WRITE")  # The viewer cannot change the data
+TMPFS_DIRS = ("/dev/shm",)  # Memory-backed directories to fall back on without XDG_RUNTIME_DIR
+
+
+def runtime_dir():
+    """A memory-backed directory only this user can use, or the temp directory as a last resort."""
+    candidates = [os.environ.get("XDG_RUNTIME_DIR")] + list(TMPFS_DIRS)
+    for directory in candidates:
+        if directory and os.path.isdir(directory) and os.access(directory, os.W_OK):
+            return directory
+    print("[WARN] No tmpfs directory found; decrypted files for viewers go to the temp directory.")
+    return tempfile.gettempdir()
+
+
+def _write_all(fd, data):
+    data = memoryview(data).cast('B')
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _fill(fd, data):
+    """Writes data (bytes, or a callable that streams into the file object it is given) to fd."""
+    if not callable(data):
+        _write_all(fd, data)
+        return
+    with os.fdopen(fd, 'wb', closefd=False) as f:
+        data(f)
+
+
+def _seal(fd):
+    seals = 0
+    for name in SEALS:
+        seals |= getattr(fcntl, name, 0)
+    if hasattr(fcntl, "F_ADD_SEALS"):
+        fcntl.fcntl(fd, fcntl.F_ADD_SEALS, seals)
+
+
+class Handoff:
+    """Plaintext another process can open at self.path until close().
+
+    data is bytes or a callable write(f) that streams the plaintext into f, so a
+    large file is never held in memory twice. in_memory tells whether a sealed
+    memfd is used; without memfd_create the data is written to a private file in
+    runtime_dir() instead, which is tmpfs on ordinary Linux desktops and is
+    removed by close().
+    """
+
+    def __init__(self, data, name):
+        name = os.path.basename(name) or "file"
+        self._directory = tempfile.mkdtemp(prefix=DIRECTORY_PREFIX, dir=runtime_dir())
+        self.path = os.path.join(self._directory, name)
+        self.fd = None
+        self.in_memory = False
+        try:
+            try:
+                self.fd = os.memfd_create(name, os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+                _fill(self.fd, data)
+                _seal(self.fd)
+                os.symlink(f"/proc/{os.getpid()}/fd/{self.fd}", self.path)
+                self.in_memory = True
+            except (AttributeError, OSError):
+                if self.fd is not None:
+                    os.close(self.fd)
+                    self.fd = None
+                if os.path.lexists(self.path):
+                    os.remove(self.path)
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                try:
+                    _fill(fd, data)
+                finally:
+                    os.close(fd)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """Removes the path and frees the plaintext; a viewer that already opened it keeps its copy."""
+        if os.path.lexists(self.path):
+            os.remove(self.path)
+        if os.path.isdir(self._directory):
+            os.rmdir(self._directory)
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,37 @@
+import os
+import json
+import platform
+import tempfile
+
+PROFILE_PATH = os.path.join(os.path.expanduser("~"), ".config", "secureusb", "host_profile.json")
+
+
+def _read_profile():
+    try:
+        with open(PROFILE_PATH, 'r') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # A profile copied from another machine says nothing about this one
+    if profile.get("machine") != platform.machine() or profile.get("node") != platform.node():
+        return {}
+    return profile
+
+
+def load(section):
+    """Returns a cached benchmark result for this host, or None."""
+    return _read_profile().get(section)
+
+
+def store(section, value):
+    """Caches a benchmark result for this host."""
+    profile = _read_profile()
+    profile.update({"machine": platform.machine(), "node": platform.node(), section: value})
+    try:
+        os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(PROFILE_PATH))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(profile, f, indent=2)
+        os.replace(temp_path, PROFILE_PATH)
+    except OSError as e:
+        print(f"[WARN] Could not save host profile: {e}")
@@ -0,0 +1,89 @@
+import os
+import time
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+import host_profile
+import key_cache
+
+PBKDF2 = "pbkdf2-sha256"
+SCRYPT = "scrypt"
+DEFAULT_KDF = PBKDF2
+TARGET_SECONDS = 0.25  # Derivation time the calibration aims for
+KEY_LENGTH = 32
+SALT_SIZE = 16
+
+# Calibration never goes below these costs, however slow the host is
+PBKDF2_MIN_ITERATIONS = 100000
+SCRYPT_MIN_N = 2 ** 14
+SCRYPT_MAX_N = 2 ** 20
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+_session_salt = None
+
+
+def _build(params):
+    salt = bytes.fromhex(params["salt"])
+    if params["name"] == PBKDF2:
+        return PBKDF2HMAC(algorithm=hashes.SHA256(), length=KEY_LENGTH, salt=salt,
+                          iterations=params["iterations"], backend=default_backend())
+    if params["name"] == SCRYPT:
+        return Scrypt(salt=salt, length=KEY_LENGTH, n=params["n"], r=params["r"], p=params["p"],
+                      backend=default_backend())
+    raise ValueError(f"Unsupported KDF {params['name']}")
+
+
+def derive(password, params):
+    """Derives a key from a password with the KDF described by params."""
+    cost = tuple(sorted((k, v) for k, v in params.items() if k != "salt"))
+    return key_cache.get_or_derive(password, bytes.fromhex(params["salt"]), cost,
+                                   lambda: _build(params).derive(password.encode()))
+
+
+def _time_derivation(params):
+    start = time.perf_counter()
+    _build(params).derive(b"calibration")
+    return time.perf_counter() - start
+
+
+def calibrate(name=DEFAULT_KDF, target=TARGET_SECONDS):
+    """Benchmarks this host and returns KDF cost parameters that take about target seconds."""
+    salt = os.urandom(SALT_SIZE).hex()
+    if name == PBKDF2:
+        probe = 20000
+        elapsed = _time_derivation({"name": PBKDF2, "salt": salt, "iterations": probe})
+        iterations = int(probe * target / max(elapsed, 1e-6)) // 10000 * 10000
+        return {"name": PBKDF2, "iterations": max(iterations, PBKDF2_MIN_ITERATIONS)}
+    if name == SCRYPT:
+        n = SCRYPT_MIN_N
+        elapsed = _time_derivation({"name": SCRYPT, "salt": salt, "n": n, "r": SCRYPT_R, "p": SCRYPT_P})
+        # scrypt cost is linear in n, so keep doubling while the next step stays under target
+        while n < SCRYPT_MAX_N and elapsed * 2 <= target:
+            n *= 2
+            elapsed *= 2
+        return {"name": SCRYPT, "n": n, "r": SCRYPT_R, "p": SCRYPT_P}
+    raise ValueError(f"Unsupported KDF {name}")
+
+
+def calibrated_params(name=DEFAULT_KDF):
+    """Returns the cost parameters for this host, calibrating only the first time."""
+    section = f"kdf_{name}"
+    params = host_profile.load(section)
+    if not params:
+        params = calibrate(name)
+        host_profile.store(section, params)
+    return params
+
+
+def session_params(name=DEFAULT_KDF):
+    """Returns KDF parameters for new files.
+
+    Files written in the same session share one random salt, so the key cache
+    can serve every one of them after a single derivation.
+    """
+    global _session_salt
+    if _session_salt is None:
+        _session_salt = os.urandom(SALT_SIZE).hex()
+    return dict(calibrated_params(name), salt=_session_salt)
@@ -0,0 +1,101 @@
+import os
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_TTL = 15 * 60  # Seconds a derived key may be reused without re-running the KDF
+DEFAULT_MAX_ENTRIES = 32
+
+
+class KeyCache:
+    """Process-wide LRU cache of derived keys with expiry and zeroization on eviction."""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (fingerprint, salt, params) -> (bytearray key, expiry)
+        self._lock = threading.Lock()
+        # Passwords are never stored; fingerprints use a random per-process HMAC key
+        # so they are useless outside this process.
+        self._pepper = os.urandom(32)
+
+    def fingerprint(self, password):
+        """Returns a process-local fingerprint of a password."""
+        return hmac.new(self._pepper, password.encode(), hashlib.sha256).digest()
+
+    def get_or_derive(self, password, salt, params, derive):
+        """Returns the cached key for (password, salt, params), calling derive() on a miss."""
+        cache_key = (self.fingerprint(password), bytes(salt), params)
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return bytes(entry[0])
+            self.misses += 1
+
+        # Derive outside the lock so unrelated derivations do not queue behind each other
+        key = derive()
+
+        with self._lock:
+            if cache_key not in self._entries:
+                self._entries[cache_key] = (bytearray(key), time.monotonic() + self.ttl)
+                while len(self._entries) > self.max_entries:
+                    self._evict(next(iter(self._entries)))
+        return key
+
+    def _expire(self, now):
+        for cache_key in [k for k, (_, expiry) in self._entries.items() if expiry <= now]:
+            self._evict(cache_key)
+
+    def _evict(self, cache_key):
+        buffer, _ = self._entries.pop(cache_key)
+        buffer[:] = bytes(len(buffer))
+        self.evictions += 1
+
+    def clear(self):
+        """Zeroizes and drops every cached key."""
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._evict(cache_key)
+
+    def stats(self):
+        """Returns hit/miss counters for the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = KeyCache()
+
+
+def get_or_derive(password, salt, params, derive):
+    """Looks up a derived key in the process-wide cache."""
+    return _cache.get_or_derive(password, salt, params, derive)
+
+
+def fingerprint(password):
+    """Returns a process-local fingerprint of a password, for remembering it was seen without keeping it."""
+    return _cache.fingerprint(password)
+
+
+def clear():
+    """Clears the process-wide cache, e.g. when the drive is unmounted."""
+    _cache.clear()
+
+
+def stats():
+    """Returns the process-wide cache counters."""
+    return _cache.stats()
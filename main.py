@@ -1,8 +1,10 @@
 import sys
 from PyQt6.QtWidgets import QApplication
 from gui.usb_window import USBDeviceWindow
+import cipher_engine
 
 if __name__ == "__main__":
+    cipher_engine.preferred_cipher()  # Benchmarks the ciphers once per host, cached afterwards
     app = QApplication(sys.argv)
     window = USBDeviceWindow()
     window.show()
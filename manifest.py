@@ -0,0 +1,245 @@
+import os
+import json
+import struct
+from cryptography.exceptions import InvalidTag
+import append_log
+import cipher_engine
+import container
+import drive_manager
+import encryption
+import kdf
+
+# The manifest is an append log (see append_log.py):
+#   header   JSON with the manifest id, KDF parameters and the random manifest key
+#            wrapped by the key derived from the drive password
+#   records  nonce | AES-GCM sealed JSON record, appended one per change
+# A record is {"op": "put", "name", "entry"}, {"op": "del", "name"} or
+# {"op": "snapshot", "entries"}; compaction rewrites the file as a single snapshot.
+# Changing the drive password only rewraps the manifest key (see rewrap_manifest).
+MANIFEST_NAME = "manifest"
+MAGIC = b'SUSBMANI'
+# Manifests that are moved out of the way are kept as manifest<suffix>.<n>, never overwriting an earlier one
+DAMAGED_SUFFIX = ".damaged"  # Structurally broken, before it is rebuilt
+REPLACED_SUFFIX = ".replaced"  # Intact but given up on by rebuild_manifest()
+
+
+class ManifestError(Exception):
+    """Raised when the manifest cannot be read."""
+
+
+class ManifestKeyError(ManifestError):
+    """Raised when the password does not unwrap the manifest key."""
+
+
+def original_name(stored_name):
+    """Recovers the user-visible name from an on-drive name such as '.report.pdf.enc'."""
+    name = os.path.basename(stored_name)
+    if name.startswith('.'):
+        name = name[1:]
+    if name.endswith('.enc'):
+        name = name[:-len('.enc')]
+    return name
+
+
+def new_entry(source, sha256=None, mime=None):
+    """Builds the manifest entry for a file that is being added from source."""
+    stat = os.stat(source)
+    return {"name": os.path.basename(source), "size": stat.st_size, "mime": mime,
+            "mtime": stat.st_mtime, "sha256": sha256}
+
+
+def scan_entry(path):
+    """Builds a best-effort entry for an encrypted file found on the drive without decrypting it."""
+    return {"name": original_name(path), "size": encryption.plaintext_size(path), "mime": None,
+            "mtime": os.stat(path).st_mtime, "sha256": None}
+
+
+class Manifest:
+    """Encrypted, append-only index mapping each file on the drive to its metadata."""
+
+    def __init__(self, path, key, header):
+        self.path = path
+        self.header = header
+        self.entries = {}
+        self._key = key
+        self._engine = cipher_engine.AESGCMEngine(key)
+        self._manifest_id = bytes.fromhex(header["manifest_id"])
+        self._log = append_log.AppendLog(path, MAGIC)
+
+    def _aad(self, sequence):
+        return self._manifest_id + struct.pack('>Q', sequence)
+
+    def _encode_record(self, sequence, record):
+        nonce = os.urandom(self._engine.nonce_size)
+        return nonce + self._engine.seal(nonce, json.dumps(record).encode(), self._aad(sequence))
+
+    def _apply(self, record):
+        if record["op"] == "put":
+            self.entries[record["name"]] = record["entry"]
+        elif record["op"] == "del":
+            self.entries.pop(record["name"], None)
+        elif record["op"] == "snapshot":
+            self.entries = dict(record["entries"])
+
+    def load(self):
+        """Reads the manifest; a torn or unauthenticated record at the end (crash mid-append) is ignored."""
+        self.entries = {}
+        nonce_size = self._engine.nonce_size
+        for _, length, blob in self._log.scan():
+            if length < nonce_size:
+                break
+            try:
+                record = json.loads(self._engine.open(blob[:nonce_size], blob[nonce_size:],
+                                                      self._aad(self._log.records)))
+            except InvalidTag:
+                break
+            self._apply(record)
+        if self._log.records == 0:
+            raise ManifestError("Manifest has no readable records")
+
+    def _append(self, *records):
+        """Appends records with a single write and fsync."""
+        self._log.append([self._encode_record(self._log.records + i, record) for i, record in enumerate(records)])
+        for record in records:
+            self._apply(record)
+        if self._log.should_compact(len(self.entries)):
+            self.compact()
+
+    def put(self, name, entry):
+        """Records that the on-drive file name now holds entry."""
+        self._append({"op": "put", "name": name, "entry": entry})
+
+    def remove(self, name):
+        """Records that the on-drive file name was deleted."""
+        self.remove_many([name])
+
+    def remove_many(self, names):
+        """Records that the on-drive files names were deleted, in one append."""
+        records = [{"op": "del", "name": name} for name in names if name in self.entries]
+        if records:
+            self._append(*records)
+
+    def compact(self):
+        """Atomically rewrites the manifest as a single snapshot record."""
+        self._log.write(self.header, [self._encode_record(0, {"op": "snapshot", "entries": self.entries})])
+
+    def rewrap(self, password):
+        """Wraps the manifest key under a new drive password, e.g. after the LUKS passphrase changed."""
+        self.header = dict(self.header, **_wrap(self._key, password))
+        self.compact()
+
+    def reconcile(self, mount_point):
+        """Brings the manifest in line with the files actually on the drive."""
+        names = set(drive_manager.list_drive(mount_point))
+        changed = False
+        for name in names - set(self.entries):
+            try:
+                self.entries[name] = scan_entry(os.path.join(mount_point, name))
+                changed = True
+            except OSError as e:
+                print(f"[WARN] Could not index {name}: {e}")
+        for name in set(self.entries) - names:
+            del self.entries[name]
+            changed = True
+        if changed or self._log.valid_length is None:
+            self.compact()
+        return changed
+
+    def rebuild(self, mount_point):
+        """Recreates the manifest from a scan of the drive."""
+        self.entries = {}
+        self._log.valid_length = None
+        self.reconcile(mount_point)
+
+
+def _wrap(manifest_key, password):
+    """Header fields that wrap manifest_key under a key derived from password with fresh KDF parameters."""
+    kdf_params = dict(kdf.calibrated_params(), salt=os.urandom(kdf.SALT_SIZE).hex())
+    return {"kdf": kdf_params, "wrapped_key": encryption.wrap_data_key(kdf.derive(password, kdf_params), manifest_key)}
+
+
+def _unwrap(header, password):
+    """Returns the manifest key; ManifestKeyError if password is not the one it was wrapped with."""
+    try:
+        return encryption.unwrap_data_key(kdf.derive(password, header["kdf"]), header["wrapped_key"])
+    except container.WrongKeyError:
+        raise ManifestKeyError("The manifest does not open with this drive password") from None
+
+
+def _set_aside(path, suffix):
+    """Moves path to the first free path + suffix + '.<n>', so earlier copies are never overwritten."""
+    number = 1
+    while os.path.lexists(f"{path}{suffix}.{number}"):
+        number += 1
+    os.replace(path, f"{path}{suffix}.{number}")
+    return f"{path}{suffix}.{number}"
+
+
+def _manifest_path(mount_point, sudo_password=None):
+    return os.path.join(drive_manager.state_dir(mount_point, sudo_password), MANIFEST_NAME)
+
+
+def _open(path, password):
+    """Opens an existing manifest; None if there is none."""
+    header = append_log.AppendLog(path, MAGIC).read_header()
+    if header is None:
+        return None
+    manifest = Manifest(path, _unwrap(header, password), header)
+    manifest.load()
+    return manifest
+
+
+def _create(path, password, mount_point):
+    """Starts a new manifest under a random key and fills it from a scan of the drive."""
+    key = os.urandom(encryption.DATA_KEY_SIZE)
+    manifest = Manifest(path, key, dict(_wrap(key, password), manifest_id=os.urandom(16).hex()))
+    manifest.rebuild(mount_point)
+    return manifest
+
+
+def open_manifest(mount_point, password, sudo_password=None):
+    """Loads the drive's manifest, rebuilding it from a scan if it is missing or broken.
+
+    A manifest whose key does not unwrap with password (a mistyped passphrase, one
+    changed while the drive was not mounted here, another LUKS key slot) raises
+    ManifestKeyError and is left untouched, since rebuilding it would lose every
+    stored mime type and hash; see rewrap_manifest() and rebuild_manifest().
+    """
+    path = _manifest_path(mount_point, sudo_password)
+    try:
+        manifest = _open(path, password)
+        if manifest is not None:
+            return manifest
+    except ManifestKeyError:
+        raise
+    except (ManifestError, KeyError, TypeError, ValueError, struct.error) as e:
+        print(f"[WARN] Manifest is damaged ({e}); rebuilding it from the drive contents.")
+    if os.path.exists(path):
+        _set_aside(path, DAMAGED_SUFFIX)
+    return _create(path, password, mount_point)
+
+
+def rewrap_manifest(mount_point, old_password, new_password, sudo_password=None):
+    """Re-locks the manifest, opened with old_password, under new_password and returns it.
+
+    Called when the drive password changes; raises ManifestKeyError if
+    old_password does not open it. Without a manifest yet, one is created.
+    """
+    path = _manifest_path(mount_point, sudo_password)
+    manifest = _open(path, old_password)
+    if manifest is None:
+        return open_manifest(mount_point, new_password, sudo_password)
+    manifest.rewrap(new_password)
+    return manifest
+
+
+def rebuild_manifest(mount_point, password, sudo_password=None):
+    """Replaces the manifest with a new one under password, built from a scan of the drive.
+
+    For a manifest nobody can open any more. The old one is kept aside (see
+    REPLACED_SUFFIX) in case its password turns up again.
+    """
+    path = _manifest_path(mount_point, sudo_password)
+    if os.path.exists(path):
+        _set_aside(path, REPLACED_SUFFIX)
+    return _create(path, password, mount_point)
@@ -0,0 +1,71 @@
+import mimetypes
+
+SNIFF_SIZE = 4096  # Bytes of plaintext needed to recognise a file
+
+# (offset, magic bytes, MIME type), checked in order
+SIGNATURES = [
+    (0, b'%PDF-', "application/pdf"),
+    (0, b'\x89PNG\r\n\x1a\n', "image/png"),
+    (0, b'\xff\xd8\xff', "image/jpeg"),
+    (0, b'GIF87a', "image/gif"),
+    (0, b'GIF89a', "image/gif"),
+    (0, b'BM', "image/bmp"),
+    (0, b'II*\x00', "image/tiff"),
+    (0, b'MM\x00*', "image/tiff"),
+    (0, b'ID3', "audio/mpeg"),
+    (0, b'fLaC', "audio/flac"),
+    (0, b'OggS', "audio/ogg"),
+    (0, b'\x1aE\xdf\xa3', "video/x-matroska"),
+    (4, b'ftypqt', "video/quicktime"),
+    (4, b'ftypM4A', "audio/mp4"),
+    (4, b'ftyp', "video/mp4"),
+    (0, b'PK\x03\x04', "application/zip"),
+    (0, b'\x1f\x8b', "application/gzip"),
+    (0, b'7z\xbc\xaf\x27\x1c', "application/x-7z-compressed"),
+]
+
+# RIFF containers carry their real type at offset 8
+RIFF_TYPES = {b'WEBP': "image/webp", b'WAVE': "audio/wav", b'AVI ': "video/x-msvideo"}
+
+# Generic results that a file name can make more specific (e.g. .docx is a zip, .csv is text)
+REFINABLE = {"application/zip", "text/plain", "application/octet-stream"}
+
+
+def _looks_like_text(data):
+    if b'\0' in data:
+        return False
+    try:
+        data.decode("utf-8")
+        return True
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the sample boundary is still text
+        return e.start >= len(data) - 3 and e.reason == "unexpected end of data"
+
+
+def sniff(data, name=None):
+    """Guesses the MIME type of a file from its first bytes, refined by its name when that is ambiguous."""
+    data = bytes(data[:SNIFF_SIZE])
+    mime = None
+    if data[:4] == b'RIFF':
+        mime = RIFF_TYPES.get(data[8:12])
+    if mime is None:
+        for offset, magic, candidate in SIGNATURES:
+            if data[offset:offset + len(magic)] == magic:
+                mime = candidate
+                break
+    if mime is None and len(data) >= 2 and data[0] == 0xFF and data[1] & 0xE0 == 0xE0:
+        mime = "audio/mpeg"  # Bare MPEG audio frame sync
+    if mime is None:
+        mime = "text/plain" if data and _looks_like_text(data) else "application/octet-stream"
+
+    if name and mime in REFINABLE:
+        guessed, _ = mimetypes.guess_type(name)
+        if guessed and (mime != "text/plain" or guessed.startswith("text/") or guessed.endswith(("json", "xml"))):
+            mime = guessed
+    return mime
+
+
+def sniff_file(path, name=None):
+    """Sniffs the MIME type of a plaintext file on disk."""
+    with open(path, 'rb') as f:
+        return sniff(f.read(SNIFF_SIZE), name or path)
@@ -0,0 +1,133 @@
+import os
+import queue
+import threading
+
+QUEUE_DEPTH = 8  # Segments in flight between the reader and the writer; each holds one input and one output buffer
+POLL_SECONDS = 0.1  # How often blocked stages check whether another stage failed
+
+
+class PipelineAborted(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+class Slot:
+    """Reusable pair of buffers that carries one segment through the pipeline."""
+    __slots__ = ("data", "out", "sequence", "index", "length", "last", "nonce", "result")
+
+    def __init__(self, data_size, out_size):
+        self.data = memoryview(bytearray(data_size))
+        self.out = memoryview(bytearray(out_size))
+
+
+class Pipeline:
+    """Reader thread -> crypto workers -> writer thread, connected by bounded queues of reusable slots.
+
+    The reader fills slots from a fixed pool and hands them to the workers; the
+    writer puts results back in order and returns each slot to the pool, so at most
+    depth segments are in flight and nothing is allocated per segment. Slots are
+    only allocated as the reader first needs them, so a small file costs one or two
+    buffers rather than the whole pool. Because the stages run concurrently, device
+    latency on the read or write side overlaps with the crypto instead of adding to
+    it. The first exception in any stage stops the others and is re-raised by run().
+    """
+
+    def __init__(self, data_size, out_size, workers=os.cpu_count() or 1, depth=QUEUE_DEPTH):
+        self.workers = max(1, workers)
+        self._free = queue.Queue()
+        self._slot_sizes = (data_size, out_size)
+        self._unallocated = max(depth, 2)  # The encrypt reader looks one segment ahead
+        self._work = queue.Queue()
+        self._done = queue.Queue()
+        self._failed = threading.Event()
+        self._error = None
+        self._sequence = 0
+
+    def _get(self, source):
+        while True:
+            try:
+                return source.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if self._failed.is_set():
+                    raise PipelineAborted() from None
+
+    def take_slot(self):
+        """Blocks until a free slot is available; for use by the read stage."""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            if not self._unallocated:
+                return self._get(self._free)
+        self._unallocated -= 1
+        return Slot(*self._slot_sizes)
+
+    def release_slot(self, slot):
+        """Returns a slot the read stage took but did not emit."""
+        self._free.put(slot)
+
+    def emit(self, slot):
+        """Hands a filled slot to the crypto workers; for use by the read stage."""
+        slot.sequence = self._sequence
+        self._sequence += 1
+        self._work.put(slot)
+
+    def _stage(self, target, *args):
+        try:
+            target(*args)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._failed.set()
+
+    def _read(self, read):
+        try:
+            read(self)
+        finally:
+            for _ in range(self.workers):
+                self._work.put(None)
+
+    def _process(self, process):
+        try:
+            while True:
+                slot = self._get(self._work)
+                if slot is None:
+                    return
+                process(slot)
+                self._done.put(slot)
+        finally:
+            self._done.put(None)
+
+    def _write(self, write):
+        pending = {}
+        expected = 0
+        finished_workers = 0
+        while finished_workers < self.workers:
+            slot = self._get(self._done)
+            if slot is None:
+                finished_workers += 1
+                continue
+            pending[slot.sequence] = slot
+            while expected in pending:
+                slot = pending.pop(expected)
+                write(slot)
+                self._free.put(slot)
+                expected += 1
+
+    def run(self, read, process, write):
+        """Runs read(pipeline), process(slot) on each worker and write(slot) in order until done."""
+        threads = [threading.Thread(target=self._stage, args=(self._read, read), daemon=True),
+                   threading.Thread(target=self._stage, args=(self._write, write), daemon=True)]
+        threads += [threading.Thread(target=self._stage, args=(self._process, process), daemon=True)
+                    for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(POLL_SECONDS)
+        except BaseException:
+            self._failed.set()
+            raise
+        if self._error is not None:
+            raise self._error
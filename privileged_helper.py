@@ -0,0 +1,352 @@
+import os
+import re
+import sys
+import json
+import stat
+import shutil
+import select
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# The helper is started once per session through sudo and then serves a single
+# client over a Unix socket, one JSON request and one JSON response per line:
+#   {"op": "delete", "paths": [...]}  ->  {"ok": true, "results": [null, "error", ...]}
+# Only the operations in Operations.OPS exist, file operations are confined to the
+# drive's mount point, and the helper exits when its client goes away. It imports
+# nothing from SecureUsb so that what runs as root stays small.
+SOCKET_NAME = "helper.sock"
+START_TIMEOUT = 60  # Seconds to wait for sudo and the helper to come up
+ACCEPT_TIMEOUT = 30  # A helper nobody connects to gives up after this long
+MAPPER_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class HelperError(Exception):
+    """Raised when the privileged helper cannot be started or refuses or fails an operation."""
+
+
+class Operations:
+    """The privileged operations, confined to root (the drive's mount point).
+
+    As a stand-in (no root needed) file operations run as the current user and
+    mounting and LUKS commands are only recorded in self.commands, so everything
+    built on the helper can be exercised without sudo.
+    """
+
+    def __init__(self, root, uid, gid, stand_in=False):
+        self.root = os.path.realpath(root)
+        self._roots = (os.path.abspath(root), self.root)  # Clients name paths by the mount point as given
+        self.uid = uid
+        self.gid = gid
+        self.stand_in = stand_in
+        self.commands = []
+
+    def _parts(self, path):
+        """Splits path into its components below root, refusing anything that is not strictly inside it."""
+        path = os.path.abspath(path)
+        for root in self._roots:
+            if path.startswith(root.rstrip(os.sep) + os.sep):
+                parts = path[len(root.rstrip(os.sep)) + 1:].split(os.sep)
+                if all(part not in ("", os.curdir, os.pardir) for part in parts):
+                    return parts
+        raise ValueError(f"{path} is outside {self.root}")
+
+    def _open_parent(self, path):
+        """Returns (fd of the directory holding path, entry name).
+
+        The directory is reached from root one component at a time with O_NOFOLLOW,
+        so a symlink planted anywhere on the way (the drive is writable by the user)
+        cannot lead outside root, now or between this check and the operation. The
+        caller acts on the entry through dir_fd and closes the fd.
+        """
+        parts = self._parts(path)
+        fd = os.open(self.root, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for part in parts[:-1]:
+                parent, fd = fd, os.open(part, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=fd)
+                os.close(parent)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd, parts[-1]
+
+    def _run(self, command, stdin=None):
+        if self.stand_in:
+            self.commands.append(command)
+            return ""
+        result = subprocess.run(command, input=stdin, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise HelperError(result.stderr.strip() or f"{command[0]} failed with status {result.returncode}")
+        return result.stdout
+
+    @staticmethod
+    def _each(items, action):
+        """Applies action to every item and collects None or the error message, so one failure does not stop a batch."""
+        results = []
+        for item in items:
+            try:
+                action(item)
+                results.append(None)
+            except (OSError, ValueError) as e:
+                results.append(str(e))
+        return results
+
+    def op_ping(self):
+        return {"stand_in": self.stand_in}
+
+    def op_move(self, pairs):
+        def move(pair):
+            source_fd, source = self._open_parent(pair[0])
+            try:
+                destination_fd, destination = self._open_parent(pair[1])
+                try:
+                    os.replace(source, destination, src_dir_fd=source_fd, dst_dir_fd=destination_fd)
+                finally:
+                    os.close(destination_fd)
+            finally:
+                os.close(source_fd)
+        return {"results": self._each(pairs, move)}
+
+    def op_delete(self, paths):
+        def delete(path):
+            fd, name = self._open_parent(path)
+            try:
+                os.remove(name, dir_fd=fd)
+            except FileNotFoundError:
+                pass  # Already gone, like rm -f
+            finally:
+                os.close(fd)
+        return {"results": self._each(paths, delete)}
+
+    def op_make_dir(self, path):
+        """Creates a private directory owned by the session's user; an existing symlink is refused, not followed."""
+        parent, name = self._open_parent(path)
+        try:
+            try:
+                os.mkdir(name, 0o700, dir_fd=parent)
+            except FileExistsError:
+                pass
+            fd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=parent)
+        finally:
+            os.close(parent)
+        try:
+            os.fchown(fd, self.uid, self.gid)
+            os.fchmod(fd, 0o700)
+        finally:
+            os.close(fd)
+        return {}
+
+    def _device(self, name):
+        if not MAPPER_NAME.match(name):
+            raise ValueError(f"Invalid mapper name {name}")
+        return f"/dev/mapper/{name}"
+
+    def op_mount(self, name, fstype=None):
+        command = ["mount"] + (["-t", fstype] if fstype else []) + [self._device(name), self.root]
+        self._run(command)
+        return {}
+
+    def op_unmount(self, force=False):
+        self._run(["umount"] + (["-f"] if force else []) + [self.root])
+        return {}
+
+    def op_luks_open(self, device, name, passphrase):
+        if not self.stand_in and not stat.S_ISBLK(os.stat(device).st_mode):
+            raise ValueError(f"{device} is not a block device")
+        self._device(name)
+        self._run(["cryptsetup", "luksOpen", device, name], passphrase + "\n")
+        return {}
+
+    def op_luks_close(self, name):
+        self._device(name)
+        self._run(["cryptsetup", "luksClose", name])
+        return {}
+
+    def op_luks_status(self, name):
+        self._device(name)
+        if self.stand_in:
+            self.commands.append(["cryptsetup", "status", name])
+            return {"active": False}
+        result = subprocess.run(["cryptsetup", "status", name], capture_output=True, text=True)
+        return {"active": "is active" in result.stdout}
+
+    OPS = {"ping": op_ping, "move": op_move, "delete": op_delete, "make_dir": op_make_dir, "mount": op_mount,
+           "unmount": op_unmount, "luks_open": op_luks_open, "luks_close": op_luks_close,
+           "luks_status": op_luks_status}
+
+    def handle(self, request):
+        operation = self.OPS.get(request.pop("op", None))
+        if operation is None:
+            return {"ok": False, "error": "Unknown operation"}
+        try:
+            return dict(operation(self, **request), ok=True)
+        except (HelperError, OSError, ValueError, TypeError) as e:
+            return {"ok": False, "error": str(e)}
+
+
+def serve(socket_path, operations, allowed_uid):
+    """Accepts one client on socket_path and serves it until it disconnects or asks to shut down."""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        if not operations.stand_in:
+            os.chown(socket_path, allowed_uid, -1)
+        server.listen(1)
+        server.settimeout(ACCEPT_TIMEOUT)
+        print("ready", flush=True)
+        connection, _ = server.accept()
+    finally:
+        server.close()
+        try:
+            os.remove(socket_path)
+        except FileNotFoundError:
+            pass  # The client cleans up too
+
+    with connection:
+        _, peer_uid, _ = struct.unpack('3i', connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                                   struct.calcsize('3i')))
+        if peer_uid not in (allowed_uid, 0):
+            return
+        with connection.makefile('rwb') as stream:
+            for line in stream:
+                request = json.loads(line)
+                if request.get("op") == "shutdown":
+                    stream.write(b'{"ok": true}\n')
+                    stream.flush()
+                    return
+                stream.write(json.dumps(operations.handle(request)).encode() + b"\n")
+                stream.flush()
+
+
+class HelperClient:
+    """Connection to a running helper; safe to share between threads."""
+
+    def __init__(self, connection, process):
+        self._connection = connection
+        self._stream = connection.makefile('rwb')
+        self._process = process
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self):
+        return self._process.poll() is None
+
+    def call(self, op, **args):
+        with self._lock:
+            try:
+                self._stream.write(json.dumps(dict(args, op=op)).encode() + b"\n")
+                self._stream.flush()
+                line = self._stream.readline()
+            except OSError as e:
+                raise HelperError(f"Lost the privileged helper: {e}") from None
+        if not line:
+            raise HelperError("The privileged helper has exited")
+        response = json.loads(line)
+        if not response.pop("ok"):
+            raise HelperError(response["error"])
+        return response
+
+    def move(self, pairs):
+        """Renames (source, destination) pairs; returns None or an error message per pair."""
+        return self.call("move", pairs=[list(pair) for pair in pairs])["results"]
+
+    def delete(self, paths):
+        """Deletes paths; returns None or an error message per path."""
+        return self.call("delete", paths=list(paths))["results"]
+
+    def make_dir(self, path):
+        self.call("make_dir", path=path)
+
+    def mount(self, name, fstype=None):
+        """Mounts /dev/mapper/name on the helper's mount point."""
+        self.call("mount", name=name, fstype=fstype)
+
+    def unmount(self, force=False):
+        self.call("unmount", force=force)
+
+    def luks_open(self, device, name, passphrase):
+        self.call("luks_open", device=device, name=name, passphrase=passphrase)
+
+    def luks_close(self, name):
+        self.call("luks_close", name=name)
+
+    def luks_status(self, name):
+        """Whether the LUKS mapping name is open."""
+        return self.call("luks_status", name=name)["active"]
+
+    def close(self):
+        """Stops the helper."""
+        try:
+            self.call("shutdown")
+        except HelperError:
+            pass
+        self._stream.close()
+        self._connection.close()
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+
+
+def start(sudo_password=None, root="/", stand_in=False, timeout=START_TIMEOUT):
+    """Starts a helper for the drive mounted at root and connects to it.
+
+    The sudo password is used once, here; with None sudo asks on the terminal (or
+    uses its cached credentials). stand_in starts the unprivileged stand-in instead.
+    """
+    directory = tempfile.mkdtemp(prefix="secureusb-")
+    socket_path = os.path.join(directory, SOCKET_NAME)
+    command = [sys.executable, os.path.abspath(__file__), "--socket", socket_path, "--root", root,
+               "--uid", str(os.getuid()), "--gid", str(os.getgid())]
+    if stand_in:
+        command.append("--stand-in")
+    elif sudo_password is None:
+        command = ["sudo"] + command
+        timeout = None  # The user may be typing the password on the terminal
+    else:
+        command = ["sudo", "-S", "-p", ""] + command
+    try:
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE if sudo_password is not None else None,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise HelperError(f"Could not start the privileged helper: {e}") from None
+        if sudo_password is not None:
+            process.stdin.write(sudo_password.encode() + b"\n")
+            process.stdin.close()
+        ready, _, _ = select.select([process.stdout], [], [], timeout)
+        if not ready or process.stdout.readline().strip() != b"ready":
+            process.kill()
+            error = process.communicate()[1].decode(errors="replace").strip()
+            raise HelperError(f"Could not start the privileged helper: {error or 'timed out'}")
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return HelperClient(connection, process)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SecureUsb privileged helper (started by SecureUsb itself)")
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--root", required=True, help="mount point the file operations are confined to")
+    parser.add_argument("--uid", type=int, required=True, help="user allowed to connect")
+    parser.add_argument("--gid", type=int, required=True)
+    parser.add_argument("--stand-in", action="store_true", help="run unprivileged and only record mount commands")
+    args = parser.parse_args(argv)
+    if not args.stand_in and os.geteuid() != 0:
+        print("The privileged helper must run as root (or with --stand-in)", file=sys.stderr)
+        return 1
+    try:
+        serve(args.socket, Operations(args.root, args.uid, args.gid, args.stand_in), args.uid)
+    except socket.timeout:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import getpass
+import container
+import encryption
+
+MB = 1024 * 1024
+
+# Per-file outcomes in a scrub report
+OK = "ok"
+CORRUPT = "corrupt"  # Some segments failed authentication or the container structure is damaged
+UNVERIFIED = "unverified"  # Nothing authenticated: most likely encrypted with another password
+UNREADABLE = "unreadable"  # The device returned read errors (e.g. EIO) for the file or some of its segments
+ERROR = "error"  # The file could not be checked for another reason
+SKIPPED = "skipped"  # The scrub was cancelled before every segment was checked
+
+
+class RateLimiter:
+    """Sleeps callers so that the combined read rate stays below a limit."""
+
+    def __init__(self, mb_per_s=None):
+        self._bytes_per_s = mb_per_s * MB if mb_per_s else None
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._bytes = 0
+
+    def reset(self):
+        with self._lock:
+            self._start = time.monotonic()
+            self._bytes = 0
+
+    def wait(self, count):
+        if not self._bytes_per_s:
+            return
+        with self._lock:
+            self._bytes += count
+            due = self._start + self._bytes / self._bytes_per_s
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _LegacySink:
+    """Discards the plaintext of a legacy file, honouring pause and the rate limit."""
+
+    def __init__(self, scrubber):
+        self._scrubber = scrubber
+
+    def write(self, data):
+        self._scrubber._checkpoint(len(data))
+        return len(data)
+
+
+class ScrubCancelled(Exception):
+    """Raised inside workers when a scrub is cancelled."""
+
+
+class Scrubber:
+    """Verifies the authentication tag of every segment of a set of encrypted files.
+
+    Segments from all files are checked in parallel, up to workers at a time, with
+    pause()/resume() and cancel() usable from another thread. Legacy AES-CBC files
+    have no tags; for those only the padding can be checked.
+    """
+
+    def __init__(self, paths, password, workers=container.DEFAULT_WORKERS, rate_limit_mb_s=None,
+                 progress=None, salt=None):
+        self.paths = list(paths)
+        self.password = password
+        self.workers = workers
+        self.progress = progress
+        self.salt = salt
+        self._limiter = RateLimiter(rate_limit_mb_s)
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self.bytes_read = 0
+        self.total_bytes = 0
+        self.results = []
+        self._started = time.monotonic()
+        self._paused_at = None
+        self._paused_seconds = 0.0
+
+    def pause(self):
+        with self._lock:
+            if self._paused_at is None:
+                self._paused_at = time.monotonic()
+        self._running.clear()
+
+    def resume(self):
+        self._limiter.reset()  # Do not let the time spent paused count as rate budget
+        self._unpause()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._unpause()
+
+    def _unpause(self):
+        with self._lock:
+            if self._paused_at is not None:
+                self._paused_seconds += time.monotonic() - self._paused_at
+                self._paused_at = None
+        self._running.set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def _checkpoint(self, count):
+        """Called before reading count bytes: blocks while paused and applies the rate limit."""
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise ScrubCancelled()
+        self._limiter.wait(count)
+        with self._lock:
+            self.bytes_read += count
+            done = self.bytes_read
+        if self.progress:
+            self.progress(done, self.total_bytes)
+
+    def _open(self, path):
+        """Returns the report entry of a file and, for containers, its open reader."""
+        result = {"path": path, "status": OK, "segments": 0, "checked": 0, "corrupt_segments": [],
+                  "unreadable_segments": [], "error": None}
+        try:
+            key = encryption.file_key(path, self.password, self.salt)
+            if not container.is_container(path):
+                with open(path, 'rb') as f:
+                    truncated = f.read(len(container.MAGIC)) == container.MAGIC
+                if truncated:
+                    raise container.ContainerError("Container footer is missing; the file is truncated")
+                result["legacy"] = True
+                return result, None, key
+            reader = container.ContainerReader(path, key)
+            result["segments"] = reader.segment_count
+            # A wrapped data key already proved the password in file_key(); otherwise it is unchecked
+            result["key_checked"] = "wrapped_key" in reader.header
+            return result, reader, key
+        except container.WrongKeyError as e:
+            result.update(status=UNVERIFIED, error=str(e))
+        except container.ContainerError as e:
+            result.update(status=CORRUPT, error=str(e))
+        except OSError as e:
+            result.update(status=UNREADABLE, error=str(e))
+        except Exception as e:
+            result.update(status=ERROR, error=str(e))
+        return result, None, None
+
+    def _verify(self, work):
+        """Checks one container segment, or a whole legacy file when index is None.
+
+        Returns work and the segment's outcome: None when it authenticated, else
+        the ContainerError or OSError it failed with.
+        """
+        result, reader, index, key = work
+        if index is None:
+            self._verify_legacy(result, key)
+            return work, None
+        offset, length = reader.entries[index]
+        self._checkpoint(length)
+        try:
+            reader.read_segment(index)
+        except (container.ContainerError, OSError) as e:
+            return work, e
+        return work, None
+
+    def _verify_legacy(self, result, key):
+        try:
+            with open(result["path"], 'rb') as f:
+                encryption.decrypt_stream(f, _LegacySink(self), key)
+        except ScrubCancelled:
+            raise
+        except OSError as e:
+            result.update(status=UNREADABLE, error=str(e))
+        except Exception as e:
+            # Without a tag a wrong password and corruption look the same
+            result.update(status=UNVERIFIED, error=f"Padding check failed: {e}")
+
+    def _work(self, results, readers):
+        """Yields (result, reader, segment index, key) for every segment, opening files lazily."""
+        for path in self.paths:
+            result, reader, key = self._open(path)
+            results.append(result)
+            if result.pop("legacy", False):
+                result["segments"] = 1  # Checked as a whole
+                yield result, None, None, key
+            elif reader is not None:
+                readers.add(reader)
+                for index in range(reader.segment_count):
+                    yield result, reader, index, key
+
+    def run(self):
+        """Scrubs every file and returns the report."""
+        self.results = []
+        self._started = time.monotonic()
+        self._paused_seconds = 0.0
+        self.total_bytes = sum(os.path.getsize(path) for path in self.paths if os.path.exists(path))
+        readers = set()
+        cancelled = False
+        try:
+            for (result, reader, index, _), error in container.ordered_map(
+                    self._verify, self._work(self.results, readers), self.workers):
+                result["checked"] += 1
+                if isinstance(error, OSError):
+                    result["unreadable_segments"].append(index)
+                    result["error"] = result["error"] or str(error)
+                elif error is not None:
+                    result["corrupt_segments"].append(index)
+                if reader is not None and index == reader.segment_count - 1:
+                    # Results arrive in order, so every segment of this file is done
+                    reader.close()
+                    readers.discard(reader)
+        except ScrubCancelled:
+            cancelled = True
+        finally:
+            for reader in readers:
+                reader.close()
+        return self.report(cancelled)
+
+    def report(self, cancelled=False, error=None):
+        """Classifies the files checked so far and returns the report.
+
+        error describes why the scrub stopped early, e.g. when run() raised; files
+        it did not get to are reported as skipped. Time spent paused does not count
+        towards the rate.
+        """
+        elapsed = max(time.monotonic() - self._started - self._paused_seconds, 1e-9)
+        for result in self.results:
+            bad = len(result["corrupt_segments"])
+            unreadable = len(result["unreadable_segments"])
+            key_checked = result.pop("key_checked", False)
+            if result["status"] != OK:
+                continue
+            if unreadable:
+                result.update(status=UNREADABLE, error=f"{unreadable} of {result['segments']} segments could not "
+                                                       f"be read: {result['error']}")
+            elif result["checked"] < result["segments"]:
+                result.update(status=SKIPPED, error=f"Checked {result['checked']} of {result['segments']} segments")
+            elif bad and bad == result["segments"] and not key_checked:
+                # Not a single segment authenticated and nothing vouched for the key, so it is the likelier culprit
+                result.update(status=UNVERIFIED, corrupt_segments=[],
+                              error="No segment authenticated; wrong password or the whole file is damaged")
+            elif bad:
+                result.update(status=CORRUPT, error=f"{bad} of {result['segments']} segments failed authentication")
+        return {
+            "files": self.results,
+            "bytes": self.bytes_read,
+            "seconds": elapsed,
+            "mb_per_s": self.bytes_read / MB / elapsed,
+            "cancelled": cancelled,
+            "error": error,
+        }
+
+
+def format_report(report):
+    """Human-readable summary of a scrub report."""
+    lines = []
+    counts = {}
+    for result in report["files"]:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        if result["status"] != OK:
+            detail = result["error"] or ""
+            if result["corrupt_segments"]:
+                detail += f" (segments {', '.join(map(str, result['corrupt_segments']))})"
+            if result["unreadable_segments"]:
+                detail += f" (unreadable segments {', '.join(map(str, result['unreadable_segments']))})"
+            lines.append(f"{result['status'].upper():<10} {os.path.basename(result['path'])}: {detail}")
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "no files"
+    lines.append(f"Scrubbed {len(report['files'])} files ({summary}): {report['bytes'] / MB:.1f} MB "
+                 f"in {report['seconds']:.1f} s, {report['mb_per_s']:.1f} MB/s"
+                 + (" (cancelled)" if report["cancelled"] else ""))
+    if report.get("error"):
+        lines.append(f"The scrub stopped early: {report['error']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the integrity of encrypted files on the drive")
+    parser.add_argument("paths", nargs="+", help="encrypted files to check")
+    parser.add_argument("--workers", type=int, default=container.DEFAULT_WORKERS)
+    parser.add_argument("--rate-mb-s", type=float, help="read at most this many MB/s")
+    parser.add_argument("--salt", help="salt of headerless legacy files (default: try the drive window's, "
+                                       "then the command line's)")
+    args = parser.parse_args(argv)
+
+    password = getpass.getpass("Enter the file password: ")
+    scrubber = Scrubber(args.paths, password, args.workers, args.rate_mb_s,
+                        salt=args.salt.encode() if args.salt else None)
+    report = scrubber.run()
+    print(format_report(report))
+    return 0 if all(result["status"] == OK for result in report["files"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+# SecureUsb's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import host_profile
+
+
+@pytest.fixture(autouse=True, scope="session")
+def private_host_profile(tmp_path_factory):
+    """Keeps KDF calibration and other host benchmarks out of the real ~/.config/secureusb."""
+    original = host_profile.PROFILE_PATH
+    host_profile.PROFILE_PATH = str(tmp_path_factory.mktemp("profile") / "host_profile.json")
+    yield
+    host_profile.PROFILE_PATH = original
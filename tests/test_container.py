@@ -0,0 +1,95 @@
+import io
+import os
+import pytest
+import container
+import encryption
+
+SEGMENT = 4096  # Small segments so boundaries are cheap to cross
+SIZES = [0, 1, SEGMENT - 1, SEGMENT, SEGMENT + 1, 3 * SEGMENT, 3 * SEGMENT + 17]
+
+
+def make_container(path, data, key, **options):
+    with open(path, 'wb') as dst:
+        container.write_container(io.BytesIO(data), dst, key, segment_size=SEGMENT, **options)
+    return str(path)
+
+
+def boundary_ranges(size):
+    """(offset, length) pairs that start, end or straddle segment boundaries, plus some past the end."""
+    points = {0, size, max(size - 1, 0)}
+    for boundary in range(SEGMENT, size + SEGMENT, SEGMENT):
+        points.update({boundary - 1, boundary, boundary + 1})
+    for offset in sorted(point for point in points if 0 <= point <= size + 1):
+        for length in (0, 1, 2, SEGMENT - 1, SEGMENT, SEGMENT + 1, 2 * SEGMENT + 3, size + 10):
+            yield offset, length
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("workers", [1, 3])
+def test_container_round_trip(tmp_path, size, workers):
+    data = os.urandom(size)
+    key = os.urandom(32)
+    path = make_container(tmp_path / "file.enc", data, key, workers=workers)
+    assert container.is_container(path) and container.is_complete(path)
+    out = io.BytesIO()
+    with container.ContainerReader(path, key) as reader:
+        assert reader.size == size
+        reader.write_to(out, workers)
+    assert out.getvalue() == data
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_decrypt_range_at_segment_boundaries(tmp_path, size):
+    data = os.urandom(size)
+    key = os.urandom(32)
+    path = make_container(tmp_path / "file.enc", data, key)
+    for offset, length in boundary_ranges(size):
+        assert encryption.decrypt_range(path, offset, length, key) == data[offset:offset + length], (offset, length)
+
+
+def test_decrypt_range_of_legacy_file_at_block_boundaries(tmp_path):
+    data = os.urandom(5 * 16 + 7)
+    key = encryption.derive_key("password")
+    path = tmp_path / "legacy.enc"
+    with open(path, 'wb') as dst:
+        encryption.encrypt_stream(io.BytesIO(data), dst, key)
+    for offset in (0, 15, 16, 17, 31, 32, len(data) - 1):
+        for length in (1, 15, 16, 17, 33, len(data)):
+            assert encryption.decrypt_range(str(path), offset, length, key) == data[offset:offset + length]
+
+
+def test_tampered_segment_fails_authentication(tmp_path):
+    data = os.urandom(3 * SEGMENT)
+    key = os.urandom(32)
+    path = make_container(tmp_path / "file.enc", data, key)
+    with container.ContainerReader(path, key) as reader:
+        offset, _ = reader.entries[1]
+    with open(path, 'r+b') as f:
+        f.seek(offset + 20)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 1]))
+    assert encryption.decrypt_range(path, 0, SEGMENT, key) == data[:SEGMENT]  # Other segments are unaffected
+    with pytest.raises(container.ContainerError):
+        encryption.decrypt_range(path, SEGMENT, 1, key)
+
+
+def test_rekey_alternates_header_slots_and_survives_a_torn_write(tmp_path):
+    data = os.urandom(2 * container.SEGMENT_SIZE + 5)
+    source = tmp_path / "file"
+    source.write_bytes(data)
+    path = encryption.encrypt_file(str(source), "one")
+    encryption.rekey_file(path, "one", "two")
+
+    with open(path, 'r+b') as f:
+        _, slots = container._read_slots(f.fileno())
+        assert [sequence for sequence, _, _ in slots] == [2, 1]
+        # An unplug in the middle of the next rewrite leaves garbage in the older slot
+        f.seek(slots[1][2])
+        f.write(os.urandom(container.HEADER_SIZE // 3))
+    assert encryption.decrypt_file(path, "two") == data
+
+    encryption.rekey_file(path, "two", "three")
+    assert encryption.decrypt_file(path, "three") == data
+    with pytest.raises(container.WrongKeyError):
+        encryption.file_key(path, "two")
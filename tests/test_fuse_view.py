@@ -0,0 +1,147 @@
+import io
+import os
+import stat
+import pytest
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+import container
+import drive_manager
+import encryption
+import fuse_view
+import kdf
+
+SIZE = 3 * container.SEGMENT_SIZE + 1234
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """A directory laid out like the drive: nested encrypted files, a legacy one and SecureUsb's state."""
+    root = tmp_path / "drive"
+    (root / "docs").mkdir(parents=True)
+    (root / drive_manager.STATE_DIR).mkdir()
+    (root / "stray.txt").write_text("not encrypted")
+    files = {"/big.bin": os.urandom(SIZE), "/docs/note.txt": b"hello\n"}
+    for name, data in files.items():
+        source = tmp_path / "plain"
+        source.write_bytes(data)
+        folder, base = os.path.split(name)
+        params = kdf.session_params()
+        encryption.encrypt_to(str(source), str(root / folder.lstrip("/") / f".{base}.enc"),
+                              kdf.derive("password", params), params)
+    legacy = os.urandom(100)
+    with open(root / ".old.bin.enc", 'wb') as dst:
+        encryption.encrypt_stream(io.BytesIO(legacy), dst, encryption.derive_key("password"))
+    files["/old.bin"] = legacy
+
+    view = fuse_view.DecryptedTree(str(root), "password", cache_bytes=2 * container.SEGMENT_SIZE)
+    yield view, files
+    view.close()
+
+
+def read_all(view, path, size, block):
+    handle = view.open(path)
+    try:
+        return b''.join(view.read(handle, block, offset) for offset in range(0, size, block))
+    finally:
+        view.release(handle)
+
+
+def test_listing_hides_internal_and_unencrypted_entries(tree):
+    view, _ = tree
+    assert view.listdir("/") == ["big.bin", "docs", "old.bin"]
+    assert view.listdir("/docs") == ["note.txt"]
+    with pytest.raises(FileNotFoundError):
+        view.listdir("/" + drive_manager.STATE_DIR)
+    with pytest.raises(NotADirectoryError):
+        view.listdir("/big.bin")
+
+
+def test_attributes_report_plaintext_sizes_read_only(tree):
+    view, files = tree
+    for path, data in files.items():
+        attributes = view.getattr(path)
+        assert attributes["st_size"] == len(data)
+        assert stat.S_ISREG(attributes["st_mode"]) and not attributes["st_mode"] & 0o222
+    assert stat.S_ISDIR(view.getattr("/docs")["st_mode"])
+    with pytest.raises(FileNotFoundError):
+        view.getattr("/missing")
+
+
+@pytest.mark.parametrize("block", [4096, 128 * 1024, container.SEGMENT_SIZE + 1])
+def test_sequential_reads_match_with_readahead(tree, block):
+    view, files = tree
+    assert read_all(view, "/big.bin", SIZE, block) == files["/big.bin"]
+    assert view.cache.size <= view.cache.capacity
+
+
+def test_random_reads_across_segment_boundaries(tree):
+    view, files = tree
+    data = files["/big.bin"]
+    handle = view.open("/big.bin")
+    try:
+        for offset, length in ((container.SEGMENT_SIZE - 10, 20), (0, 1), (SIZE - 5, 100),
+                               (2 * container.SEGMENT_SIZE, container.SEGMENT_SIZE + 7), (SIZE, 10)):
+            assert view.read(handle, length, offset) == data[offset:offset + length]
+    finally:
+        view.release(handle)
+    assert read_all(view, "/old.bin", 100, 7) == files["/old.bin"]
+    assert read_all(view, "/docs/note.txt", 6, 4) == b"hello\n"
+
+
+def test_wrong_password_and_missing_files(tree):
+    view, _ = tree
+    other = fuse_view.DecryptedTree(view.root, "wrong")
+    try:
+        with pytest.raises(PermissionError):
+            other.open("/big.bin")
+    finally:
+        other.close()
+    with pytest.raises(FileNotFoundError):
+        view.open("/docs/missing.txt")
+    with pytest.raises(IsADirectoryError):
+        view.open("/docs")
+
+
+def test_page_cache_is_bounded_least_recently_used():
+    cache = fuse_view.PageCache(capacity=10)
+    cache.put(("a", 0), b"x" * 4)
+    cache.put(("a", 1), b"x" * 4)
+    assert cache.get(("a", 0)) is not None
+    cache.put(("b", 0), b"x" * 4)
+    assert ("a", 1) not in cache and ("a", 0) in cache and cache.size == 8
+    cache.put(("c", 0), b"x" * 11)
+    assert ("c", 0) not in cache
+    cache.drop("a")
+    assert cache.size == 4
+
+
+def legacy_file(path, data, password, salt):
+    """Writes a headerless AES-CBC file with a fixed IV, so how a wrong password fares is repeatable."""
+    key = encryption.derive_key(password, salt)
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(b"\0" * 16)).encryptor()
+    with open(path, 'wb') as f:
+        f.write(b"\0" * 16 + encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize())
+
+
+def test_legacy_files_from_the_drive_window_and_the_command_line(tmp_path):
+    root = tmp_path / "drive"
+    root.mkdir()
+    legacy_file(root / ".window.txt.enc", b"from the drive window\n", "password", encryption.DRIVE_SALT)
+    legacy_file(root / ".cli.txt.enc", b"from the command line\n", "password", encryption.SALT)
+
+    view = fuse_view.DecryptedTree(str(root), "password")
+    try:
+        assert read_all(view, "/window.txt", 64, 64) == b"from the drive window\n"
+        assert read_all(view, "/cli.txt", 64, 64) == b"from the command line\n"
+        assert view.getattr("/window.txt")["st_size"] == len(b"from the drive window\n")
+    finally:
+        view.close()
+
+    for view in (fuse_view.DecryptedTree(str(root), "password", salt=encryption.SALT),
+                 fuse_view.DecryptedTree(str(root), "wrong")):
+        try:
+            with pytest.raises(PermissionError):
+                view.open("/window.txt")
+        finally:
+            view.close()
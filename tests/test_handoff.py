@@ -0,0 +1,56 @@
+import os
+import fcntl
+import pytest
+import handoff
+
+
+@pytest.fixture
+def runtime(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_plaintext_is_in_a_sealed_memfd_until_closed(runtime):
+    if not hasattr(os, "memfd_create"):
+        pytest.skip("no memfd_create here")
+    with handoff.Handoff(b"secret", "notes.txt") as view:
+        assert view.in_memory and os.path.basename(view.path) == "notes.txt"
+        assert os.path.dirname(view.path).startswith(str(runtime / handoff.DIRECTORY_PREFIX))
+        with open(view.path, 'rb') as f:
+            assert f.read() == b"secret"
+        if hasattr(fcntl, "F_GET_SEALS"):
+            assert fcntl.fcntl(view.fd, fcntl.F_GET_SEALS) & fcntl.F_SEAL_WRITE
+        with pytest.raises(PermissionError):
+            with open(view.path, 'r+b') as f:
+                f.write(b"SECRET")
+                f.flush()
+        with open(view.path, 'rb') as f:
+            assert f.read() == b"secret"
+    assert os.listdir(runtime) == [] and view.fd is None
+
+
+def test_plaintext_can_be_streamed_in(runtime):
+    with handoff.Handoff(lambda f: f.write(b"streamed"), "a/b/photo.jpg") as view:
+        assert os.path.basename(view.path) == "photo.jpg"
+        with open(view.path, 'rb') as f:
+            assert f.read() == b"streamed"
+
+
+def test_falls_back_to_a_private_file_without_memfd(runtime, monkeypatch):
+    def memfd_create(name, flags=0):
+        raise OSError("not here")
+    monkeypatch.setattr(handoff.os, "memfd_create", memfd_create, raising=False)
+    with handoff.Handoff(b"secret", "notes.txt") as view:
+        assert not view.in_memory and view.fd is None
+        assert not os.path.islink(view.path) and os.stat(view.path).st_mode & 0o777 == 0o600
+        with open(view.path, 'rb') as f:
+            assert f.read() == b"secret"
+    assert os.listdir(runtime) == []
+
+
+def test_a_failed_handoff_leaves_nothing_behind(runtime):
+    def fail(f):
+        raise ValueError("wrong key")
+    with pytest.raises(ValueError):
+        handoff.Handoff(fail, "notes.txt")
+    assert os.listdir(runtime) == []
@@ -0,0 +1,88 @@
+import os
+import pytest
+import append_log
+import manifest
+
+ENTRY = {"name": "report.pdf", "size": 10, "mime": "application/pdf", "mtime": 1.0, "sha256": "ab" * 32}
+
+
+@pytest.fixture
+def drive(tmp_path):
+    mount_point = tmp_path / "drive"
+    mount_point.mkdir()
+    index = manifest.open_manifest(str(mount_point), "password")
+    index.put(".report.pdf.enc", ENTRY)
+    return str(mount_point), index.path
+
+
+def first_record_offset(path):
+    return next(append_log.AppendLog(path, manifest.MAGIC).scan())[0]
+
+
+def test_wrong_password_leaves_the_manifest_untouched(drive):
+    mount_point, path = drive
+    with open(path, 'rb') as f:
+        before = f.read()
+    with pytest.raises(manifest.ManifestKeyError):
+        manifest.open_manifest(mount_point, "wrong")
+    with open(path, 'rb') as f:
+        assert f.read() == before
+    assert manifest.open_manifest(mount_point, "password").entries == {".report.pdf.enc": ENTRY}
+
+
+def test_rewrap_after_a_drive_password_change_keeps_the_entries(drive):
+    mount_point, path = drive
+    manifest.rewrap_manifest(mount_point, "password", "new password")
+    with pytest.raises(manifest.ManifestKeyError):
+        manifest.open_manifest(mount_point, "password")
+    assert manifest.open_manifest(mount_point, "new password").entries == {".report.pdf.enc": ENTRY}
+    with pytest.raises(manifest.ManifestKeyError):
+        manifest.rewrap_manifest(mount_point, "password", "other")
+
+
+def test_rebuild_keeps_the_locked_manifest_aside(drive):
+    mount_point, path = drive
+    rebuilt = manifest.rebuild_manifest(mount_point, "new password")
+    assert rebuilt.entries == {}
+    assert manifest.open_manifest(mount_point, "new password").entries == {}
+    kept = path + manifest.REPLACED_SUFFIX + ".1"
+    os.replace(kept, path)
+    assert manifest.open_manifest(mount_point, "password").entries == {".report.pdf.enc": ENTRY}
+
+
+def test_broken_manifests_are_kept_aside_and_rebuilt(drive):
+    mount_point, path = drive
+    with open(path, 'r+b') as f:
+        f.truncate(first_record_offset(path) + 3)
+    assert manifest.open_manifest(mount_point, "password").entries == {}
+    assert os.path.exists(path + manifest.DAMAGED_SUFFIX + ".1")
+
+    # A damaged first record is damage, not a wrong password, and does not overwrite the earlier copy
+    offset = first_record_offset(path)
+    with open(path, 'r+b') as f:
+        f.seek(offset + 20)
+        byte = f.read(1)
+        f.seek(offset + 20)
+        f.write(bytes([byte[0] ^ 1]))
+    assert manifest.open_manifest(mount_point, "password").entries == {}
+    assert sorted(name for name in os.listdir(os.path.dirname(path)) if manifest.DAMAGED_SUFFIX in name) == [
+        "manifest.damaged.1", "manifest.damaged.2"]
+
+
+def test_torn_append_is_ignored_and_overwritten(drive):
+    mount_point, path = drive
+    with open(path, 'ab') as f:
+        f.write(b'\0\0\1\0partial')
+    index = manifest.open_manifest(mount_point, "password")
+    assert index.entries == {".report.pdf.enc": ENTRY}
+    index.remove(".report.pdf.enc")
+    assert manifest.open_manifest(mount_point, "password").entries == {}
+
+
+def test_log_is_compacted(drive):
+    mount_point, path = drive
+    index = manifest.open_manifest(mount_point, "password")
+    for i in range(3 * append_log.COMPACT_MIN_RECORDS):
+        index.put(".report.pdf.enc", dict(ENTRY, size=i))
+    assert index._log.records <= append_log.COMPACT_MIN_RECORDS
+    assert manifest.open_manifest(mount_point, "password").entries[".report.pdf.enc"]["size"] == i
@@ -0,0 +1,92 @@
+import time
+import threading
+import pytest
+import pipeline
+
+
+def reader(count, fail_at=None):
+    def read(p):
+        for index in range(count):
+            if index == fail_at:
+                raise ValueError("bad read")
+            slot = p.take_slot()
+            slot.index = index
+            p.emit(slot)
+    return read
+
+
+def test_results_are_written_in_order_with_a_bounded_pool():
+    p = pipeline.Pipeline(4, 4, workers=4, depth=3)
+    written = []
+
+    def process(slot):
+        time.sleep(0.001 * (slot.index % 3))  # Workers finish out of order
+        slot.result = slot.index * 2
+
+    p.run(reader(50), process, lambda slot: written.append(slot.result))
+    assert written == [index * 2 for index in range(50)]
+    assert p._unallocated == 0 and p._free.qsize() == 3
+
+
+@pytest.mark.parametrize("stage", ["read", "process", "write"])
+def test_the_first_error_of_any_stage_stops_the_others_and_is_raised(stage):
+    p = pipeline.Pipeline(4, 4, workers=2, depth=2)
+    written = []
+
+    def process(slot):
+        if stage == "process" and slot.index == 5:
+            raise ValueError("bad process")
+
+    def write(slot):
+        if stage == "write" and slot.index == 5:
+            raise ValueError("bad write")
+        written.append(slot.index)
+
+    with pytest.raises(ValueError, match=f"bad {stage}"):
+        p.run(reader(1000, fail_at=5 if stage == "read" else None), process, write)
+    assert written == list(range(5))
+
+
+def test_a_stage_blocked_on_a_queue_gives_up_once_another_fails():
+    p = pipeline.Pipeline(4, 4, workers=1, depth=2)
+    stuck = threading.Event()
+
+    def read(p):
+        for index in range(10):
+            slot = p.take_slot()  # Blocks once both slots wait on the writer
+            slot.index = index
+            p.emit(slot)
+
+    def write(slot):
+        stuck.wait()
+        raise ValueError("bad write")
+
+    threading.Timer(0.2, stuck.set).start()
+    with pytest.raises(ValueError, match="bad write"):
+        p.run(read, lambda slot: None, write)
+
+
+def test_interrupting_run_stops_the_stages(monkeypatch):
+    p = pipeline.Pipeline(4, 4, workers=1, depth=2)
+    started = threading.Event()
+    real_join = threading.Thread.join
+
+    def join(thread, timeout=None):
+        if started.is_set():
+            raise KeyboardInterrupt()
+        return real_join(thread, timeout)
+    monkeypatch.setattr(threading.Thread, "join", join)
+
+    def read(p):
+        started.set()
+        while True:  # Never finishes on its own
+            slot = p.take_slot()
+            slot.index = 0
+            p.emit(slot)
+
+    def write(slot):
+        time.sleep(0.01)
+
+    with pytest.raises(KeyboardInterrupt):
+        p.run(read, lambda slot: None, write)
+    assert p._failed.is_set()
@@ -0,0 +1,85 @@
+import os
+import pytest
+import privileged_helper
+
+
+@pytest.fixture
+def layout(tmp_path):
+    """A mount point with a subfolder, and a directory outside it that symlinks on the drive point to."""
+    root = tmp_path / "mnt"
+    (root / "sub").mkdir(parents=True)
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    outside.chmod(0o755)
+    (outside / "victim").write_text("keep me")
+    (root / "link").symlink_to(outside)
+    return root, outside
+
+
+@pytest.fixture
+def operations(layout):
+    root, _ = layout
+    return privileged_helper.Operations(str(root), os.getuid(), os.getgid(), stand_in=True)
+
+
+def test_make_dir_creates_private_directory(layout, operations):
+    root, _ = layout
+    assert operations.handle({"op": "make_dir", "path": str(root / "new")}) == {"ok": True}
+    assert (root / "new").stat().st_mode & 0o777 == 0o700
+    assert operations.handle({"op": "make_dir", "path": str(root / "new")}) == {"ok": True}
+
+
+def test_make_dir_refuses_symlink_instead_of_following_it(layout, operations):
+    root, outside = layout
+    response = operations.handle({"op": "make_dir", "path": str(root / "link")})
+    assert not response["ok"]
+    assert outside.stat().st_mode & 0o777 == 0o755
+    assert not operations.handle({"op": "make_dir", "path": str(root / "link" / "inside")})["ok"]
+    assert not (outside / "inside").exists()
+
+
+def test_delete_and_move_do_not_follow_symlinked_directories(layout, operations):
+    root, outside = layout
+    (root / "sub" / "file").write_text("data")
+    results = operations.handle({"op": "delete", "paths": [str(root / "link" / "victim"),
+                                                           str(root / ".." / "outside" / "victim"),
+                                                           str(root / "sub" / "file"),
+                                                           str(root / "sub" / "missing")]})["results"]
+    assert results[0] is not None and results[1] is not None
+    assert results[2:] == [None, None]
+    assert (outside / "victim").exists() and not (root / "sub" / "file").exists()
+
+    (root / "sub" / "file").write_text("data")
+    results = operations.handle({"op": "move", "pairs": [[str(root / "sub" / "file"), str(root / "link" / "file")],
+                                                         [str(root / "sub" / "file"), str(root / "moved")]]})["results"]
+    assert results[0] is not None and results[1] is None
+    assert not (outside / "file").exists() and (root / "moved").read_text() == "data"
+
+
+def test_paths_outside_the_mount_point_are_refused(layout, operations, tmp_path):
+    root, _ = layout
+    for path in (str(tmp_path / "elsewhere"), str(root), str(root) + "-other/x"):
+        assert not operations.handle({"op": "make_dir", "path": path})["ok"]
+    assert not operations.handle({"op": "mount", "name": "../../etc"})["ok"]
+    assert not operations.handle({"op": "reboot"})["ok"]
+
+
+def test_stand_in_helper_over_its_socket(layout):
+    root, outside = layout
+    (root / "a").write_text("a")
+    (root / "b").write_text("b")
+    helper = privileged_helper.start(root=str(root), stand_in=True)
+    try:
+        assert helper.alive
+        helper.make_dir(str(root / "state"))
+        assert helper.move([(str(root / "a"), str(root / "state" / "a"))]) == [None]
+        assert helper.delete([str(root / "b"), str(root / "missing")]) == [None, None]
+        with pytest.raises(privileged_helper.HelperError):
+            helper.make_dir(str(root / "link"))
+        helper.mount("encrypted_partition", "xfs")
+        assert helper.luks_status("encrypted_partition") is False
+    finally:
+        helper.close()
+    assert not helper.alive
+    assert sorted(os.listdir(root)) == ["link", "state", "sub"]
+    assert outside.stat().st_mode & 0o777 == 0o755
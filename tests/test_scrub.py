@@ -0,0 +1,108 @@
+import io
+import os
+import errno
+import threading
+import container
+import encryption
+import scrub
+
+
+def encrypted_file(tmp_path, size):
+    source = tmp_path / "file"
+    source.write_bytes(os.urandom(size))
+    return encryption.encrypt_file(str(source), "password")
+
+
+def flip_byte(path, offset):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 1]))
+
+
+def scrub_one(path, password):
+    return scrub.Scrubber([path], password, workers=1).run()["files"][0]
+
+
+def test_intact_file_is_ok(tmp_path):
+    assert scrub_one(encrypted_file(tmp_path, 3 * container.SEGMENT_SIZE), "password")["status"] == scrub.OK
+
+
+def test_damaged_single_segment_file_is_corrupt_not_unverified(tmp_path):
+    path = encrypted_file(tmp_path, 5000)
+    flip_byte(path, container.DATA_OFFSET + 40)
+    result = scrub_one(path, "password")
+    assert result["status"] == scrub.CORRUPT and result["corrupt_segments"] == [0]
+
+
+def test_wrong_password_is_unverified(tmp_path):
+    path = encrypted_file(tmp_path, 5000)
+    assert scrub_one(path, "other")["status"] == scrub.UNVERIFIED
+
+
+def failing_pread(monkeypatch, fail_offset):
+    """Makes os.pread raise EIO for reads starting at fail_offset, like a failing sector."""
+    real_pread = os.pread
+
+    def pread(fd, length, offset):
+        if offset == fail_offset:
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+        return real_pread(fd, length, offset)
+    monkeypatch.setattr(os, "pread", pread)
+
+
+def test_read_error_in_a_segment_is_reported_and_the_scrub_carries_on(tmp_path, monkeypatch):
+    (tmp_path / "one").mkdir()
+    (tmp_path / "two").mkdir()
+    damaged = encrypted_file(tmp_path / "one", 3 * container.SEGMENT_SIZE)
+    intact = encrypted_file(tmp_path / "two", 5000)
+    with container.ContainerReader(damaged, encryption.file_key(damaged, "password")) as reader:
+        offset, _ = reader.entries[1]
+    failing_pread(monkeypatch, offset)
+    report = scrub.Scrubber([damaged, intact], "password", workers=2).run()
+    first, second = report["files"]
+    assert first["status"] == scrub.UNREADABLE and first["unreadable_segments"] == [1]
+    assert first["checked"] == 3 and not first["corrupt_segments"]
+    assert second["status"] == scrub.OK
+    assert "unreadable segments 1" in scrub.format_report(report)
+
+
+def test_read_error_opening_a_file_is_reported(tmp_path, monkeypatch):
+    path = encrypted_file(tmp_path, 5000)
+    failing_pread(monkeypatch, 0)
+    assert scrub_one(path, "password")["status"] == scrub.UNREADABLE
+
+
+def test_read_error_in_a_legacy_file_is_reported(tmp_path, monkeypatch):
+    path = tmp_path / "legacy.enc"
+    with open(path, 'wb') as dst:
+        encryption.encrypt_stream(io.BytesIO(os.urandom(5000)), dst, encryption.derive_key("password"))
+
+    def decrypt_stream(src, dst, key):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+    monkeypatch.setattr(encryption, "decrypt_stream", decrypt_stream)
+    assert scrub_one(str(path), "password")["status"] == scrub.UNREADABLE
+
+
+def test_time_spent_paused_is_left_out_of_the_rate(tmp_path):
+    scrubber = scrub.Scrubber([encrypted_file(tmp_path, 5000)], "password", workers=1)
+    scrubber.pause()
+    threading.Timer(0.5, scrubber.resume).start()
+    report = scrubber.run()
+    assert report["files"][0]["status"] == scrub.OK
+    assert report["seconds"] < 0.4
+
+
+def test_legacy_files_are_found_under_either_salt(tmp_path, monkeypatch):
+    data = os.urandom(5000)
+    monkeypatch.setattr(encryption.os, "urandom", lambda size: b"\0" * size)  # Fixed IVs keep the padding check repeatable
+    paths = []
+    for salt in encryption.LEGACY_SALTS:
+        path = str(tmp_path / f"{salt.hex()}.enc")
+        with open(path, 'wb') as dst:
+            encryption.encrypt_stream(io.BytesIO(data), dst, encryption.derive_key("password", salt))
+        paths.append(path)
+    monkeypatch.undo()
+    report = scrub.Scrubber(paths, "password", workers=1).run()
+    assert [result["status"] for result in report["files"]] == [scrub.OK, scrub.OK]
@@ -0,0 +1,50 @@
+import os
+import sys
+import textwrap
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPARSE_SIZE = 2 * 1024 ** 3  # Far more than the memory the process is allowed to grow to
+RSS_CAP_MB = 160  # Interpreter, cryptography and the pipeline buffers, with room to spare
+
+# Runs in a fresh interpreter so that its peak RSS covers nothing but the streaming
+CHILD = textwrap.dedent("""
+    import os, sys, resource
+    sys.path.insert(0, sys.argv[1])
+    import host_profile
+    host_profile.PROFILE_PATH = os.path.join(sys.argv[2], "host_profile.json")
+    import encryption, kdf
+
+    source, encrypted = os.path.join(sys.argv[2], "sparse"), os.path.join(sys.argv[2], "sparse.enc")
+    size = int(sys.argv[3])
+    with open(source, "wb") as f:
+        f.truncate(size)
+    params = kdf.session_params()
+    key = kdf.derive("password", params)
+
+    # Every byte through the cipher, ciphertext discarded
+    encryption.encrypt_to(source, os.devnull, key, params, compression_codec=None)
+    # Kept on disk (the zeros compress) so that the whole plaintext can be streamed back out
+    encryption.encrypt_to(source, encrypted, key, params)
+
+    class ZeroCheck:
+        count = 0
+        def write(self, data):
+            if bytes(data) != bytes(len(data)):
+                raise AssertionError("decrypted data differs")
+            self.count += len(data)
+            return len(data)
+
+    out = ZeroCheck()
+    encryption.decrypt_to_stream(encrypted, out, encryption.file_key(encrypted, "password"))
+    assert out.count == size, out.count
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)
+""")
+
+
+def test_multi_gb_sparse_file_streams_under_memory_cap(tmp_path):
+    result = subprocess.run([sys.executable, "-c", CHILD, ROOT, str(tmp_path), str(SPARSE_SIZE)],
+                            capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stderr
+    peak_mb = int(result.stdout.split()[-1])
+    assert peak_mb < RSS_CAP_MB, f"peak RSS {peak_mb} MB while streaming {SPARSE_SIZE >> 30} GB"
@@ -0,0 +1,69 @@
+import io
+import os
+from PIL import Image
+import append_log
+import encryption
+import thumbnails
+
+
+def image_file(directory, name, password):
+    """Encrypts a small PNG onto the drive and returns its on-drive name."""
+    out = io.BytesIO()
+    Image.new("RGB", (200, 100), "red").save(out, "PNG")
+    source = directory / name
+    source.write_bytes(out.getvalue())
+    encrypted = encryption.encrypt_file(str(source), password)
+    os.remove(source)
+    return os.path.basename(encrypted)
+
+
+def run_backfill(cache, mount_point, entries, password):
+    found = {}
+    thumbnails.backfill(cache, str(mount_point), entries, password, set(),
+                        on_thumbnail=lambda name, mime, key: found.setdefault(name, key))
+    return found
+
+
+def test_a_thumbnail_opens_only_with_its_own_key(tmp_path):
+    cache = thumbnails.open_cache(str(tmp_path))
+    key, other = os.urandom(32), os.urandom(32)
+    cache.put("a.enc", b"png", key)
+    reopened = thumbnails.open_cache(str(tmp_path))
+    assert "a.enc" in reopened
+    assert reopened.get("a.enc", key) == b"png"
+    assert reopened.get("a.enc", other) is None
+
+
+def test_backfill_shows_only_files_of_the_password_given(tmp_path):
+    mine = image_file(tmp_path, "mine.png", "mine")
+    theirs = image_file(tmp_path, "theirs.png", "theirs")
+    entries = {mine: None, theirs: None}
+    cache = thumbnails.open_cache(str(tmp_path))
+
+    found = run_backfill(cache, tmp_path, entries, "mine")
+    assert set(found) == {mine}
+    file_key = encryption.file_key(str(tmp_path / mine), "mine")
+    assert found[mine] == thumbnails.thumbnail_key(file_key)
+    assert cache.get(mine, found[mine]).startswith(b"\x89PNG")
+
+    # Another password finds the cached thumbnail but cannot open it, so renders its own files only
+    other = run_backfill(cache, tmp_path, entries, "theirs")
+    assert set(other) == {theirs}
+    assert cache.get(mine, other[theirs]) is None
+
+
+def test_backfill_reuses_a_cached_thumbnail(tmp_path, monkeypatch):
+    name = image_file(tmp_path, "picture.png", "password")
+    cache = thumbnails.open_cache(str(tmp_path))
+    key = run_backfill(cache, tmp_path, {name: None}, "password")[name]
+    monkeypatch.setattr(thumbnails, "make_thumbnail", lambda source, mime_type: None)
+    assert run_backfill(cache, tmp_path, {name: None}, "password") == {name: key}
+
+
+def test_a_cache_under_the_drive_key_is_discarded(tmp_path):
+    path = str(tmp_path / thumbnails.THUMBNAIL_NAME)
+    append_log.AppendLog(path, thumbnails.MAGIC).write({"cache_id": "00" * 16, "check": "ab"}, [b"t" * 40])
+    thumbnails.open_cache(str(tmp_path))
+    log = append_log.AppendLog(path, thumbnails.MAGIC)
+    assert log.read_header()["format"] == thumbnails.FORMAT
+    assert list(log.scan()) == []
@@ -0,0 +1,116 @@
+import time
+import threading
+import transfer_queue
+
+TIMEOUT = 5
+
+
+def wait_for(predicate):
+    deadline = time.monotonic() + TIMEOUT
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Worker:
+    """process() for the queue that moves one byte at a time, each only when the test lets it."""
+
+    def __init__(self, fail_first=False):
+        self.steps = threading.Semaphore(0)
+        self.started = threading.Event()
+        self.fail_first = fail_first
+        self.runs = 0
+
+    def __call__(self, transfer, on_bytes):
+        self.runs += 1
+        self.started.set()
+        if self.fail_first and self.runs == 1:
+            raise OSError("stick pulled")
+        for _ in range(transfer.size):
+            assert self.steps.acquire(timeout=TIMEOUT)
+            on_bytes(1)
+        return transfer.source
+
+    def step(self, count=1):
+        for _ in range(count):
+            self.steps.release()
+
+
+def test_a_paused_transfer_waits_and_resumes():
+    worker = Worker()
+    queue = transfer_queue.TransferQueue(worker, workers=1)
+    transfer = queue.add("a", "b", 3, "password")
+    worker.started.wait(TIMEOUT)
+    worker.step()
+    wait_for(lambda: transfer.done == 1)
+    queue.pause(transfer)
+    worker.step(2)  # Blocks in its next progress callback instead
+    time.sleep(0.05)
+    assert transfer.status == transfer_queue.PAUSED and transfer.done == 1
+    queue.resume(transfer)
+    wait_for(lambda: transfer.status == transfer_queue.DONE)
+    assert transfer.result == "a" and transfer.done == 3 and transfer.password is None
+    queue.stop()
+
+
+def test_a_transfer_paused_while_queued_only_runs_once_resumed():
+    worker = Worker()
+    queue = transfer_queue.TransferQueue(worker, workers=1)
+    first = queue.add("first", "b", 1, "password")
+    second = queue.add("second", "b", 1, "password")
+    queue.pause(second)
+    worker.step()
+    wait_for(lambda: first.status == transfer_queue.DONE)
+    time.sleep(0.05)
+    assert second.status == transfer_queue.PAUSED and worker.runs == 1
+    queue.resume(second)
+    worker.step()
+    wait_for(lambda: second.status == transfer_queue.DONE)
+    queue.stop()
+
+
+def test_cancel_running_and_queued_transfers():
+    worker = Worker()
+    queue = transfer_queue.TransferQueue(worker, workers=1)
+    running = queue.add("running", "b", 5, "password")
+    queued = queue.add("queued", "b", 5, "password")
+    worker.started.wait(TIMEOUT)
+    queue.cancel(queued)
+    assert queued.status == transfer_queue.CANCELLED
+    queue.cancel(running)
+    worker.step()
+    wait_for(lambda: running.status == transfer_queue.CANCELLED)
+    assert running.cancelled and worker.runs == 1 and not queue.active
+    queue.stop()
+
+
+def test_a_failed_transfer_can_be_retried_with_its_password():
+    worker = Worker(fail_first=True)
+    queue = transfer_queue.TransferQueue(worker, workers=1)
+    transfer = queue.add("a", "b", 1, "password")
+    wait_for(lambda: transfer.status == transfer_queue.FAILED)
+    assert transfer.error == "stick pulled" and transfer.password == "password"
+    queue.retry(transfer)
+    worker.step()
+    wait_for(lambda: transfer.status == transfer_queue.DONE)
+    queue.retry(transfer)  # Nothing to retry
+    assert transfer.status == transfer_queue.DONE and worker.runs == 2
+    queue.stop()
+
+
+def test_stop_waits_for_work_after_the_last_progress_callback():
+    release = threading.Event()
+    finished = []
+
+    def process(transfer, on_bytes):
+        on_bytes(1)
+        release.wait(TIMEOUT)  # Renaming into place, say: no progress callback to stop it
+        finished.append(transfer)
+
+    queue = transfer_queue.TransferQueue(process, workers=1)
+    transfer = queue.add("a", "b", 1, "password")
+    wait_for(lambda: transfer.done == 1)
+    assert not queue.stop(timeout=0.05)
+    release.set()
+    assert queue.stop()
+    assert finished == [transfer]
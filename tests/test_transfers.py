@@ -0,0 +1,227 @@
+import os
+import hashlib
+import pytest
+import container
+import drive_manager
+import encryption
+import transfer_journal
+import usb_io
+
+COMMIT = 2 * 1024 * 1024
+SIZE = 6 * 1024 * 1024 + 333
+
+
+class Unplugged(Exception):
+    """Stands in for the stick going away in the middle of a transfer."""
+
+
+def unplug_after(limit):
+    """on_bytes callback that fails once more than limit bytes have gone through."""
+    done = [0]
+
+    def on_bytes(count):
+        done[0] += count
+        if done[0] > limit:
+            raise Unplugged()
+    return on_bytes
+
+
+def counting():
+    done = []
+    return done, done.append
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    """A drive directory the user can write to, committing progress every COMMIT bytes."""
+    monkeypatch.setattr(transfer_journal, "COMMIT_BYTES", COMMIT)
+    monkeypatch.setattr(drive_manager, "sync_policy", usb_io.SyncPolicy(usb_io.FSYNC_FILE))
+    mount_point = tmp_path / "drive"
+    mount_point.mkdir()
+    source = tmp_path / "source.bin"
+    data = os.urandom(SIZE)
+    source.write_bytes(data)
+    return str(mount_point), str(source), data
+
+
+def test_interrupted_import_resumes_from_last_commit(drive):
+    mount_point, source, data = drive
+    destination = os.path.join(mount_point, ".source.bin.enc")
+    with pytest.raises(Unplugged):
+        drive_manager.store_encrypted(source, destination, "password", mount_point, on_bytes=unplug_after(5 * 2 ** 20))
+    assert not os.path.exists(destination)
+
+    done, on_bytes = counting()
+    drive_manager.store_encrypted(source, destination, "password", mount_point, on_bytes=on_bytes)
+    assert done[0] >= COMMIT  # Skipped what was committed instead of starting over
+    assert encryption.decrypt_file(destination, "password") == data
+    assert transfer_journal.transfers(drive_manager.state_dir(mount_point)) == []
+
+
+def test_interrupted_export_resumes_from_last_commit(drive, tmp_path):
+    mount_point, source, data = drive
+    encrypted = os.path.join(mount_point, ".source.bin.enc")
+    drive_manager.store_encrypted(source, encrypted, "password", mount_point)
+    destination = str(tmp_path / "exported.bin")
+    with pytest.raises(Unplugged):
+        drive_manager.export_decrypted(encrypted, destination, "password", mount_point,
+                                       on_bytes=unplug_after(5 * 2 ** 20))
+    assert not os.path.exists(destination)
+
+    done, on_bytes = counting()
+    drive_manager.export_decrypted(encrypted, destination, "password", mount_point, on_bytes=on_bytes)
+    assert done[0] >= COMMIT
+    with open(destination, 'rb') as f:
+        assert f.read() == data
+    assert os.stat(destination).st_mode & 0o777 == 0o600
+
+
+def test_recovery_completes_rolls_back_or_keeps_transfers(drive, tmp_path, monkeypatch):
+    mount_point, source, data = drive
+
+    # Finished but never renamed into place: completed on the next mount
+    finished = os.path.join(mount_point, ".finished.enc")
+
+    def lost_rename(*args, **kwargs):
+        raise Unplugged()
+    with monkeypatch.context() as patch:
+        patch.setattr(drive_manager, "move_into_place", lost_rename)
+        with pytest.raises(Unplugged):
+            drive_manager.store_encrypted(source, finished, "password", mount_point)
+
+    # Cut short part way: kept for resuming
+    partial = os.path.join(mount_point, ".partial.enc")
+    with pytest.raises(Unplugged):
+        drive_manager.store_encrypted(source, partial, "password", mount_point, on_bytes=unplug_after(3 * 2 ** 20))
+
+    # Source changed since: rolled back
+    other = tmp_path / "other.bin"
+    other.write_bytes(os.urandom(SIZE))
+    with pytest.raises(Unplugged):
+        drive_manager.store_encrypted(str(other), os.path.join(mount_point, ".other.enc"), "password", mount_point,
+                                      on_bytes=unplug_after(3 * 2 ** 20))
+    other.write_bytes(b"edited")
+
+    outcomes = {os.path.basename(entry["destination"]): entry["outcome"]
+                for entry in drive_manager.recover_transfers(mount_point)}
+    assert outcomes == {".finished.enc": transfer_journal.COMPLETED, ".partial.enc": transfer_journal.PENDING,
+                        ".other.enc": transfer_journal.ROLLED_BACK}
+    assert encryption.decrypt_file(finished, "password") == data
+    assert not os.path.exists(os.path.join(mount_point, ".other.enc"))
+
+    drive_manager.store_encrypted(source, partial, "password", mount_point)
+    assert encryption.decrypt_file(partial, "password") == data
+    assert drive_manager.recover_transfers(mount_point) == []
+
+
+def part_of(mount_point, destination):
+    for journal in transfer_journal.transfers(drive_manager.state_dir(mount_point)):
+        if journal.info["destination"] == destination:
+            return journal
+    return None
+
+
+def lose_rename(monkeypatch, source, destination, mount_point):
+    def lost_rename(*args, **kwargs):
+        raise Unplugged()
+    with monkeypatch.context() as patch:
+        patch.setattr(drive_manager, "move_into_place", lost_rename)
+        with pytest.raises(Unplugged):
+            drive_manager.store_encrypted(source, destination, "password", mount_point)
+
+
+def test_recovery_authenticates_an_unflushed_import_before_completing_it(drive, monkeypatch):
+    mount_point, source, data = drive
+    monkeypatch.setattr(drive_manager, "sync_policy", usb_io.SyncPolicy(usb_io.FSYNC_BATCH))
+    intact = os.path.join(mount_point, ".intact.enc")
+    torn = os.path.join(mount_point, ".torn.enc")
+    lose_rename(monkeypatch, source, intact, mount_point)
+    lose_rename(monkeypatch, source, torn, mount_point)
+    journal = part_of(mount_point, torn)
+    assert not journal.complete
+    with open(journal.info["part"], 'r+b') as f:
+        f.seek(journal.committed_offset + 100)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 1]))  # Never reached the disk intact
+
+    outcomes = {os.path.basename(entry["destination"]): entry["outcome"]
+                for entry in drive_manager.recover_transfers(mount_point)}
+    assert outcomes == {".intact.enc": transfer_journal.PENDING, ".torn.enc": transfer_journal.PENDING}
+
+    outcomes = {os.path.basename(entry["destination"]): entry["outcome"]
+                for entry in drive_manager.recover_transfers(mount_point, password="password")}
+    assert outcomes == {".intact.enc": transfer_journal.COMPLETED, ".torn.enc": transfer_journal.PENDING}
+    assert encryption.decrypt_file(intact, "password") == data
+    assert os.path.getsize(journal.info["part"]) == journal.committed_offset
+
+    drive_manager.store_encrypted(source, torn, "password", mount_point)
+    assert encryption.decrypt_file(torn, "password") == data
+
+
+def test_recovery_keeps_an_export_that_was_not_flushed_to_the_end(drive, tmp_path, monkeypatch):
+    mount_point, source, data = drive
+    encrypted = os.path.join(mount_point, ".source.bin.enc")
+    drive_manager.store_encrypted(source, encrypted, "password", mount_point)
+    destination = str(tmp_path / "exported.bin")
+
+    def crash(*args):
+        raise Unplugged()
+    with monkeypatch.context() as patch:
+        patch.setattr(transfer_journal.TransferJournal, "mark_complete", crash)
+        with pytest.raises(Unplugged):
+            drive_manager.export_decrypted(encrypted, destination, "password", mount_point)
+    assert os.path.getsize(part_of(mount_point, destination).info["part"]) == SIZE  # Looks done, but is unproven
+
+    [entry] = drive_manager.recover_transfers(mount_point, password="password")
+    assert entry["outcome"] == transfer_journal.PENDING
+    drive_manager.export_decrypted(encrypted, destination, "password", mount_point)
+    with open(destination, 'rb') as f:
+        assert f.read() == data
+
+
+def test_a_completed_import_is_not_encrypted_again(drive, monkeypatch):
+    mount_point, source, data = drive
+    destination = os.path.join(mount_point, ".source.bin.enc")
+    lose_rename(monkeypatch, source, destination, mount_point)
+    assert part_of(mount_point, destination).complete
+
+    with pytest.raises(container.WrongKeyError):
+        encryption.encrypt_resumable(source, part_of(mount_point, destination).info["part"], "other",
+                                     part_of(mount_point, destination))
+    digest = hashlib.sha256()
+    monkeypatch.setattr(container, "write_container", None)
+    drive_manager.store_encrypted(source, destination, "password", mount_point, digest=digest)
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert encryption.decrypt_file(destination, "password") == data
+
+
+def test_replacing_a_file_flushes_it_first_whatever_the_policy(drive, monkeypatch):
+    mount_point, source, data = drive
+    monkeypatch.setattr(drive_manager, "sync_policy", usb_io.SyncPolicy(usb_io.FSYNC_UNMOUNT))
+    new = os.path.join(mount_point, ".new.enc")
+    replaced = os.path.join(mount_point, ".replaced.enc")
+    with open(replaced, 'wb') as f:
+        f.write(b"old")
+    lose_rename(monkeypatch, source, new, mount_point)
+    lose_rename(monkeypatch, source, replaced, mount_point)
+    assert not part_of(mount_point, new).complete
+    assert part_of(mount_point, replaced).complete
+
+
+def test_recovery_sweeps_parts_no_journal_owns(drive, monkeypatch):
+    mount_point, source, data = drive
+    partial = os.path.join(mount_point, ".partial.enc")
+    with pytest.raises(Unplugged):
+        drive_manager.store_encrypted(source, partial, "password", mount_point, on_bytes=unplug_after(3 * 2 ** 20))
+    state = drive_manager.state_dir(mount_point)
+    orphans = [os.path.join(state, ".forgotten.part"),
+               os.path.join(transfer_journal.journal_dir(state), ".torn.part")]
+    for orphan in orphans:
+        with open(orphan, 'wb') as f:
+            f.write(b"left over")
+
+    [entry] = drive_manager.recover_transfers(mount_point)
+    assert entry["outcome"] == transfer_journal.PENDING
+    assert not any(os.path.exists(orphan) for orphan in orphans)
+    assert os.path.exists(part_of(mount_point, partial).info["part"])
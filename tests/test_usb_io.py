@@ -0,0 +1,175 @@
+import os
+import pytest
+import usb_io
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Records (offset, length) of every write that reaches the kernel."""
+    calls = []
+    real_write = os.write
+
+    def write(fd, data):
+        calls.append((os.lseek(fd, 0, os.SEEK_CUR), len(data)))
+        return real_write(fd, data)
+    monkeypatch.setattr(usb_io.os, "write", write)
+    return calls
+
+
+def test_aligned_writer_hands_the_kernel_whole_aligned_chunks(tmp_path, writes):
+    path = str(tmp_path / "out")
+    data = os.urandom(200 * 1024 + 7)
+    with usb_io.AlignedWriter(path, chunk_size=64 * 1024) as f:
+        for start in range(0, len(data), 1000):
+            f.write(data[start:start + 1000])
+        f.write(b"")
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert [length for _, length in writes[:-1]] == [64 * 1024] * 3
+    assert writes[-1] == (3 * 64 * 1024, len(data) - 3 * 64 * 1024)
+
+
+def test_aligned_writer_realigns_after_seek_and_truncate(tmp_path, writes):
+    path = str(tmp_path / "out")
+    with open(path, 'wb') as f:
+        f.write(b"x" * 10000)
+    with usb_io.AlignedWriter(path, 'r+b', chunk_size=16 * 1024) as f:
+        f.truncate(5000)
+        f.seek(0, os.SEEK_END)
+        assert f.tell() == 5000
+        f.write(b"y" * 40000)
+    with open(path, 'rb') as f:
+        assert f.read() == b"x" * 5000 + b"y" * 40000
+    first_offset, first_length = writes[0]
+    assert first_offset == 5000 and (first_offset + first_length) % usb_io.ALIGNMENT == 0
+    assert all(offset % usb_io.ALIGNMENT == 0 for offset, _ in writes[1:])
+
+
+@pytest.fixture
+def flushes(monkeypatch):
+    calls = {"fsync": 0, "syncfs": []}
+
+    def fsync(fd):
+        calls["fsync"] += 1
+    monkeypatch.setattr(usb_io.os, "fsync", fsync)
+    monkeypatch.setattr(usb_io, "syncfs", calls["syncfs"].append)
+    return calls
+
+
+def write_file(policy, path):
+    with open(path, 'wb') as f:
+        f.write(b"data")
+        policy.file_written(f)
+
+
+def test_per_file_policy_flushes_each_file_at_once(tmp_path, flushes):
+    policy = usb_io.SyncPolicy(usb_io.FSYNC_FILE)
+    done = []
+    write_file(policy, str(tmp_path / "a"))
+    policy.when_durable(lambda: done.append("a"))
+    assert flushes["fsync"] == 1 and done == ["a"]
+    policy.batch_done()
+    assert flushes["syncfs"] == []
+
+
+def test_batch_policy_flushes_once_and_then_runs_waiting_callbacks(tmp_path, flushes):
+    policy = usb_io.SyncPolicy(usb_io.FSYNC_BATCH)
+    done = []
+    for name in ("a", "b"):
+        write_file(policy, str(tmp_path / name))
+        policy.when_durable(lambda name=name: done.append(name))
+    assert flushes["fsync"] == 0 and done == []
+    policy.batch_done()
+    assert flushes["syncfs"] == [str(tmp_path)] and done == ["a", "b"]
+    policy.batch_done()
+    assert flushes["syncfs"] == [str(tmp_path)]
+
+
+def test_unmount_policy_only_flushes_on_sync(tmp_path, flushes):
+    policy = usb_io.SyncPolicy(usb_io.FSYNC_UNMOUNT)
+    done = []
+    write_file(policy, str(tmp_path / "a"))
+    policy.when_durable(lambda: done.append("a"))
+    policy.batch_done()
+    assert flushes["syncfs"] == [] and done == []
+    policy.sync()
+    assert flushes["syncfs"] == [str(tmp_path)] and done == ["a"]
+
+
+def test_a_failed_flush_keeps_what_it_was_waiting_for(tmp_path, monkeypatch):
+    policy = usb_io.SyncPolicy(usb_io.FSYNC_BATCH)
+    done = []
+    write_file(policy, str(tmp_path / "a"))
+    policy.when_durable(lambda: done.append("a"))
+
+    def failing_syncfs(path):
+        raise OSError("device gone")
+    monkeypatch.setattr(usb_io, "syncfs", failing_syncfs)
+    with pytest.raises(OSError):
+        policy.sync()
+    assert done == []
+    monkeypatch.setattr(usb_io, "syncfs", lambda path: None)
+    policy.sync()
+    assert done == ["a"]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        usb_io.SyncPolicy("sometimes")
+
+
+@pytest.fixture
+def unnamed(tmp_path):
+    """Skips the test where the filesystem has no O_TMPFILE."""
+    try:
+        os.close(os.open(tmp_path, os.O_TMPFILE | os.O_WRONLY, 0o600))
+    except (AttributeError, OSError):
+        pytest.skip("no O_TMPFILE here")
+
+
+def test_atomic_output_only_appears_on_commit(tmp_path, unnamed):
+    destination = tmp_path / "out"
+    destination.write_bytes(b"old")
+    with usb_io.AtomicOutput(str(destination)) as output:
+        assert not output.named
+        output.file.write(b"new")
+        assert os.listdir(tmp_path) == ["out"] and destination.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["out"] and destination.read_bytes() == b"new"
+    assert os.stat(destination).st_mode & 0o777 == 0o600
+
+
+def test_atomic_output_leaves_nothing_when_interrupted(tmp_path, unnamed):
+    destination = tmp_path / "out"
+    destination.write_bytes(b"old")
+    with pytest.raises(KeyboardInterrupt):
+        with usb_io.AtomicOutput(str(destination)) as output:
+            output.file.write(b"new")
+            raise KeyboardInterrupt()
+    assert os.listdir(tmp_path) == ["out"] and destination.read_bytes() == b"old"
+
+
+def test_atomic_output_falls_back_to_a_named_file(tmp_path, monkeypatch):
+    monkeypatch.delattr(os, "O_TMPFILE", raising=False)
+    destination = str(tmp_path / "out")
+    output = usb_io.AtomicOutput(destination)
+    assert output.named and os.path.exists(output.temp_path)
+    output.file.write(b"data")
+    output.discard()
+    assert os.listdir(tmp_path) == []
+    with usb_io.AtomicOutput(destination) as output:
+        output.file.write(b"data")
+    assert os.listdir(tmp_path) == ["out"]
+    with open(destination, 'rb') as f:
+        assert f.read() == b"data"
+
+
+def test_link_fd_names_an_unnamed_file_but_never_overwrites(tmp_path, unnamed):
+    fd = os.open(tmp_path, os.O_TMPFILE | os.O_RDWR, 0o600)
+    try:
+        os.write(fd, b"data")
+        usb_io._link_fd(fd, str(tmp_path / "a"))
+        assert (tmp_path / "a").read_bytes() == b"data"
+        with pytest.raises(FileExistsError):
+            usb_io._link_fd(fd, str(tmp_path / "a"))
+    finally:
+        os.close(fd)
@@ -0,0 +1,249 @@
+import io
+import os
+import shutil
+import struct
+import hashlib
+import threading
+import subprocess
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from PIL import Image
+import append_log
+import cipher_engine
+import encryption
+import key_cache
+import mime_sniff
+
+# The thumbnail cache is an append log (see append_log.py):
+#   header   JSON (cache id, format)
+#   records  name tag | nonce | AES-GCM sealed PNG, appended one per thumbnail
+# Each thumbnail is sealed under a key derived from its own file's key (see
+# thumbnail_key), so it opens only for someone who can decrypt that file; the
+# drive password alone shows none of them. The name tag is a hash of the on-drive
+# file name, which anyone with the drive can list anyway, so the index can be read
+# without any key; a record holding only a name tag removes a thumbnail.
+THUMBNAIL_NAME = "thumbnails"
+MAGIC = b'SUSBTHMB'
+FORMAT = 2  # 1 sealed every thumbnail under one key from the drive password
+TAG_SIZE = 16
+THUMBNAIL_SIZE = 96  # Pixels on the longest side; the icon grid shows 64x64
+MAX_BACKFILL_BYTES = 64 * 1024 * 1024  # Larger files only get a thumbnail from their first bytes (videos) or when added
+TOOL_TIMEOUT = 30
+
+
+def can_thumbnail(mime_type):
+    """Whether make_thumbnail() knows how to render this type."""
+    return bool(mime_type) and (mime_type.startswith(("image/", "video/")) or mime_type == "application/pdf")
+
+
+def _render(image):
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    out = io.BytesIO()
+    image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def _run_tool(command, data=None):
+    """Runs an external renderer; plaintext given as bytes is fed on stdin so it never touches the disk."""
+    result = subprocess.run(command, input=data, stdin=None if data is not None else subprocess.DEVNULL,
+                            capture_output=True, timeout=TOOL_TIMEOUT)
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return _render(Image.open(io.BytesIO(result.stdout)))
+
+
+def make_thumbnail(source, mime_type):
+    """Renders a small PNG for an image, PDF or video given as a path or as bytes; None if it cannot.
+
+    A path is handed to the renderer as it is, so adding a large video does not
+    read it into memory; ffmpeg and pdftoppm only read the parts they need.
+    """
+    try:
+        if mime_type.startswith("image/"):
+            with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as image:
+                return _render(image)
+
+        data = None if isinstance(source, str) else source
+        if mime_type == "application/pdf" and shutil.which("pdftoppm"):
+            return _run_tool(["pdftoppm", "-png", "-f", "1", "-l", "1", "-singlefile",
+                              "-scale-to", str(THUMBNAIL_SIZE * 2),
+                              "-" if data is not None else os.path.abspath(source)], data)
+        if mime_type.startswith("video/") and shutil.which("ffmpeg"):
+            return _run_tool(["ffmpeg", "-loglevel", "error",
+                              "-i", "pipe:0" if data is not None else "file:" + os.path.abspath(source),
+                              "-vf", "thumbnail", "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "pipe:1"],
+                             data)
+    except Exception as e:
+        print(f"[WARN] Could not render a {mime_type} thumbnail: {e}")
+    return None
+
+
+def thumbnail_key(file_key):
+    """The key a file's thumbnail is sealed with, derived from the key that decrypts the file.
+
+    For containers that is the data key, which a password change rewraps but
+    keeps, so thumbnails survive it; for headerless files it is the password key.
+    """
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=b"secureusb thumbnail").derive(file_key)
+
+
+class ThumbnailCache:
+    """Encrypted, append-only store of small PNG thumbnails keyed by on-drive file name.
+
+    get() and put() take the thumbnail_key() of the file the thumbnail belongs to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cache_id = None
+        self._index = {}  # name tag -> (offset of sealed blob, length)
+        self._log = append_log.AppendLog(path, MAGIC)
+        self._lock = threading.Lock()
+
+    def _tag(self, name):
+        return hashlib.sha256(self._cache_id + name.encode()).digest()[:TAG_SIZE]
+
+    def _header(self):
+        return {"cache_id": self._cache_id.hex(), "format": FORMAT}
+
+    def _seal(self, tag, png, key):
+        engine = cipher_engine.AESGCMEngine(key)
+        nonce = os.urandom(engine.nonce_size)
+        return nonce + engine.seal(nonce, png, self._cache_id + tag)
+
+    def load(self):
+        """Reads the record headers only; returns False if the file is missing or of an older format."""
+        header = self._log.read_header()
+        if header is None:
+            return False
+        try:
+            if header.get("format") != FORMAT:
+                return False
+            cache_id = bytes.fromhex(header["cache_id"])
+            index = {}
+            for offset, length, tag in self._log.scan(peek=TAG_SIZE):
+                if length < TAG_SIZE:
+                    break
+                if length > TAG_SIZE:
+                    index[tag] = (offset + TAG_SIZE, length - TAG_SIZE)
+                else:
+                    index.pop(tag, None)
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return False
+        self._cache_id = cache_id
+        self._index = index
+        return True
+
+    def reset(self):
+        """Starts an empty cache, replacing whatever was on disk."""
+        with self._lock:
+            self._cache_id = os.urandom(16)
+            self._index = {}
+            self._log.write(self._header())
+
+    def __contains__(self, name):
+        return self._tag(name) in self._index
+
+    def get(self, name, key):
+        """Decrypts one thumbnail, or returns None if there is none or it does not open with key.
+
+        The latter is expected: the key of another password, or a thumbnail left
+        from a file that has since been replaced.
+        """
+        tag = self._tag(name)
+        with self._lock:
+            location = self._index.get(tag)
+            if location is None:
+                return None
+            blob = self._log.read(*location)
+        engine = cipher_engine.AESGCMEngine(key)
+        try:
+            return engine.open(blob[:engine.nonce_size], blob[engine.nonce_size:], self._cache_id + tag)
+        except InvalidTag:
+            return None
+
+    def _append(self, *records):
+        """Appends (tag, png and key, or None) records with a single write and fsync."""
+        bodies = [tag + self._seal(tag, *sealed) if sealed else tag for tag, sealed in records]
+        with self._lock:
+            offsets = self._log.append(bodies)
+            for (tag, sealed), offset, body in zip(records, offsets, bodies):
+                if sealed:
+                    self._index[tag] = (offset + TAG_SIZE, len(body) - TAG_SIZE)
+                else:
+                    self._index.pop(tag, None)
+            if self._log.should_compact(len(self._index)):
+                self._compact()
+
+    def put(self, name, png, key):
+        """Stores the thumbnail for an on-drive file name, sealed with that file's thumbnail_key()."""
+        self._append((self._tag(name), (png, key)))
+
+    def remove(self, name):
+        """Forgets the thumbnail of a deleted file."""
+        self.remove_many([name])
+
+    def remove_many(self, names):
+        """Forgets the thumbnails of deleted files, in one append."""
+        records = [(self._tag(name), None) for name in names if name in self]
+        if records:
+            self._append(*records)
+
+    def _compact(self):
+        """Rewrites the cache with only live records; called with the lock held."""
+        live = [(tag, self._log.read(offset, length)) for tag, (offset, length) in self._index.items()]
+        offsets = self._log.write(self._header(), [tag + blob for tag, blob in live])
+        self._index = {tag: (offset + TAG_SIZE, len(blob)) for (tag, blob), offset in zip(live, offsets)}
+
+
+def open_cache(directory):
+    """Opens the thumbnail cache in the drive's state directory, starting a new one if it is missing or stale."""
+    cache = ThumbnailCache(os.path.join(directory, THUMBNAIL_NAME))
+    if not cache.load():
+        cache.reset()
+    return cache
+
+
+def backfill(cache, mount_point, entries, password, tried, on_thumbnail=None, should_stop=None, salt=encryption.SALT):
+    """Finds the thumbnails of the files on the drive that decrypt with password, rendering missing ones.
+
+    Files are encrypted with their own passwords, so this is run with each password
+    the user enters and tried holds (name, password fingerprint) pairs that already
+    failed or were done. on_thumbnail(name, mime, key) is called for each file whose
+    thumbnail is now available, with the thumbnail_key() that opens it.
+    """
+    fingerprint = key_cache.fingerprint(password)
+    for name, entry in list(entries.items()):
+        if should_stop and should_stop():
+            return
+        mime_type = (entry or {}).get("mime")
+        if (name, fingerprint) in tried or (mime_type and not can_thumbnail(mime_type)):
+            continue
+        tried.add((name, fingerprint))
+        path = os.path.join(mount_point, name)
+        try:
+            file_key = encryption.file_key(path, password, salt)
+            if not mime_type:
+                mime_type = mime_sniff.sniff(encryption.decrypt_range(path, 0, mime_sniff.SNIFF_SIZE, file_key), name)
+                if not can_thumbnail(mime_type):
+                    continue
+            key = thumbnail_key(file_key)
+            if cache.get(name, key) is not None:
+                if on_thumbnail:
+                    on_thumbnail(name, mime_type, key)
+                continue
+            size = encryption.plaintext_size(path)
+            if size > MAX_BACKFILL_BYTES and not mime_type.startswith("video/"):
+                continue
+            data = encryption.decrypt_range(path, 0, min(size, MAX_BACKFILL_BYTES), file_key)
+        except Exception:
+            continue  # Most likely another password
+        png = make_thumbnail(data, mime_type)
+        if png:
+            cache.put(name, png, key)
+            if on_thumbnail:
+                on_thumbnail(name, mime_type, key)
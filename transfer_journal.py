@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import struct
+import tempfile
+import container
+import usb_io
+
+# Each transfer has two files in the journal directory of the drive's state directory:
+#   <id>.json  what is being transferred (written once, atomically)
+#   <id>.log   one record per durably committed segment, appended after the
+#              partial output has been fsynced up to and including that segment,
+#              and a COMPLETE record once the whole output has been fsynced
+# The drive itself is LUKS-encrypted, so the paths in the journal are protected at rest.
+JOURNAL_DIR = "journal"
+IMPORT = "import"  # Plaintext file encrypted onto the drive
+EXPORT = "export"  # Encrypted file decrypted off the drive
+COMMIT_BYTES = 16 * 1024 * 1024  # Plaintext between fsyncs; at most this much is redone after a crash
+RECORD = struct.Struct('>QQI')  # segments committed, segment offset, segment length (offset/length unused for exports)
+COMPLETE = 2 ** 64 - 1  # Segment count of the record saying the output is written and flushed to the end
+
+# Outcomes of the recovery pass
+COMPLETED = "completed"
+ROLLED_BACK = "rolled back"
+PENDING = "pending"  # Can be resumed once the user supplies the file password
+
+
+class TransferJournal:
+    """Durable progress record of one import or export, so it can resume after a crash or unplug."""
+
+    def __init__(self, path, info):
+        self.path = path
+        self.info = info
+        self.entries = []  # Committed container segments (imports)
+        self.segments = 0  # Committed segment count
+        self.complete = False  # The whole output was flushed before the journal said so
+        self._log = None
+
+    @property
+    def log_path(self):
+        return self.path[:-len(".json")] + ".log"
+
+    @property
+    def committed_bytes(self):
+        """Plaintext bytes that are durably done; committed segments are always full ones."""
+        return self.segments * self.info["segment_size"]
+
+    @property
+    def committed_offset(self):
+        """Where the durably committed part of the output ends; anything after it is unproven."""
+        if self.info["kind"] == EXPORT:
+            return self.committed_bytes
+        return self.entries[-1][0] + self.entries[-1][1] if self.entries else 0
+
+    def load(self):
+        """Reads the commit log; a torn record at the end is ignored."""
+        self.entries = []
+        self.segments = 0
+        self.complete = False
+        try:
+            with open(self.log_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        for start in range(0, len(data) - RECORD.size + 1, RECORD.size):
+            segments, offset, length = RECORD.unpack_from(data, start)
+            if segments == COMPLETE:
+                self.complete = True
+                continue
+            self.segments = segments
+            self.complete = False
+            if length:
+                self.entries.append((offset, length))
+        return self
+
+    def source_unchanged(self):
+        """Whether the transfer's source still looks exactly as it did when the transfer started."""
+        try:
+            stat = os.stat(self.info["source"])
+        except OSError:
+            return False
+        return stat.st_size == self.info["source_size"] and stat.st_mtime == self.info["source_mtime"]
+
+    def _append(self, dst, records):
+        # The data must be durable before the journal says it is
+        dst.flush()
+        os.fsync(dst.fileno())
+        if self._log is None:
+            self._log = open(self.log_path, 'ab')
+        self._log.write(records)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def segment_written(self, dst, entries, size, last):
+        """container.write_container callback: commits full segments every COMMIT_BYTES."""
+        if last or size - self.committed_bytes < COMMIT_BYTES:
+            return
+        new = entries[len(self.entries):]
+        self._append(dst, b''.join(RECORD.pack(self.segments + i + 1, *entry) for i, entry in enumerate(new)))
+        self.entries.extend(new)
+        self.segments = len(self.entries)
+
+    def segment_decrypted(self, dst, index):
+        """ContainerReader.write_to callback: commits the plaintext written so far every COMMIT_BYTES."""
+        if (index + 1 - self.segments) * self.info["segment_size"] < COMMIT_BYTES:
+            return
+        self._append(dst, RECORD.pack(index + 1, 0, 0))
+        self.segments = index + 1
+
+    def mark_complete(self, dst):
+        """Records that dst, the transfer's output, is written to the end; flushes it first."""
+        self._append(dst, RECORD.pack(COMPLETE, 0, 0))
+        self.complete = True
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def finish(self):
+        """Forgets the transfer once its output is in place."""
+        self.close()
+        for path in (self.log_path, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def abandon(self):
+        """Rolls the transfer back: removes the partial output and the journal."""
+        if os.path.exists(self.info["part"]):
+            os.remove(self.info["part"])
+        self.finish()
+
+
+def journal_dir(state):
+    path = os.path.join(state, JOURNAL_DIR)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def start(state, kind, source, destination, part, segment_size=container.SEGMENT_SIZE, durable=True):
+    """Creates the journal for a new transfer.
+
+    With durable=False the journal is not fsynced, for fsync policies that defer
+    flushing anyway; a crash may then forget the transfer instead of resuming it.
+    """
+    stat = os.stat(source)
+    info = {"id": os.urandom(8).hex(), "kind": kind, "source": source, "destination": destination, "part": part,
+            "source_size": stat.st_size, "source_mtime": stat.st_mtime, "segment_size": segment_size,
+            "started": time.time()}
+    directory = journal_dir(state)
+    path = os.path.join(directory, info["id"] + ".json")
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(info, f)
+            f.flush()
+            if durable:
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        if durable:
+            usb_io.fsync_dir(directory)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return TransferJournal(path, info)
+
+
+def transfers(state):
+    """Every journaled transfer on the drive, with its committed progress loaded."""
+    directory = os.path.join(state, JOURNAL_DIR)
+    if not os.path.isdir(directory):
+        return []
+    journals = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                journals.append(TransferJournal(path, json.load(f)).load())
+        except FileNotFoundError:
+            continue  # Finished by another worker since the listing
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Ignoring unreadable transfer journal {name}: {e}")
+    return journals
+
+
+def find(state, kind, source, destination):
+    """The interrupted transfer of source to destination that can be resumed, if any."""
+    for journal in transfers(state):
+        info = journal.info
+        if info["kind"] == kind and info["source"] == source and info["destination"] == destination:
+            if journal.source_unchanged() and os.path.exists(info["part"]):
+                return journal
+            journal.abandon()
+    return None
@@ -0,0 +1,235 @@
+import os
+import time
+import queue
+import threading
+import itertools
+from collections import deque
+
+# Transfer states
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+WORKERS = 2  # Files transferred at once; a USB stick rarely gets faster with more
+RATE_WINDOW = 5.0  # Seconds of progress the throughput of a transfer is averaged over
+
+
+class TransferCancelled(Exception):
+    """Raised inside a transfer's progress callback when it is cancelled or the queue stops."""
+
+
+class Transfer:
+    """One queued file and its progress; the fields are read by the GUI while a worker updates them."""
+
+    def __init__(self, transfer_id, source, destination, size, password, stopping, kind=None, name=None):
+        self.id = transfer_id
+        self.source = source
+        self.destination = destination
+        self.kind = kind  # Free for process() to tell kinds of transfer apart
+        self.name = name or os.path.basename(source)
+        self.size = size
+        self.password = password
+        self.status = QUEUED
+        self.error = None
+        self.result = None
+        self.done = 0
+        self._samples = deque()  # (time, done) within the last RATE_WINDOW seconds
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+        self._stopping = stopping
+        self._on_worker = False
+
+    @property
+    def cancelled(self):
+        """Whether the user cancelled this transfer (as opposed to the queue stopping)."""
+        return self._cancelled.is_set()
+
+    @property
+    def rate(self):
+        """Bytes per second over the last RATE_WINDOW seconds."""
+        if not self._on_worker or not self._running.is_set() or len(self._samples) < 2:
+            return 0.0
+        (first_time, first_done), (last_time, last_done) = self._samples[0], self._samples[-1]
+        elapsed = time.monotonic() - first_time
+        return (last_done - first_done) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        rate = self.rate
+        return (self.size - self.done) / rate if rate > 0 else None
+
+    def _start(self):
+        self.done = 0
+        self._samples = deque([(time.monotonic(), 0)])
+        self._on_worker = True
+
+    def advance(self, count):
+        """Progress callback for the worker: records count more bytes, blocks while paused, raises when cancelled."""
+        self._running.wait()
+        if self._cancelled.is_set() or self._stopping.is_set():
+            raise TransferCancelled()
+        self.done += count
+        now = time.monotonic()
+        self._samples.append((now, self.done))
+        while len(self._samples) > 2 and self._samples[0][0] < now - RATE_WINDOW:
+            self._samples.popleft()
+
+
+class TransferQueue:
+    """Runs queued transfers on background worker threads with pause, cancel and retry.
+
+    process(transfer, on_bytes) does the work of one transfer on a worker and
+    returns its result; on_bytes must be called as data moves. on_change(transfer)
+    is called on the worker thread whenever a transfer changes state.
+    """
+
+    def __init__(self, process, workers=WORKERS, on_change=None):
+        self.process = process
+        self.on_change = on_change
+        self.transfers = []
+        self._ids = itertools.count(1)
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def _changed(self, transfer):
+        if self.on_change:
+            self.on_change(transfer)
+
+    def add(self, source, destination, size, password, kind=None, name=None):
+        transfer = Transfer(next(self._ids), source, destination, size, password, self._stopping, kind, name)
+        with self._lock:
+            self.transfers.append(transfer)
+        self._pending.put(transfer)
+        self._changed(transfer)
+        return transfer
+
+    def _work(self):
+        while True:
+            transfer = self._pending.get()
+            if transfer is None:
+                return
+            with self._lock:
+                if transfer.status != QUEUED or self._stopping.is_set():
+                    continue  # Paused or cancelled while waiting; resume() and retry() queue it again
+                transfer.status = RUNNING
+                transfer._start()
+            self._changed(transfer)
+            try:
+                result = self.process(transfer, transfer.advance)
+            except TransferCancelled:
+                self._finish(transfer, CANCELLED if transfer.cancelled else FAILED,
+                             error=None if transfer.cancelled else "Interrupted; it resumes when added again")
+            except Exception as e:
+                self._finish(transfer, FAILED, error=str(e))
+            else:
+                self._finish(transfer, DONE, result=result)
+
+    def _finish(self, transfer, status, error=None, result=None):
+        with self._lock:
+            transfer._on_worker = False
+            transfer.status = status
+            transfer.error = error
+            transfer.result = result
+            if status == DONE:
+                transfer.done = transfer.size
+                transfer.password = None  # Only failed transfers may need it again, for a retry
+        self._changed(transfer)
+
+    def pause(self, transfer):
+        with self._lock:
+            if transfer.status not in (QUEUED, RUNNING):
+                return
+            transfer._running.clear()  # A running transfer blocks in its next progress callback
+            transfer.status = PAUSED
+        self._changed(transfer)
+
+    def resume(self, transfer):
+        with self._lock:
+            if transfer.status != PAUSED:
+                return
+            transfer._running.set()
+            if transfer._on_worker:
+                transfer.status = RUNNING
+            else:
+                transfer.status = QUEUED
+                self._pending.put(transfer)
+        self._changed(transfer)
+
+    def cancel(self, transfer):
+        with self._lock:
+            if transfer.status in FINISHED:
+                return
+            transfer._cancelled.set()
+            transfer._running.set()
+            if transfer._on_worker:
+                return  # The worker notices on its next progress callback
+            transfer.status = CANCELLED
+        self._changed(transfer)
+
+    def retry(self, transfer):
+        with self._lock:
+            if transfer.status not in (FAILED, CANCELLED) or transfer.password is None:
+                return
+            transfer._cancelled.clear()
+            transfer._running.set()
+            transfer.status = QUEUED
+            transfer.error = None
+            transfer.done = 0
+        self._pending.put(transfer)
+        self._changed(transfer)
+
+    def clear_finished(self):
+        """Forgets transfers that are done or were cancelled; failed ones stay so they can be retried."""
+        with self._lock:
+            self.transfers = [t for t in self.transfers if t.status not in (DONE, CANCELLED)]
+
+    @property
+    def active(self):
+        """Whether any transfer is still to run or running (paused ones included)."""
+        return any(transfer.status not in FINISHED for transfer in self.transfers)
+
+    def stats(self):
+        """Aggregate progress of every transfer that has not been cleared."""
+        with self._lock:
+            transfers = [t for t in self.transfers if t.status != CANCELLED]
+        total = sum(t.size for t in transfers)
+        done = sum(t.done for t in transfers)
+        rate = sum(t.rate for t in transfers)
+        remaining = sum(t.size - t.done for t in transfers if t.status in (QUEUED, RUNNING, PAUSED))
+        return {
+            "files": len(transfers),
+            "files_done": sum(t.status == DONE for t in transfers),
+            "failed": sum(t.status == FAILED for t in transfers),
+            "bytes": done,
+            "total": total,
+            "bytes_per_s": rate,
+            "eta": remaining / rate if rate > 0 else None,
+        }
+
+    def stop(self, timeout=None):
+        """Interrupts running transfers (their journals are kept) and waits for the workers to stop.
+
+        A transfer stops at its next progress callback, but whatever process() does
+        after the data (a rename, a thumbnail) still runs. Returns False if a worker
+        is still busy after timeout seconds; calling stop() again waits some more.
+        """
+        if not self._stopping.is_set():
+            self._stopping.set()
+            with self._lock:
+                for transfer in self.transfers:
+                    transfer._running.set()
+            for _ in self._workers:
+                self._pending.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(worker.is_alive() for worker in self._workers)
@@ -0,0 +1,308 @@
+import os
+import ctypes
+import tempfile
+import threading
+import host_profile
+
+# Cheap flash drives erase and program in large blocks, so they are fastest when
+# written in big pieces that start on a block boundary.
+ALIGNMENT = 4096
+WRITE_CHUNK = 4 * 1024 * 1024  # Default size of each write to the drive, until `bench.py usb` recommends one
+READAHEAD_BYTES = 8 * 1024 * 1024  # How far ahead of a sequential reader the kernel is asked to prefetch
+PROFILE_SECTION = "usb_io"
+
+# When data written to the drive is flushed to the device
+FSYNC_FILE = "file"  # After every file: slowest, nothing finished is ever lost
+FSYNC_BATCH = "batch"  # Once at the end of a batch of files
+FSYNC_UNMOUNT = "unmount"  # Only when the drive is unmounted
+FSYNC_POLICIES = (FSYNC_FILE, FSYNC_BATCH, FSYNC_UNMOUNT)
+FSYNC_ENV = "SECUREUSB_FSYNC"  # Environment variable that overrides the policy saved in the host profile
+
+_libc = ctypes.CDLL(None, use_errno=True)
+AT_FDCWD = -100
+AT_SYMLINK_FOLLOW = 0x400
+
+
+def write_chunk():
+    """Write size for the drive: the one `bench.py usb` recommended on this host, or WRITE_CHUNK."""
+    profile = host_profile.load(PROFILE_SECTION) or {}
+    return profile.get("write_chunk", WRITE_CHUNK)
+
+
+def fsync_policy(default=FSYNC_BATCH):
+    """The fsync policy to use: $SECUREUSB_FSYNC, else the one saved in the host profile, else default."""
+    for source, policy in (("$" + FSYNC_ENV, os.environ.get(FSYNC_ENV)),
+                           ("the host profile", (host_profile.load(PROFILE_SECTION) or {}).get("fsync_policy"))):
+        if policy in FSYNC_POLICIES:
+            return policy
+        if policy:
+            print(f"[WARN] Ignoring unknown fsync policy {policy!r} from {source}.")
+    return default
+
+
+def store_fsync_policy(policy):
+    """Saves the fsync policy for this host, next to the recommended write size."""
+    if policy not in FSYNC_POLICIES:
+        raise ValueError(f"Unknown fsync policy {policy}")
+    host_profile.store(PROFILE_SECTION, dict(host_profile.load(PROFILE_SECTION) or {}, fsync_policy=policy))
+
+
+def advise_sequential(fd):
+    """Tells the kernel a file is about to be read front to back, so it reads ahead aggressively."""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, READAHEAD_BYTES, os.POSIX_FADV_WILLNEED)
+
+
+class Readahead:
+    """Keeps a prefetch window of READAHEAD_BYTES in front of a sequential reader that uses pread."""
+
+    def __init__(self, fd, window=READAHEAD_BYTES):
+        self._fd = fd
+        self._window = window
+        self._requested = 0
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def advance(self, offset):
+        """Called before reading at offset; asks for the next window once half of the current one is used."""
+        if not hasattr(os, "posix_fadvise") or offset + self._window // 2 < self._requested:
+            return
+        start = max(offset, self._requested)
+        os.posix_fadvise(self._fd, start, offset + self._window - start, os.POSIX_FADV_WILLNEED)
+        self._requested = offset + self._window
+
+
+def syncfs(path):
+    """Flushes the whole filesystem holding path to its device, falling back to sync() where syncfs is missing."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if getattr(_libc, "syncfs", None) is None or _libc.syncfs(fd) != 0:
+            os.sync()
+    finally:
+        os.close(fd)
+
+
+class AlignedWriter:
+    """Unbuffered file writer that hands the drive large writes on ALIGNMENT boundaries.
+
+    Small writes (nonces, sealed segments, the footer) are collected in one
+    preallocated buffer of chunk_size bytes. The first write is cut short so that it
+    ends on an ALIGNMENT boundary, after which every write is a whole chunk; large
+    writes skip the buffer. It supports the subset of the file API the container
+    code and the transfer journal use.
+    """
+
+    def __init__(self, path, mode='wb', chunk_size=None):
+        self.name = path
+        self._file = open(path, mode, buffering=0)
+        self.chunk_size = chunk_size or write_chunk()
+        self._buffer = memoryview(bytearray(self.chunk_size))
+        self._filled = 0
+        self._position = self._file.tell()
+        self._limit = self._next_limit()
+
+    def _next_limit(self):
+        return self.chunk_size - self._position % ALIGNMENT
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def _write_all(self, data):
+        while data:
+            data = data[os.write(self._file.fileno(), data):]
+
+    def _drain(self):
+        if self._filled:
+            self._write_all(self._buffer[:self._filled])
+            self._position += self._filled
+            self._filled = 0
+        self._limit = self._next_limit()
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        count = len(data)
+        while data:
+            if not self._filled and len(data) >= self._limit:
+                # Nothing buffered and a whole chunk at hand: write it straight from the caller's buffer
+                self._write_all(data[:self._limit])
+                self._position += self._limit
+                data = data[self._limit:]
+                self._limit = self._next_limit()
+                continue
+            taken = min(self._limit - self._filled, len(data))
+            self._buffer[self._filled:self._filled + taken] = data[:taken]
+            self._filled += taken
+            data = data[taken:]
+            if self._filled == self._limit:
+                self._drain()
+        return count
+
+    def flush(self):
+        """Hands buffered data to the kernel; it is not durable until fsynced."""
+        self._drain()
+
+    def tell(self):
+        return self._position + self._filled
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._drain()
+        self._position = os.lseek(self._file.fileno(), offset, whence)
+        self._limit = self._next_limit()
+        return self._position
+
+    def truncate(self, size=None):
+        self._drain()
+        os.ftruncate(self._file.fileno(), self._position if size is None else size)
+
+    def close(self):
+        if not self._file.closed:
+            try:
+                self._drain()
+            finally:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SyncPolicy:
+    """Decides when files written to the drive are flushed to the device (see FSYNC_POLICIES).
+
+    With FSYNC_BATCH and FSYNC_UNMOUNT a finished file is only handed to the kernel;
+    the filesystems written to are remembered and flushed with one syncfs each by
+    batch_done() or sync(). A crash before that can lose files that looked finished,
+    so bookkeeping about them waits for the flush (see when_durable).
+    """
+
+    def __init__(self, policy=FSYNC_FILE):
+        if policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {policy}")
+        self.policy = policy
+        self._dirty = set()
+        self._waiting = []  # when_durable() callbacks for the next sync()
+        self._lock = threading.Lock()
+
+    @property
+    def per_file(self):
+        return self.policy == FSYNC_FILE
+
+    def file_written(self, f):
+        """Called when a file on the drive is complete, before it is renamed into place."""
+        f.flush()
+        if self.per_file:
+            os.fsync(f.fileno())
+        else:
+            with self._lock:
+                self._dirty.add(os.path.dirname(os.path.abspath(f.name)))
+
+    def when_durable(self, callback):
+        """Calls callback once the files written so far are on the device: now with FSYNC_FILE, else after sync()."""
+        if self.per_file:
+            callback()
+            return
+        with self._lock:
+            self._waiting.append(callback)
+
+    def batch_done(self):
+        """Called at the end of a batch of files."""
+        if self.policy == FSYNC_BATCH:
+            self.sync()
+
+    def sync(self):
+        """Flushes everything written since the last sync, e.g. right before unmounting."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            waiting, self._waiting = self._waiting, []
+        try:
+            for directory in dirty:
+                if os.path.isdir(directory):
+                    syncfs(directory)
+        except BaseException:
+            with self._lock:
+                self._dirty |= dirty
+                self._waiting = waiting + self._waiting
+            raise
+        for callback in waiting:
+            callback()
+
+
+def fsync_dir(directory):
+    """Makes entries created, renamed or removed in directory durable."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _link_fd(fd, path):
+    """Gives the file open as fd (e.g. an O_TMPFILE) the name path.
+
+    os.link() calls link(), which would link the /proc symlink itself, so linkat()
+    with AT_SYMLINK_FOLLOW is called directly.
+    """
+    if _libc.linkat(AT_FDCWD, f"/proc/self/fd/{fd}".encode(), AT_FDCWD, os.fsencode(path), AT_SYMLINK_FOLLOW) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+
+
+class AtomicOutput:
+    """File that appears at destination complete or not at all, written in destination's directory.
+
+    Where the filesystem supports it, the data goes into an unnamed O_TMPFILE that
+    is only linked into place by commit(), so an interrupted write leaves nothing
+    behind: the kernel frees the file when it is closed. Elsewhere a hidden named
+    file is renamed into place instead and removed by discard().
+    """
+
+    def __init__(self, destination):
+        self.destination = destination
+        directory = os.path.dirname(os.path.abspath(destination))
+        self.temp_path = None
+        try:
+            fd = os.open(directory, os.O_TMPFILE | os.O_WRONLY, 0o600)
+        except (AttributeError, OSError):
+            fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(destination) + ".",
+                                                  suffix=".part")
+        self.file = os.fdopen(fd, 'wb')
+
+    @property
+    def named(self):
+        """Whether the fallback named file is in use (it survives a crash)."""
+        return self.temp_path is not None
+
+    def commit(self):
+        """Makes the data durable and puts the file at destination, replacing what was there."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.temp_path is None:
+            # linkat() through /proc gives the unnamed file a name; it cannot overwrite, so link then rename
+            directory = os.path.dirname(os.path.abspath(self.destination))
+            self.temp_path = os.path.join(directory, f".{os.path.basename(self.destination)}.{os.urandom(4).hex()}")
+            _link_fd(self.file.fileno(), self.temp_path)
+        self.file.close()
+        os.replace(self.temp_path, self.destination)
+        self.temp_path = None
+
+    def discard(self):
+        self.file.close()
+        if self.temp_path is not None and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+            self.temp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.discard()
+            return
+        try:
+            self.commit()
+        except BaseException:
+            self.discard()
+            raise